@@ -1,7 +1,7 @@
 import os
+import re
 import sys
 import math
-import h5py
 
 
 import numpy as np
@@ -30,6 +30,13 @@ class MetaData:
         self.nxblocks = -1
         # place to save the hole filled segmentations
         self.hole_filling_output_directory = None
+        # how the connected components are kept between the hole filling steps
+        self.hole_filling_components = 'full'
+        # later per-block steps computed from the filled block before it leaves memory
+        self.hole_filling_post_fill = ()
+        # codec and chunk shape of the hdf5 blocks written by the pipeline
+        self.h5_compression = 'gzip'
+        self.h5_chunk_size = None
         self.synapse_path = None
         self.somata_path = None
         self.surfaces_path = None
@@ -99,6 +106,12 @@ class MetaData:
                     self.max_label = int(value)
                 elif comment == '# somata downsample rate':
                     self.somata_downsample_rate = int(value)
+                elif comment == '# hdf5 compression (gzip, gzip-level, lz4, zstd, none)':
+                    self.h5_compression = value
+                elif comment == '# hdf5 chunk size (x, y, z)':
+                    h5_chunk_size = value.split('x')
+                    # use order 2, 1, 0 to convert from xyz to zyx
+                    self.h5_chunk_size = (int(h5_chunk_size[2]), int(h5_chunk_size[1]), int(h5_chunk_size[0]))
 
                 ##########################
                 ### OUTPUT DIRECTORIES ###
@@ -108,6 +121,12 @@ class MetaData:
                     self.tmp_directory = value
                 elif comment == '# hole filling output directory':
                     self.hole_filling_output_directory = value
+                elif comment == '# hole filling components (full, runlength, recompute)':
+                    self.hole_filling_components = value
+                elif comment == '# hole filling post fill (walls, surfaces, statistics)':
+                    # none disables the post fill steps
+                    if not value == 'none':
+                        self.hole_filling_post_fill = tuple(step.strip() for step in value.split(','))
 
                 elif comment == '# skeleton output directory':
                     self.skeleton_output_directory = value
@@ -150,6 +169,21 @@ class MetaData:
         if self.somata_downsample_rate:
             assert (not self.somata_path == None)
 
+        # make sure the hole filling components are stored in a known way
+        assert (self.hole_filling_components in ['full', 'runlength', 'recompute'])
+
+        # the post fill steps require hole filling
+        for step in self.hole_filling_post_fill:
+            assert (step in ['walls', 'surfaces', 'statistics'])
+        if len(self.hole_filling_post_fill):
+            assert (not self.hole_filling_output_directory == None)
+
+        # make sure the hdf5 codec is known and available
+        assert (self.h5_compression in ['gzip', 'lz4', 'zstd', 'none'] or re.fullmatch('gzip-[0-9]', self.h5_compression))
+        # dataIO imports this module so the helper is imported here
+        from blockbased_synapseaware.utilities.dataIO import H5CompressionAvailable
+        assert (H5CompressionAvailable(self.h5_compression))
+
         # if there will be figures, make sure there is a description
         if not self.figures_directory == None:
             assert (not self.figure_description == None)
@@ -264,13 +298,10 @@ class MetaData:
 
 
 
-    def ReadRawSegmentationBlock(self, iz, iy, ix):
+    def ReadRawSegmentationBlock(self, iz, iy, ix, window = None):
         filename = '{}/{:04d}z-{:04d}y-{:04d}x.h5'.format(self.raw_segmentation_path, iz, iy, ix)
 
-        with h5py.File(filename, 'r') as hf:
-            data = np.array(hf[list(hf.keys())[0]])
-
-        return data
+        return self.ReadH5Block(filename, window)
 
 
 
@@ -289,6 +320,11 @@ class MetaData:
 
 
 
+    def RawSegmentationDirectory(self):
+        return self.raw_segmentation_path
+
+
+
     def SomataDirectory(self):
         return self.somata_path
 
@@ -308,6 +344,26 @@ class MetaData:
 
 
 
+    def HoleFillingComponents(self):
+        return self.hole_filling_components
+
+
+
+    def HoleFillingPostFill(self):
+        return self.hole_filling_post_fill
+
+
+
+    def H5Compression(self):
+        return self.h5_compression
+
+
+
+    def H5ChunkSize(self):
+        return self.h5_chunk_size
+
+
+
     def SkeletonOutputDirectory(self):
         return self.skeleton_output_directory
 
@@ -348,31 +404,52 @@ class MetaData:
 
 
 
-    def ReadSegmentationBlock(self, iz, iy, ix):
+    def ReadH5Block(self, filename, window = None):
+        # dataIO imports this module so the reader is imported here
+        from blockbased_synapseaware.utilities.dataIO import ReadH5File
+
+        # read either the entire block or only the chunks that overlap the window (a tuple of slices)
+        return ReadH5File(filename, window)
+
+
+
+    def ReadSegmentationBlock(self, iz, iy, ix, window = None):
         # if there was no hole filling computed, read the raw segmentation data
         if self.hole_filling_output_directory == None:
-            return self.ReadRawSegmentationBlock(iz, iy, ix)
+            return self.ReadRawSegmentationBlock(iz, iy, ix, window)
         # otherwise read in the hole filled output
         filename = '{}/{:04d}z-{:04d}y-{:04d}x.h5'.format(self.hole_filling_output_directory, iz, iy, ix)
 
-        with h5py.File(filename, 'r') as hf:
-            data = np.array(hf[list(hf.keys())[0]])
+        return self.ReadH5Block(filename, window)
 
-        return data
 
 
+    def WallWindow(self, axis, side):
+        # make sure the wall is recognized
+        assert (axis == 'z' or axis == 'y' or axis == 'x')
+        assert (side == 'min' or side == 'max')
 
-    def ReadSomataBlock(self, iz, iy, ix):
+        # the wall is the first or last slice along this axis
+        index = 0 if side == 'min' else -1
+
+        return tuple(index if dimension == axis else slice(None) for dimension in ['z', 'y', 'x'])
+
+
+
+    def ReadSegmentationWall(self, iz, iy, ix, axis, side):
+        # read only the first or last slice along this axis
+        return self.ReadSegmentationBlock(iz, iy, ix, self.WallWindow(axis, side))
+
+
+
+    def ReadSomataBlock(self, iz, iy, ix, window = None):
         # return no soma if it does not exist
         if self.somata_path == None:
             return None
-        # otherwise read in the soma file
+        # otherwise read in the soma file (the window is in downsampled coordinates)
         filename = '{}/{:04d}z-{:04d}y-{:04d}x.h5'.format(self.somata_path, iz, iy, ix)
 
-        with h5py.File(filename, 'r') as hf:
-            data = np.array(hf[list(hf.keys())[0]])
-
-        return data
+        return self.ReadH5Block(filename, window)
 
 
 
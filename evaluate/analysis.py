@@ -13,11 +13,17 @@ from matplotlib import pyplot as plt
 
 
 
-from blockbased_synapseaware.utilities.dataIO import PickleData, ReadAttributePtsFile, ReadMetaData, ReadPickledData, ReadPtsFile
+from blockbased_synapseaware.utilities.dataIO import PickleData, ReadAssociatedLabels, ReadAttributePtsFile, ReadLabelMapping, ReadMetaData, ReadPickledData, ReadPtsFile
+from blockbased_synapseaware.utilities.scheduler import IterateTasks
 from blockbased_synapseaware.utilities.constants import *
 
 
 
+# the columns of the geodesic distance results and their types
+GEODESIC_DISTANCES_COLUMNS = { 'labels': np.int64, 'diffs': np.float64, 'euclideans': np.float64, 'geodesics': np.float64 }
+
+
+
 def EvaluateHoleFilling(meta_filename):
     data = ReadMetaData(meta_filename)
 
@@ -28,6 +34,8 @@ def EvaluateHoleFilling(meta_filename):
 
     neighbor_label_dicts = {}
 
+    associated_label_dict = {}
+
     # read in the hole sizes from each block
     for iz in range(data.StartZ(), data.EndZ()):
         for iy in range(data.StartY(), data.EndY()):
@@ -42,17 +50,21 @@ def EvaluateHoleFilling(meta_filename):
                 for label in holes_sizes_per_block:
                     hole_sizes[label] = holes_sizes_per_block[label]
 
+                # read the associated labels of every background component in this block
+                block_associated_labels = ReadAssociatedLabels(data, iz, iy, ix)
+                background_start_label = -1 - (data.IndexFromIndices(iz, iy, ix) * data.BlockVolume())
+                for offset, associated_label in enumerate(block_associated_labels.tolist()):
+                    associated_label_dict[background_start_label - offset] = associated_label
+
                 # any value already determined in the local step mush have no neighbors
-                associated_label_dict = ReadPickledData('{}/associated-label-set-local.pickle'.format(tmp_block_directory))
-                for label in associated_label_dict:
+                associated_labels, _ = ReadLabelMapping('{}/associated-labels-local.npz'.format(tmp_block_directory))
+                for label in associated_labels.tolist():
                     neighbor_label_dicts[label] = []
 
     # read in the neighbor label dictionary that maps values to its neighbors
     tmp_directory = data.TempDirectory()
     neighbor_label_filename = '{}/hole-filling-neighbor-label-dict-global.pickle'.format(tmp_directory)
     neighbor_label_dict_global = ReadPickledData(neighbor_label_filename)
-    associated_label_filename = '{}/hole-filling-associated-labels.pickle'.format(tmp_directory)
-    associated_label_dict = ReadPickledData(associated_label_filename)
 
     # make sure that the keys are identical for hole sizes and associated labels (sanity check)
     assert (sorted(hole_sizes.keys()) == sorted(associated_label_dict.keys()))
@@ -184,12 +196,12 @@ def EvaluateSkeletons(meta_filename):
         # skip files that do not exist (no synapses, e.g.)
         if not os.path.exists(thinning_filename): continue
 
-        thinned_skeletons_global_pts, _ = ReadPtsFile(data, thinning_filename)
+        thinned_skeletons_global_pts, _ = ReadPtsFile(data, thinning_filename, label = label)
         thinned_skeletons = thinned_skeletons_global_pts[label]
 
         refined_filename = '{}/skeletons/{:016d}.pts'.format(data.SkeletonOutputDirectory(), label)
 
-        refined_skeletons_global_pts, _ = ReadPtsFile(data, refined_filename)
+        refined_skeletons_global_pts, _ = ReadPtsFile(data, refined_filename, label = label)
         refined_skeletons = refined_skeletons_global_pts[label]
 
         # get the volume and total remaining voxels
@@ -365,7 +377,7 @@ def EvaluateNeuralReconstructionIntegrity(meta_filename):
                     if not label in synapses_per_label:
                         synapses_per_label[label] = []
 
-                    synapses_per_label[label] += block_synapses[label]
+                    synapses_per_label[label] += block_synapses[label].tolist()
 
     # get the output filename
     evaluation_directory = data.EvaluationDirectory()
@@ -393,7 +405,7 @@ def EvaluateNeuralReconstructionIntegrity(meta_filename):
         synapses = synapses_per_label[label]
 
         # ignore the local coordinates
-        skeletons, _ = ReadPtsFile(data, skeleton_filename)
+        skeletons, _ = ReadPtsFile(data, skeleton_filename, label = label)
         skeleton = skeletons[label]
 
         # read in the somata surfaces (points on the surface should not count as endpoints)
@@ -402,7 +414,7 @@ def EvaluateNeuralReconstructionIntegrity(meta_filename):
 
         # path may not exist if soma not found
         if os.path.exists(somata_filename):
-            somata_surfaces, _ = ReadPtsFile(data, somata_filename)
+            somata_surfaces, _ = ReadPtsFile(data, somata_filename, label = label)
             somata_surface = set(somata_surfaces[label])
         else:
             somata_surface = set()
@@ -458,10 +470,17 @@ def EvaluateNeuralReconstructionIntegrity(meta_filename):
 
 
 
-def EvaluateWidths(data, label):
-    # get the resolution of this data
+def PointCloud(data, global_indices):
+    # get the location of every global index in nanometers
     resolution = data.Resolution()
 
+    iz, iy, ix = data.GlobalIndexToIndices(np.asarray(global_indices, dtype=np.int64))
+
+    return np.stack((resolution[OR_Z] * iz, resolution[OR_Y] * iy, resolution[OR_X] * ix), axis=1).astype(np.float32)
+
+
+
+def EvaluateWidths(data, label, workers = -1):
     # read the width attributes filename
     widths_directory = '{}/widths'.format(data.SkeletonOutputDirectory())
     width_filename = '{}/{:016d}.pts'.format(widths_directory, label)
@@ -477,44 +496,27 @@ def EvaluateWidths(data, label):
     surfaces_filename = '{}/{:016d}.pts'.format(data.SurfacesDirectory(), label)
 
     # read the surfaces, ignore local coordinates
-    surfaces, _ = ReadPtsFile(data, surfaces_filename)
+    surfaces, _ = ReadPtsFile(data, surfaces_filename, label = label)
     surface = surfaces[label]
-    npoints = len(surface)
 
     # convert the surface into a numpy point cloud
-    np_point_cloud = np.zeros((npoints, 3), dtype=np.float32)
-    for index, iv in enumerate(surface):
-        # convert the index into indices
-        iz, iy, ix = data.GlobalIndexToIndices(iv)
+    np_point_cloud = PointCloud(data, surface)
 
-        # set the point cloud value according to the resolutions
-        np_point_cloud[index,:] = (resolution[OR_Z] * iz, resolution[OR_Y] * iy, resolution[OR_X] * ix)
+    # get the estimated width and location of every skeleton point
+    skeleton = np.array(list(widths.keys()), dtype=np.int64)
+    estimated_widths = np.array(list(widths.values()), dtype=np.float64)
+
+    # get the min distance from every skeleton point to the surface (true width) at once
+    surface_tree = scipy.spatial.cKDTree(np_point_cloud)
+    min_distances, _ = surface_tree.query(PointCloud(data, skeleton), workers=workers)
 
     # create empty dictionary for all results
     results = {}
 
     # keep track of all errors for this label
-    results['errors'] = []
-    results['estimates'] = 0
-    results['ground_truths'] = 0
-
-    # iterate over all skeleton points
-    for iv in widths.keys():
-        # get the estimated width at this location
-        width = widths[iv]
-
-        iz, iy, ix = data.GlobalIndexToIndices(iv)
-
-        # convert the coordinates into a 2d vector with the resolutions
-        vec = np.zeros((1, 3), dtype=np.float32)
-        vec[0,:] = (resolution[OR_Z] * iz, resolution[OR_Y] * iy, resolution[OR_X] * ix)
-
-        # get the min distance from this point to the surface (true width)
-        min_distance = scipy.spatial.distance.cdist(np_point_cloud, vec).min()
-
-        results['errors'].append(abs(width - min_distance))
-        results['estimates'] += width
-        results['ground_truths'] += min_distance
+    results['errors'] = np.abs(estimated_widths - min_distances).tolist()
+    results['estimates'] = np.sum(estimated_widths)
+    results['ground_truths'] = np.sum(min_distances)
 
     # skip over vacuous skeletons
     if len(results['errors']) < 2: return
@@ -585,27 +587,24 @@ def CombineEvaluatedWidths(data):
 
 
 
-def EvaluateWidthsSequentially(meta_filename):
+def EvaluateWidthsSequentially(meta_filename, workers = -1):
     data = ReadMetaData(meta_filename)
 
     # iterate over all labels and generate width statistics
     for label in range(1, data.NLabels()):
-        EvaluateWidths(data, label)
+        EvaluateWidths(data, label, workers)
 
     CombineEvaluatedWidths(data)
 
 
 
-def EvaluateGeodesicDistances(data, label):
-    # get the resolution of this data
-    resolution = data.Resolution()
-
+def EvaluateGeodesicDistances(data, label, workers = -1):
     # read the distance attributes filename
     distances_directory = '{}/distances'.format(data.SkeletonOutputDirectory())
     distance_filename = '{}/{:016d}.pts'.format(distances_directory, label)
 
     # skip over labels not processed
-    if not os.path.exists(distance_filename): return
+    if not os.path.exists(distance_filename): return None
 
     # read the distance attributes
     distances, input_label = ReadAttributePtsFile(data, distance_filename)
@@ -613,134 +612,163 @@ def EvaluateGeodesicDistances(data, label):
 
     # get the synapses filename
     synapses_filename = '{}/synapses/{:016d}.pts'.format(data.TempDirectory(), label)
-    if not os.path.exists(synapses_filename): return
+    if not os.path.exists(synapses_filename): return None
 
-    synapses, _ = ReadPtsFile(data, synapses_filename)
+    synapses, _ = ReadPtsFile(data, synapses_filename, label = label)
     synapses = synapses[label]
 
     # get the somata surface filename
     somata_surface_filename = '{}/somata_surfaces/{:016d}.pts'.format(data.TempDirectory(), label)
-    if not os.path.exists(somata_surface_filename): return
+    if not os.path.exists(somata_surface_filename): return None
 
-    somata_surfaces, _ = ReadPtsFile(data, somata_surface_filename)
+    somata_surfaces, _ = ReadPtsFile(data, somata_surface_filename, label = label)
     somata_surface = somata_surfaces[label]
-    npoints = len(somata_surface)
+
+    # if there are no points return the empty set
+    if not len(somata_surface): return None
 
     # convert the somata surfaces into a numpy point cloud
-    np_point_cloud = np.zeros((npoints, 3), dtype=np.float32)
-    for index, iv in enumerate(somata_surface):
-        # convert the index into indices
-        iz, iy, ix = data.GlobalIndexToIndices(iv)
+    np_point_cloud = PointCloud(data, somata_surface)
 
-        # set the piont cloud value according to the resolution
-        np_point_cloud[index,:] = (resolution[OR_Z] * iz, resolution[OR_Y] * iy, resolution[OR_X] * ix)
+    # get the estimated distance at every synapse point
+    geodesics = np.array([distances[iv] for iv in synapses.tolist()], dtype=np.float64)
 
-    # create empty dictionary for all results
+    # get the min distance from every synapse to the surface (euclidean distance) at once
+    surface_tree = scipy.spatial.cKDTree(np_point_cloud)
+    euclideans, _ = surface_tree.query(PointCloud(data, synapses), workers=workers)
+
+    # geodesic distances could be less than euclidean only when the synapse is on the cell body
+    # surface but downsampling causes a disconnect between the assumed surface and the cell
+    # body surface. skip these trivial points
+    valid = ~(geodesics < euclideans)
+    geodesics = geodesics[valid]
+    euclideans = euclideans[valid]
+
+    if geodesics.size < 2: return None
+
+    # create dictionary with one entry per synapse for all results
     results = {}
+    results['diffs'] = np.abs(geodesics - euclideans)
+    results['euclideans'] = euclideans
+    results['geodesics'] = geodesics
 
-    # keep track of all errors for this label
-    results['diffs'] = []
-    results['euclidean'] = 0
-    results['geodesic'] = 0
+    return results
 
-    # if there are no points return the empty set
-    if not npoints: return
 
-    for iv in synapses:
-        # get the estimated distance at this synapse point
-        distance = distances[iv]
 
-        iz, iy, ix = data.GlobalIndexToIndices(iv)
+def GeodesicDistancesFilenames(data):
+    # the columnar results have one raw file per column with a row per synapse
+    tmp_results_directory = '{}/results/geodesic-distances'.format(data.TempDirectory())
 
-        # convert the coordinates into a 2d vector with the resolutions
-        vec = np.zeros((1, 3), dtype=np.float32)
-        vec[0,:] = (resolution[OR_Z] * iz, resolution[OR_Y] * iy, resolution[OR_X] * ix)
+    return { column: '{}/{}.bin'.format(tmp_results_directory, column) for column in GEODESIC_DISTANCES_COLUMNS }
 
-        # get the min distance from this point to the surface (euclidean distance)
-        euclidean_distance = scipy.spatial.distance.cdist(np_point_cloud, vec).min()
 
-        # geodesic distances could be less than euclidean only when the synapse is on the cell body
-        # surface but downsampling causes a disconnect between the assumed surface and the cell
-        # body surface. skip these trivial points
-        if (distance < euclidean_distance): continue
 
-        results['diffs'].append(abs(distance - euclidean_distance))
-        results['euclidean'] += euclidean_distance
-        results['geodesic'] += distance
+def WriteGeodesicDistances(data, labels, label_results):
+    filenames = GeodesicDistancesFilenames(data)
 
-    if len(results['diffs']) < 2: return
+    tmp_results_directory = os.path.dirname(filenames['labels'])
+    if not os.path.exists(tmp_results_directory):
+        os.makedirs(tmp_results_directory, exist_ok=True)
 
-    # output the differences, euclidean, and geodesic distances
-    tmp_distances_directory = '{}/results/distances'.format(data.TempDirectory())
-    if not os.path.exists(tmp_distances_directory):
-        os.makedirs(tmp_distances_directory, exist_ok=True)
+    fds = { column: open(filename, 'wb') for column, filename in filenames.items() }
 
-    output_filename = '{}/{:016d}.pickle'.format(tmp_distances_directory, label)
-    PickleData(results, output_filename)
+    # append the results of every label to the columns as they arrive
+    for label, results in zip(labels, label_results):
+        # skip over labels without results
+        if results == None: continue
 
+        np.full(results['diffs'].size, label, dtype=GEODESIC_DISTANCES_COLUMNS['labels']).tofile(fds['labels'])
+        for column in ['diffs', 'euclideans', 'geodesics']:
+            results[column].astype(GEODESIC_DISTANCES_COLUMNS[column]).tofile(fds[column])
+
+    for fd in fds.values():
+        fd.close()
 
 
-def CombineGeodesicDistances(data):
-    diffs = []
-    euclideans = 0
-    geodesics = 0
 
+def CombineGeodesicDistances(data):
     # get the output filename
     evaluation_directory = data.EvaluationDirectory()
     if not os.path.exists(evaluation_directory):
         os.makedirs(evaluation_directory, exist_ok=True)
 
     output_filename = '{}/distance-results.txt'.format(evaluation_directory)
-    fd = open(output_filename, 'w')
 
-    for label in range(1, data.NLabels()):
-        # read the generated distances
-        tmp_distances_directory = '{}/results/distances'.format(data.TempDirectory())
-        distances_filename = '{}/{:016d}.pickle'.format(tmp_distances_directory, label)
+    # read the distances of every synapse in label order
+    filenames = GeodesicDistancesFilenames(data)
+    labels, diffs, euclideans, geodesics = (np.fromfile(filenames[column], dtype=dtype) for column, dtype in GEODESIC_DISTANCES_COLUMNS.items())
 
-        # skip over files that do not exist
-        if not os.path.exists(distances_filename): continue
+    # the standard deviations need at least two synapses overall and for every label
+    if diffs.size < 2:
+        raise statistics.StatisticsError('geodesic distances exist for {} synapses but at least two are required'.format(diffs.size))
+
+    # get the per label statistics from the contiguous rows of every label
+    unique_labels, starts, counts = np.unique(labels, return_index=True, return_counts=True)
+
+    if np.any(counts < 2):
+        raise statistics.StatisticsError('geodesic distances exist for only one synapse of label {}'.format(unique_labels[counts < 2][0]))
+
+    fd = open(output_filename, 'w')
+
+    means = np.add.reduceat(diffs, starts) / counts
+    stddevs = np.sqrt(np.add.reduceat((diffs - np.repeat(means, counts)) ** 2, starts) / (counts - 1))
+    label_euclideans = np.add.reduceat(euclideans, starts)
+    label_geodesics = np.add.reduceat(geodesics, starts)
 
-        results = ReadPickledData(distances_filename)
+    for index, label in enumerate(unique_labels.tolist()):
+        mean, stddev, euclidean, geodesic = means[index], stddevs[index], label_euclideans[index], label_geodesics[index]
 
-        # output the results and update the average distances
+        # output the results for this label
         print ('Label: {}'.format(label))
-        print ('  Mean Absolute Difference: {:0.4f} (\u00B1{:0.2f}) nanometers'.format(statistics.mean(results['diffs']), statistics.stdev(results['diffs'])))
-        print ('  Euclidean Distances: {:0.4f}'.format(results['euclidean']))
-        print ('  Geodesic Distances: {:0.4f}'.format(results['geodesic']))
-        print ('  Difference: {:0.4f}%'.format(100.0 * (results['geodesic'] - results['euclidean']) / results['euclidean']))
+        print ('  Mean Absolute Difference: {:0.4f} (\u00B1{:0.2f}) nanometers'.format(mean, stddev))
+        print ('  Euclidean Distances: {:0.4f}'.format(euclidean))
+        print ('  Geodesic Distances: {:0.4f}'.format(geodesic))
+        print ('  Difference: {:0.4f}%'.format(100.0 * (geodesic - euclidean) / euclidean))
 
         fd.write ('Label: {}\n'.format(label))
-        fd.write ('  Mean Absolute Difference: {:0.4f} (\u00B1{:0.2f}) nanometers\n'.format(statistics.mean(results['diffs']), statistics.stdev(results['diffs'])))
-        fd.write ('  Euclidean Distances: {:0.4f}\n'.format(results['euclidean']))
-        fd.write ('  Geodesic Distances: {:0.4f}\n'.format(results['geodesic']))
-        fd.write ('  Difference: {:0.4f}%\n'.format(100.0 * (results['geodesic'] - results['euclidean']) / results['euclidean']))
+        fd.write ('  Mean Absolute Difference: {:0.4f} (\u00B1{:0.2f}) nanometers\n'.format(mean, stddev))
+        fd.write ('  Euclidean Distances: {:0.4f}\n'.format(euclidean))
+        fd.write ('  Geodesic Distances: {:0.4f}\n'.format(geodesic))
+        fd.write ('  Difference: {:0.4f}%\n'.format(100.0 * (geodesic - euclidean) / euclidean))
 
-        # update global information
-        diffs += results['diffs']
-        euclideans += results['euclidean']
-        geodesics += results['geodesic']
+    mean, stddev = np.mean(diffs), np.std(diffs, ddof=1)
+    euclidean, geodesic = np.sum(euclideans), np.sum(geodesics)
 
     print ('Total Volume')
-    print ('  Mean Absolute Difference: {:0.4f} (\u00B1{:0.2f}) nanometers'.format(statistics.mean(diffs), statistics.stdev(diffs)))
-    print ('  Euclidean Distances: {:0.4f}'.format(euclideans))
-    print ('  Geodesic Distances: {:0.4f}'.format(geodesics))
-    print ('  Difference: {:0.4f}%'.format(100.0 * (geodesics - euclideans) / euclideans))
+    print ('  Mean Absolute Difference: {:0.4f} (\u00B1{:0.2f}) nanometers'.format(mean, stddev))
+    print ('  Euclidean Distances: {:0.4f}'.format(euclidean))
+    print ('  Geodesic Distances: {:0.4f}'.format(geodesic))
+    print ('  Difference: {:0.4f}%'.format(100.0 * (geodesic - euclidean) / euclidean))
 
     fd.write ('Total Volume\n')
-    fd.write ('  Mean Absolute Difference: {:0.4f} (\u00B1{:0.2f}) nanometers\n'.format(statistics.mean(diffs), statistics.stdev(diffs)))
-    fd.write ('  Euclidean Distances: {:0.4f}\n'.format(euclideans))
-    fd.write ('  Geodesic Distances: {:0.4f}\n'.format(geodesics))
-    fd.write ('  Difference: {:0.4f}%\n'.format(100.0 * (geodesics - euclideans) / euclideans))
+    fd.write ('  Mean Absolute Difference: {:0.4f} (\u00B1{:0.2f}) nanometers\n'.format(mean, stddev))
+    fd.write ('  Euclidean Distances: {:0.4f}\n'.format(euclidean))
+    fd.write ('  Geodesic Distances: {:0.4f}\n'.format(geodesic))
+    fd.write ('  Difference: {:0.4f}%\n'.format(100.0 * (geodesic - euclidean) / euclidean))
 
+    fd.close()
 
 
 
-def EvaluateGeodesicDistancesSequentially(meta_filename):
+def EvaluateGeodesicDistancesSequentially(meta_filename, workers = -1):
     data = ReadMetaData(meta_filename)
 
     # iterate over all labels and generate geodesic statistics
-    for label in range(1, data.NLabels()):
-        EvaluateGeodesicDistances(data, label)
+    labels = list(range(1, data.NLabels()))
+    label_results = (EvaluateGeodesicDistances(data, label, workers) for label in labels)
+
+    WriteGeodesicDistances(data, labels, label_results)
+    CombineGeodesicDistances(data)
+
+
+
+def EvaluateGeodesicDistancesInParallel(meta_filename, nprocesses=None):
+    data = ReadMetaData(meta_filename)
+
+    # evaluate all labels in parallel with one thread for each nearest neighbor query
+    labels = list(range(1, data.NLabels()))
+    label_results = IterateTasks(meta_filename, EvaluateGeodesicDistances, [(label, 1) for label in labels], nprocesses)
 
+    WriteGeodesicDistances(data, labels, label_results)
     CombineGeodesicDistances(data)
@@ -32,7 +32,7 @@ def BlockStatistics(seg):
 
 
 
-def CalculatePerBlockStatistics(data, iz, iy, ix):
+def CalculatePerBlockStatistics(data, iz, iy, ix, raw_seg = None, seg = None):
     # start timing statistics
     total_time = time.time()
 
@@ -41,12 +41,12 @@ def CalculatePerBlockStatistics(data, iz, iy, ix):
     if not os.path.exists(statistics_directory):
         os.makedirs(statistics_directory, exist_ok=True)
 
-    # calculate raw block statistics
-    raw_seg = data.ReadRawSegmentationBlock(iz, iy, ix)
+    # calculate raw block statistics (read the blocks only if they are not already in memory)
+    if raw_seg is None: raw_seg = data.ReadRawSegmentationBlock(iz, iy, ix)
     raw_n_non_zero, raw_nlabels, raw_voxel_counts = BlockStatistics(raw_seg)
     del raw_seg
     # calculate filled block statistics
-    seg = data.ReadSegmentationBlock(iz, iy, ix)
+    if seg is None: seg = data.ReadSegmentationBlock(iz, iy, ix)
     filled_n_non_zero, filled_nlabels, filled_voxel_counts = BlockStatistics(seg)
     del seg
 
@@ -146,11 +146,12 @@ def CombineStatistics(data):
 def CalculateBlockStatisticsSequentially(meta_filename):
     data = ReadMetaData(meta_filename)
 
-    # iterate over all blocks
-    for iz in range(data.StartZ(), data.EndZ()):
-        for iy in range(data.StartY(), data.EndY()):
-            for ix in range(data.StartX(), data.EndX()):
-                CalculatePerBlockStatistics(data, iz, iy, ix)
+    # iterate over all blocks unless hole filling already wrote the statistics
+    if not 'statistics' in data.HoleFillingPostFill():
+        for iz in range(data.StartZ(), data.EndZ()):
+            for iy in range(data.StartY(), data.EndY()):
+                for ix in range(data.StartX(), data.EndX()):
+                    CalculatePerBlockStatistics(data, iz, iy, ix)
                 
     CombineStatistics(data)
 
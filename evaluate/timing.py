@@ -256,6 +256,7 @@ def SkeletonRefinement(data, wfd):
 
     refinement_times = []
     updated_widths_times = []
+    graph_times = []
     total_times = {}
 
     for label in range(1, data.NLabels()):
@@ -265,6 +266,7 @@ def SkeletonRefinement(data, wfd):
         with open(timing_filename, 'r') as rfd:
             refinement_times.append(ParseLine(rfd.readline()))
             updated_widths_times.append(ParseLine(rfd.readline()))
+            graph_times.append(ParseLine(rfd.readline()))
             total_times[label] = ParseLine(rfd.readline())
 
     print ('Skeleton Refinement')
@@ -272,6 +274,7 @@ def SkeletonRefinement(data, wfd):
 
     PrintStatistics('Refinement Time', refinement_times, wfd)
     PrintStatistics('Update Widths Time', updated_widths_times, wfd)
+    PrintStatistics('Graph Time', graph_times, wfd)
     PrintStatistics('Total Time', total_times.values(), wfd)
 
     return total_times
@@ -14,7 +14,7 @@ from numba.typed import Dict
 
 
 from blockbased_synapseaware.hole_filling.connected_components.cc3d import connected_components
-from blockbased_synapseaware.utilities.dataIO import PickleData, PickleNumbaData, WriteH5File
+from blockbased_synapseaware.utilities.dataIO import PickleData, ReadH5File, WriteEdgeArray, WriteH5File, WriteLabelMapping
 from blockbased_synapseaware.utilities.constants import *
 
 
@@ -27,120 +27,243 @@ def ComputeConnected6Components(seg, background_start_label):
 
 
 
+def ReadPaddedSegmentationBlock(data, iz, iy, ix):
+    seg = data.ReadRawSegmentationBlock(iz, iy, ix)
+
+    # make sure the block is not larger than mentioned in param file
+    assert (seg.shape[OR_Z] <= data.BlockZLength())
+    assert (seg.shape[OR_Y] <= data.BlockYLength())
+    assert (seg.shape[OR_X] <= data.BlockXLength())
+
+    # pad the block with zeroes at the ends
+    if seg.shape[OR_Z] < data.BlockZLength() or seg.shape[OR_Y] < data.BlockYLength() or seg.shape[OR_X] < data.BlockXLength():
+        # make sure that the block is on one of the far edges
+        assert (iz == data.EndZ() - 1 or iy == data.EndY() - 1 or ix == data.EndX() - 1)
+
+        zpadding = data.BlockZLength() - seg.shape[OR_Z]
+        ypadding = data.BlockYLength() - seg.shape[OR_Y]
+        xpadding = data.BlockXLength() - seg.shape[OR_X]
+
+        # padding only goes at the far edges of the block
+        seg = np.pad(seg, ((0, zpadding), (0, ypadding), (0, xpadding)), 'constant', constant_values = 0)
+
+        # make sure the block is not smaller than mentioned in param file
+        assert (seg.shape[OR_Z] == data.BlockZLength())
+        assert (seg.shape[OR_Y] == data.BlockYLength())
+        assert (seg.shape[OR_X] == data.BlockXLength())
+
+    return seg
+
+
+
+def WriteComponentsBlock(data, seg, components, tmp_directory):
+    # write all of the components
+    if data.HoleFillingComponents() == 'full':
+        WriteH5File(components, '{}/components.h5'.format(tmp_directory), compression = data.H5Compression(), chunks = data.H5ChunkSize())
+    # write the background components as runs in the order of the background voxels of the segmentation
+    elif data.HoleFillingComponents() == 'runlength':
+        background_components = components[seg == 0]
+
+        # a new run starts at the first voxel and wherever the component changes
+        starts = np.flatnonzero(np.diff(background_components, prepend=background_components[:1] - 1))
+        lengths = np.diff(starts, append=background_components.size)
+
+        np.savez('{}/components-runlength.npz'.format(tmp_directory), values=background_components[starts], lengths=lengths)
+    # otherwise the components are recomputed when removing holes
+
+
+
+def ReadComponentsBlock(data, iz, iy, ix):
+    tmp_directory = data.TempBlockDirectory(iz, iy, ix)
+
+    # read all of the components
+    if data.HoleFillingComponents() == 'full':
+        return ReadH5File('{}/components.h5'.format(tmp_directory))
+
+    seg = ReadPaddedSegmentationBlock(data, iz, iy, ix)
+
+    # decode the background components into the background voxels of the segmentation
+    if data.HoleFillingComponents() == 'runlength':
+        with np.load('{}/components-runlength.npz'.format(tmp_directory)) as runs:
+            background_components = np.repeat(runs['values'], runs['lengths'])
+
+        components = seg.astype(np.int64)
+        components[seg == 0] = background_components
+
+        return components
+    # rerun the deterministic connected components with the same start label
+    else:
+        background_start_label = -1 - (data.IndexFromIndices(iz, iy, ix) * data.BlockVolume())
+
+        return ComputeConnected6Components(seg, background_start_label)
+
+
+
+# the components of a block fit in 32 bits after the background components are moved above this value
+NARROW_BACKGROUND = 2 ** 31
+# the second half of a key for components that touch the local border
+NARROW_BORDER_CONTACT = 2 ** 32 - 1
+# the number of keys found before they are sorted and merged
+ADJACENCY_KEY_BUFFER_SIZE = 2 ** 12
+
+
+
 @jit(nopython=True)
-def FindAdjacentLabelSetLocal(components):
-    neighbor_label_set = set()
+def NarrowComponent(component, background_start_label):
+    # the background components of a block count down from background_start_label so they fit above NARROW_BACKGROUND
+    if component < 0: return np.uint64(background_start_label - component + NARROW_BACKGROUND)
+    else: return np.uint64(component)
+
+
 
+@jit(nopython=True)
+def LabelPairKey(component_one, component_two, background_start_label):
+    # pack the ordered pair of narrow components into one key
+    narrow_one = NarrowComponent(component_one, background_start_label)
+    narrow_two = NarrowComponent(component_two, background_start_label)
+
+    if narrow_one < narrow_two: return (narrow_one << np.uint64(32)) | narrow_two
+    else: return (narrow_two << np.uint64(32)) | narrow_one
+
+
+
+@jit(nopython=True)
+def FindAdjacentLabelKeysLocal(components, background_start_label, start_row, keys):
     zres, yres, xres = components.shape
 
-    # consider all neighboring pairs within the volume
-    for iz in range(0, zres - 1):
-        for iy in range(0, yres - 1):
-            for ix in range(0, xres - 1):
+    nkeys = 0
+
+    # neighboring voxels along a boundary repeat the same pair so skip the last key of each direction
+    last_keys = np.zeros(4, dtype=np.uint64)
+
+    # consider all neighboring pairs within the volume one (z, y) row at a time starting at this row
+    for row in range(start_row, zres * yres):
+        # stop before this row if its keys might not fit (the caller continues here)
+        if nkeys + 4 * xres > keys.size: return nkeys, row
+
+        iz = row // yres
+        iy = row % yres
+
+        # every voxel in rows on the first and last z and y slices touches the local border
+        border_row = (iz == 0 or iz == zres - 1 or iy == 0 or iy == yres - 1)
+
+        for ix in range(xres):
+            # get the component at this location
+            component = components[iz,iy,ix]
 
-                # get the component at this location
-                component = components[iz,iy,ix]
+            # does this component differ from its neighbor in z, y, or x
+            if iz < zres - 1 and component != components[iz+1,iy,ix]:
+                key = LabelPairKey(component, components[iz+1,iy,ix], background_start_label)
+                if key != last_keys[0]:
+                    keys[nkeys] = key
+                    nkeys += 1
+                    last_keys[0] = key
 
-                # does this component differ from its neighbor in z
-                if component != components[iz+1,iy,ix]:
-                    neighbor_label_set.add((component, components[iz+1,iy,ix]))
-                    neighbor_label_set.add((components[iz+1,iy,ix], component))
+            if iy < yres - 1 and component != components[iz,iy+1,ix]:
+                key = LabelPairKey(component, components[iz,iy+1,ix], background_start_label)
+                if key != last_keys[1]:
+                    keys[nkeys] = key
+                    nkeys += 1
+                    last_keys[1] = key
 
-                # does this component differ from its neighbor in y
-                if component != components[iz,iy+1,ix]:
-                    neighbor_label_set.add((component, components[iz,iy+1,ix]))
-                    neighbor_label_set.add((components[iz,iy+1,ix], component))
+            if ix < xres - 1 and component != components[iz,iy,ix+1]:
+                key = LabelPairKey(component, components[iz,iy,ix+1], background_start_label)
+                if key != last_keys[2]:
+                    keys[nkeys] = key
+                    nkeys += 1
+                    last_keys[2] = key
 
-                # does this component differ from its neighbor in x
-                if component != components[iz,iy,ix+1]:
-                    neighbor_label_set.add((component, components[iz,iy,ix+1]))
-                    neighbor_label_set.add((components[iz,iy,ix+1], component))
+            # components on the first and last slice of each axis touch the local border
+            if border_row or ix == 0 or ix == xres - 1:
+                key = (NarrowComponent(component, background_start_label) << np.uint64(32)) | np.uint64(NARROW_BORDER_CONTACT)
+                if key != last_keys[3]:
+                    keys[nkeys] = key
+                    nkeys += 1
+                    last_keys[3] = key
 
-    # consider components on the first and last z slice
-    for iz in [0, zres - 1]:
-        for iy in range(0, yres):
-            for ix in range(0, xres):
+    return nkeys, zres * yres
 
-                #interconnect in plane
-                component = components[iz,iy,ix]
 
-                if iy < yres - 1:
-                    if component != components[iz,iy+1,ix]:
-                        neighbor_label_set.add((component, components[iz,iy+1,ix]))
-                        neighbor_label_set.add((components[iz,iy+1,ix], component))
 
-                if ix < xres - 1:
-                    if component != components[iz,iy,ix+1]:
-                        neighbor_label_set.add((component, components[iz,iy,ix+1]))
-                        neighbor_label_set.add((components[iz,iy,ix+1], component))
+def UniqueKeys(keys):
+    # sorting and dropping repeats is much faster than np.unique for large key arrays
+    keys = np.sort(keys)
 
-                # write dict of border components paired with sufficiently high fake label
-                neighbor_label_set.add((component, BORDER_CONTACT))
+    return keys[np.append(True, keys[1:] != keys[:-1])] if keys.size else keys
 
-    # consider components on the first and last y slice
-    for iy in [0, yres - 1]:
-        for iz in range(0, zres):
-            for ix in range(0, xres):
 
-                #interconnect in plane
-                component = components[iz,iy,ix]
 
-                if iz < zres - 1:
-                    if component != components[iz+1,iy,ix]:
-                        neighbor_label_set.add((component, components[iz+1,iy,ix]))
-                        neighbor_label_set.add((components[iz+1,iy,ix], component))
+def FindAdjacentLabelEdgesLocal(components, background_start_label):
+    zres, yres, xres = components.shape
+
+    # labels of at least NARROW_BACKGROUND do not fit the narrow keys so relabel these blocks densely
+    labels = None
+    if components.max() >= NARROW_BACKGROUND:
+        labels, components = np.unique(components, return_inverse=True)
+        components = components.reshape(zres, yres, xres).astype(np.int64)
+
+    # find the keys of the adjacent components in rounds of one buffer each (a row has at most four keys per voxel)
+    keys = np.empty(max(ADJACENCY_KEY_BUFFER_SIZE, 4 * xres), dtype=np.uint64)
+    unique_keys = np.zeros(0, dtype=np.uint64)
+    pending_keys = []
+    npending_keys = 0
 
-                if ix < xres - 1:
-                    if component != components[iz,iy,ix+1]:
-                        neighbor_label_set.add((component, components[iz,iy,ix+1]))
-                        neighbor_label_set.add((components[iz,iy,ix+1], component))
+    row = 0
+    while row < zres * yres:
+        nkeys, row = FindAdjacentLabelKeysLocal(components, background_start_label, row, keys)
 
-                # write dict of border components paired with sufficiently high fake label
-                neighbor_label_set.add((component, BORDER_CONTACT))
+        pending_keys.append(UniqueKeys(keys[:nkeys]))
+        npending_keys += pending_keys[-1].size
 
-    # consider components on the first and last x slice
-    for ix in [0, xres - 1]:
-        for iz in range(0, zres):
-            for iy in range(0, yres):
+        # merge once the pending keys outnumber the merged keys so every key is sorted a few times at most
+        if npending_keys > max(unique_keys.size, ADJACENCY_KEY_BUFFER_SIZE):
+            unique_keys = UniqueKeys(np.concatenate([unique_keys] + pending_keys))
+            pending_keys = []
+            npending_keys = 0
 
-                #interconnect in plane
-                component = components[iz,iy,ix]
+    unique_keys = UniqueKeys(np.concatenate([unique_keys] + pending_keys))
 
-                if iz < zres - 1:
-                    if component != components[iz+1,iy,ix]:
-                        neighbor_label_set.add((component, components[iz+1,iy,ix]))
-                        neighbor_label_set.add((components[iz+1,iy,ix], component))
+    # unpack the keys and move the background components back below zero
+    firsts = (unique_keys >> np.uint64(32)).astype(np.int64)
+    seconds = (unique_keys & np.uint64(NARROW_BORDER_CONTACT)).astype(np.int64)
 
-                if iy < yres - 1:
-                    if component != components[iz,iy+1,ix]:
-                        neighbor_label_set.add((component, components[iz,iy+1,ix]))
-                        neighbor_label_set.add((components[iz,iy+1,ix], component))
+    border = (seconds == NARROW_BORDER_CONTACT)
 
-                # write dict of border components paired with sufficiently high fake label
-                neighbor_label_set.add((component, BORDER_CONTACT))
+    firsts[firsts >= NARROW_BACKGROUND] = background_start_label - (firsts[firsts >= NARROW_BACKGROUND] - NARROW_BACKGROUND)
+    seconds[seconds >= NARROW_BACKGROUND] = background_start_label - (seconds[seconds >= NARROW_BACKGROUND] - NARROW_BACKGROUND)
 
-    return neighbor_label_set
+    # neighbors are symmetric but the border contact only appears as the second label
+    border_labels = firsts[border]
+    firsts = firsts[~border]
+    seconds = seconds[~border]
 
+    # map the dense labels back to the components
+    if not labels is None:
+        border_labels = labels[border_labels]
+        firsts = labels[firsts]
+        seconds = labels[seconds]
 
+    edges = np.concatenate((
+        np.stack((firsts, seconds), axis=1),
+        np.stack((seconds, firsts), axis=1),
+        np.stack((border_labels, np.full_like(border_labels, BORDER_CONTACT)), axis=1),
+    ))
 
-def Set2Dictionary(label_set, label_dict = None):
-    if label_dict == None:
-        label_dict = dict()
+    # return the pairs in lexicographic order
+    return edges[np.lexsort((edges[:,1], edges[:,0]))]
 
-    # go through all of the labels in the set
-    for (label_one, label_two) in label_set:
-        # background components can be neighbors if they cross a border
 
-        # skip non-background components
-        if label_one > 0: continue
 
-        # create a dictionary entry for this label if it doesn't exist yet
-        if not label_one in label_dict:
-            label_dict[label_one] = [label_two]
-        # otherwise append the label to the dictionary entry for label_one
-        elif not label_two in label_dict[label_one]:
-            label_dict[label_one].append(label_two)
-        # when label_dict is not None, the element could already appear in the set
+def EdgeArray2Dictionary(edges):
+    label_dict = dict()
+
+    # background components are the only keys in the dictionary
+    edges = np.unique(edges[edges[:,0] < 0], axis=0)
+
+    # the sorted rows of each background component are contiguous
+    labels, starts = np.unique(edges[:,0], return_index=True)
+    for label, neighbors in zip(labels.tolist(), np.split(edges[:,1], starts[1:])):
+        label_dict[label] = neighbors.tolist()
 
     return label_dict
 
@@ -225,18 +348,13 @@ def FindBackgroundComponentsAssociatedLabels(neighbor_label_dict, undetermined_l
 
 
 
-def PruneNeighborLabelSet(neighbor_label_set, holes, non_holes):
-    neighbor_label_set_reduced = set()
-
-    for (label_one, label_two) in neighbor_label_set:
-        # do not include any elements already labeled or connected to the border
-        if label_one in holes or label_one in non_holes: continue
-        if label_two in holes or label_two in non_holes: continue
-        if label_one == BORDER_CONTACT or label_two == BORDER_CONTACT: continue
+def PruneNeighborLabelEdges(neighbor_label_edges, holes, non_holes):
+    # do not include any elements already labeled or connected to the border
+    determined = np.array(list(holes) + list(non_holes) + [BORDER_CONTACT], dtype=np.int64)
 
-        neighbor_label_set_reduced.add((label_one, label_two))
+    keep = ~(np.isin(neighbor_label_edges[:,0], determined) | np.isin(neighbor_label_edges[:,1], determined))
 
-    return neighbor_label_set_reduced
+    return neighbor_label_edges[keep]
 
 
 
@@ -257,39 +375,14 @@ def FindPerBlockConnectedComponents(data, iz, iy, ix):
 
     # read in this volume
     read_time = time.time()
-    seg = data.ReadRawSegmentationBlock(iz, iy, ix)
+    seg = ReadPaddedSegmentationBlock(data, iz, iy, ix)
     read_time = time.time() - read_time
 
-    # make sure the block is not larger than mentioned in param file
-    assert (seg.shape[OR_Z] <= data.BlockZLength())
-    assert (seg.shape[OR_Y] <= data.BlockYLength())
-    assert (seg.shape[OR_X] <= data.BlockXLength())
-
-    # pad the block with zeroes at the ends
-    if seg.shape[OR_Z] < data.BlockZLength() or seg.shape[OR_Y] < data.BlockYLength() or seg.shape[OR_X] < data.BlockXLength():
-        # make sure that the block is on one of the far edges
-        assert (iz == data.EndZ() - 1 or iy == data.EndY() - 1 or ix == data.EndX() - 1)
-
-        zpadding = data.ZBlockLength() - seg.shape[OR_Z]
-        ypadding = data.YBlockLength() - seg.shape[OR_Y]
-        xpadding = data.XBlockLength() - seg.shape[OR_X]
-
-        # padding only goes at the far edges of the block
-        seg = np.pad(seg, ((0, zpadding), (0, ypadding), (0, xpadding)), 'constant', constant_values = 0)
-
-        # make sure the block is not smaller than mentioned in param file
-        assert (seg.shape[OR_Z] == data.BlockZLength())
-        assert (seg.shape[OR_Y] == data.BlockYLength())
-        assert (seg.shape[OR_X] == data.BlockXLength())
-
     # call connected components algorithm for this block
     components_time = time.time()
 
     components = ComputeConnected6Components(seg, background_start_label)
 
-    # delete original segmentation
-    del seg
-
     # save the components file to disk
     tmp_directory = data.TempBlockDirectory(iz, iy, ix)
 
@@ -298,24 +391,27 @@ def FindPerBlockConnectedComponents(data, iz, iy, ix):
         os.makedirs(tmp_directory, exist_ok=True)
 
     # write the components and all walls to file
-    WriteH5File(components, '{}/components.h5'.format(tmp_directory))
-    WriteH5File(components[0,:,:], '{}/z-min-hole-filling.h5'.format(tmp_directory))
-    WriteH5File(components[-1,:,:], '{}/z-max-hole-filling.h5'.format(tmp_directory))
-    WriteH5File(components[:,0,:], '{}/y-min-hole-filling.h5'.format(tmp_directory))
-    WriteH5File(components[:,-1,:], '{}/y-max-hole-filling.h5'.format(tmp_directory))
-    WriteH5File(components[:,:,0], '{}/x-min-hole-filling.h5'.format(tmp_directory))
-    WriteH5File(components[:,:,-1], '{}/x-max-hole-filling.h5'.format(tmp_directory))
+    WriteComponentsBlock(data, seg, components, tmp_directory)
+    WriteH5File(components[0,:,:], '{}/z-min-hole-filling.h5'.format(tmp_directory), compression = data.H5Compression())
+    WriteH5File(components[-1,:,:], '{}/z-max-hole-filling.h5'.format(tmp_directory), compression = data.H5Compression())
+    WriteH5File(components[:,0,:], '{}/y-min-hole-filling.h5'.format(tmp_directory), compression = data.H5Compression())
+    WriteH5File(components[:,-1,:], '{}/y-max-hole-filling.h5'.format(tmp_directory), compression = data.H5Compression())
+    WriteH5File(components[:,:,0], '{}/x-min-hole-filling.h5'.format(tmp_directory), compression = data.H5Compression())
+    WriteH5File(components[:,:,-1], '{}/x-max-hole-filling.h5'.format(tmp_directory), compression = data.H5Compression())
+
+    # delete original segmentation
+    del seg
 
     components_time = time.time() - components_time
 
     # find the set of adjacent labels, both inside the volume and the ones connected at the local border
     adjacency_set_time = time.time()
-    neighbor_label_set = FindAdjacentLabelSetLocal(components)
+    neighbor_label_edges = FindAdjacentLabelEdgesLocal(components, background_start_label)
     adjacency_set_time = time.time() - adjacency_set_time
 
-    # create a dictionary of labels from the set
+    # create a dictionary of labels from the edges
     background_associated_labels_time = time.time()
-    neighbor_label_dict = Set2Dictionary(neighbor_label_set)
+    neighbor_label_dict = EdgeArray2Dictionary(neighbor_label_edges)
 
     # to start, none of the background components are determined
     undetermined_label_set = set(neighbor_label_dict.keys())
@@ -324,18 +420,19 @@ def FindPerBlockConnectedComponents(data, iz, iy, ix):
     associated_label_dict, undetermined_label_set, holes, non_holes = FindBackgroundComponentsAssociatedLabels(neighbor_label_dict, undetermined_label_set, associated_label_dict)
     background_associated_labels_time = time.time() - background_associated_labels_time
 
-    # remove from the neighbor label set border elements and those already determined as holes and non holes
-    neighbor_label_set_reduced = PruneNeighborLabelSet(neighbor_label_set, holes, non_holes)
-    neighbor_label_dict_reduced = Set2Dictionary(neighbor_label_set_reduced)
+    # remove from the neighbor label edges border elements and those already determined as holes and non holes
+    neighbor_label_edges_reduced = PruneNeighborLabelEdges(neighbor_label_edges, holes, non_holes)
 
-    # delete the temporary generated set and dictionary
-    del neighbor_label_set, neighbor_label_dict
+    # delete the temporary generated edges and dictionary
+    del neighbor_label_edges, neighbor_label_dict
 
     # write the relevant files to disk
     write_time = time.time()
-    PickleNumbaData(associated_label_dict, '{}/associated-label-set-local.pickle'.format(tmp_directory))
-    PickleData(undetermined_label_set, '{}/undetermined-label-set-local.pickle'.format(tmp_directory))
-    PickleData(neighbor_label_dict_reduced, '{}/neighbor-label-dictionary-reduced.pickle'.format(tmp_directory))
+    associated_labels = np.fromiter(associated_label_dict.keys(), dtype=np.int64, count=len(associated_label_dict))
+    associated_values = np.fromiter(associated_label_dict.values(), dtype=np.int64, count=len(associated_label_dict))
+    WriteLabelMapping(associated_labels, associated_values, '{}/associated-labels-local.npz'.format(tmp_directory))
+    np.save('{}/undetermined-labels-local.npy'.format(tmp_directory), np.unique(np.array(list(undetermined_label_set), dtype=np.int64)))
+    WriteEdgeArray(neighbor_label_edges_reduced[neighbor_label_edges_reduced[:,0] < 0], '{}/neighbor-label-edges-reduced.npy'.format(tmp_directory))
     write_time = time.time() - write_time
 
     total_time = time.time() - total_time
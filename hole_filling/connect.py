@@ -3,70 +3,55 @@ import time
 
 
 
-from numba import jit, types
-from numba.typed import Dict
+import numpy as np
 
 
 
-from blockbased_synapseaware.hole_filling.components import FindBackgroundComponentsAssociatedLabels, Set2Dictionary
-from blockbased_synapseaware.utilities.dataIO import PickleData, PickleNumbaData, ReadH5File, ReadPickledData
-from blockbased_synapseaware.utilities.constants import BORDER_CONTACT
-
-
+from numba import jit
 
 
-# suppress deprecation warnings (future use will require typed.Set - not implemented)
-from numba.core.errors import NumbaDeprecationWarning, NumbaPendingDeprecationWarning
-import warnings
 
-warnings.simplefilter('ignore', category=NumbaDeprecationWarning)
-warnings.simplefilter('ignore', category=NumbaPendingDeprecationWarning)
+from blockbased_synapseaware.hole_filling.components import EdgeArray2Dictionary
+from blockbased_synapseaware.utilities.dataIO import PickleData, ReadEdgeArray, ReadH5File, ReadLabelMapping, WriteEdgeArray
+from blockbased_synapseaware.utilities.constants import BORDER_CONTACT
 
 
 
-@jit(nopython=True)
-def FindLabelsAdjacentToGlobalBorder(label_set, seg_wall):
-    wall_shape = seg_wall.shape
 
-    # go through all pixels along this wall
-    for ij in range(wall_shape[0]):
-        for ii in range(wall_shape[1]):
-            label_set.add((seg_wall[ij,ii], BORDER_CONTACT))
+def FindLabelsAdjacentToGlobalBorder(seg_wall):
+    # all background components along this wall connect to the boundary
+    labels = np.unique(seg_wall)
+    labels = labels[labels < 0]
 
-    return label_set
+    return np.stack((labels, np.full_like(labels, BORDER_CONTACT)), axis=1)
 
 
 
-def ConnectBlockToGlobalBorder(label_set, tmp_directory, axis, direction):
+def ConnectBlockToGlobalBorder(tmp_directory, axis, direction):
     # read in the wall for this border
     seg_wall_filename = '{}/{}-{}-hole-filling.h5'.format(tmp_directory, axis, direction)
 
     seg_wall = ReadH5File(seg_wall_filename)
 
     # all pixels along the wall connect to the boundary
-    label_set = FindLabelsAdjacentToGlobalBorder(label_set, seg_wall)
-
-    return label_set
+    return FindLabelsAdjacentToGlobalBorder(seg_wall)
 
 
 
-@jit(nopython=True)
-def FindLabelsBetweenAdjacentBlocks(label_set, current_seg_wall, neighbor_seg_wall):
-    wall_shape = current_seg_wall.shape
-
+def FindLabelsBetweenAdjacentBlocks(current_seg_wall, neighbor_seg_wall):
     assert (current_seg_wall.shape == neighbor_seg_wall.shape)
 
-    # go through all pixels along this wall
-    for ij in range(wall_shape[0]):
-        for ii in range(wall_shape[1]):
-            label_set.add((current_seg_wall[ij,ii], neighbor_seg_wall[ij,ii]))
-            label_set.add((neighbor_seg_wall[ij,ii], current_seg_wall[ij,ii]))
+    # pair every pixel along this wall with its neighbor in both directions
+    current_labels = current_seg_wall.ravel().astype(np.int64)
+    neighbor_labels = neighbor_seg_wall.ravel().astype(np.int64)
+    edges = np.concatenate((np.stack((current_labels, neighbor_labels), axis=1), np.stack((neighbor_labels, current_labels), axis=1)))
 
-    return label_set
+    # only pairs starting at a background component are needed
+    return edges[edges[:,0] < 0]
 
 
 
-def ConnectBlocks(data, label_set, iz, iy, ix, axis):
+def ConnectBlocks(data, iz, iy, ix, axis):
     # get the (z, y, x) coordinates for the neighbor above this
     if axis == 'z':
         neighbor_iz = iz + 1
@@ -93,9 +78,7 @@ def ConnectBlocks(data, label_set, iz, iy, ix, axis):
     current_seg_wall = ReadH5File(current_wall_filename)
     neighbor_seg_wall = ReadH5File(neighbor_wall_filename)
 
-    label_set = FindLabelsBetweenAdjacentBlocks(label_set, current_seg_wall, neighbor_seg_wall)
-
-    return label_set
+    return FindLabelsBetweenAdjacentBlocks(current_seg_wall, neighbor_seg_wall)
 
 
 
@@ -106,55 +89,52 @@ def ConnectLabelsAcrossBlocks(data, iz, iy, ix):
     # find all of the adjacent components across the boundaries
     adjacency_set_time = time.time()
 
-    # create an empty list of adjacency sets
-    neighbor_label_set_global = set()
-    # add a fake tuple for numba to know fingerprint
-    neighbor_label_set_global.add((BORDER_CONTACT, BORDER_CONTACT))
+    # create an empty list of adjacency arrays
+    neighbor_edges_global = []
 
     # get the temporary directory for this dataset
     tmp_directory = data.TempBlockDirectory(iz, iy, ix)
 
     # this block occurs at the minimum in the z direction
     if iz == data.StartZ():
-        neighbor_label_set_global = ConnectBlockToGlobalBorder(neighbor_label_set_global, tmp_directory, 'z', 'min')
+        neighbor_edges_global.append(ConnectBlockToGlobalBorder(tmp_directory, 'z', 'min'))
 
     # this block occurs at the minimum of the y direction
     if iy == data.StartY():
-        neighbor_label_set_global = ConnectBlockToGlobalBorder(neighbor_label_set_global, tmp_directory, 'y', 'min')
+        neighbor_edges_global.append(ConnectBlockToGlobalBorder(tmp_directory, 'y', 'min'))
 
     # this block occurs at the minimum of the x direction
     if ix == data.StartX():
-        neighbor_label_set_global = ConnectBlockToGlobalBorder(neighbor_label_set_global, tmp_directory, 'x', 'min')
+        neighbor_edges_global.append(ConnectBlockToGlobalBorder(tmp_directory, 'x', 'min'))
 
     # this block occurs at the maximum in the z direction
     if iz == data.EndZ() - 1:
-        neighbor_label_set_global = ConnectBlockToGlobalBorder(neighbor_label_set_global, tmp_directory, 'z', 'max')
+        neighbor_edges_global.append(ConnectBlockToGlobalBorder(tmp_directory, 'z', 'max'))
     # this block has a neighbor in the positive z direction
     else:
-        neighbor_label_set_global = ConnectBlocks(data, neighbor_label_set_global, iz, iy, ix, 'z')
+        neighbor_edges_global.append(ConnectBlocks(data, iz, iy, ix, 'z'))
 
     # this block occurs at the maximum of the y direction
     if iy == data.EndY() - 1:
-        neighbor_label_set_global = ConnectBlockToGlobalBorder(neighbor_label_set_global, tmp_directory, 'y', 'max')
+        neighbor_edges_global.append(ConnectBlockToGlobalBorder(tmp_directory, 'y', 'max'))
     # this block has a neighbor in the positive y direction
     else:
-        neighbor_label_set_global = ConnectBlocks(data, neighbor_label_set_global, iz, iy, ix, 'y')
+        neighbor_edges_global.append(ConnectBlocks(data, iz, iy, ix, 'y'))
 
     # this block occurs at the maximum of the x direction
     if ix == data.EndX() - 1:
-        neighbor_label_set_global = ConnectBlockToGlobalBorder(neighbor_label_set_global, tmp_directory, 'x', 'max')
+        neighbor_edges_global.append(ConnectBlockToGlobalBorder(tmp_directory, 'x', 'max'))
     # this block has a neighbor in the positive y direction
     else:
-        neighbor_label_set_global = ConnectBlocks(data, neighbor_label_set_global, iz, iy, ix, 'x')
+        neighbor_edges_global.append(ConnectBlocks(data, iz, iy, ix, 'x'))
 
-    # remove fake tuple from set
-    neighbor_label_set_global.remove((BORDER_CONTACT, BORDER_CONTACT))
+    neighbor_edges_global = np.concatenate(neighbor_edges_global)
 
     adjacency_set_time = time.time() - adjacency_set_time
 
     # write the relevant files to disk
     write_time = time.time()
-    PickleData(neighbor_label_set_global, '{}/neighbor-label-set-global.pickle'.format(tmp_directory))
+    WriteEdgeArray(neighbor_edges_global, '{}/neighbor-label-edges-global.npy'.format(tmp_directory))
     write_time = time.time() - write_time
 
     total_time = time.time() - total_time
@@ -175,63 +155,149 @@ def ConnectLabelsAcrossBlocks(data, iz, iy, ix):
 
 
 
+@jit(nopython=True)
+def FindRoot(parents, index):
+    # follow the parents to the root and halve the path along the way
+    while parents[index] != index:
+        parents[index] = parents[parents[index]]
+        index = parents[index]
+
+    return index
+
+
+
+@jit(nopython=True)
+def UnionBackgroundComponents(parents, sizes, indices_one, indices_two):
+    for ie in range(indices_one.size):
+        root_one = FindRoot(parents, indices_one[ie])
+        root_two = FindRoot(parents, indices_two[ie])
+
+        if root_one == root_two: continue
+
+        # attach the smaller tree below the larger one
+        if sizes[root_one] < sizes[root_two]:
+            root_one, root_two = root_two, root_one
+
+        parents[root_two] = root_one
+        sizes[root_one] += sizes[root_two]
+
+    # flatten every tree so each component points directly at its root
+    for index in range(parents.size):
+        parents[index] = FindRoot(parents, index)
+
+    return parents
+
+
+
+def ResolveBackgroundComponents(neighbor_edges, undetermined_labels):
+    # every edge starts at a background component which is undetermined after the local step
+    labels = np.unique(undetermined_labels)
+    firsts = np.searchsorted(labels, neighbor_edges[:,0])
+    assert (np.all(labels[np.minimum(firsts, labels.size - 1)] == neighbor_edges[:,0]))
+
+    # union all background components that neighbor each other
+    background = neighbor_edges[:,1] < 0
+    seconds = np.searchsorted(labels, neighbor_edges[background,1])
+    assert (np.all(labels[np.minimum(seconds, labels.size - 1)] == neighbor_edges[background,1]))
+
+    parents = np.arange(labels.size, dtype=np.int64)
+    sizes = np.ones(labels.size, dtype=np.int64)
+    roots = UnionBackgroundComponents(parents, sizes, firsts[background], seconds)
+
+    # any component in a group that touches the global border makes the entire group a non hole
+    border_contact = np.zeros(labels.size, dtype=bool)
+    border_contact[roots[firsts[neighbor_edges[:,1] == BORDER_CONTACT]]] = True
+
+    # find the distinct neuron neighbors of every group
+    neurons = (neighbor_edges[:,1] > 0) & (neighbor_edges[:,1] != BORDER_CONTACT)
+    group_neurons = np.unique(np.stack((roots[firsts[neurons]], neighbor_edges[neurons,1]), axis=1), axis=0)
+    nneurons = np.bincount(group_neurons[:,0], minlength=labels.size)
+
+    # groups surrounded by exactly one neuron are holes and fill with that neuron
+    group_labels = np.zeros(labels.size, dtype=np.int64)
+    single = nneurons[group_neurons[:,0]] == 1
+    group_labels[group_neurons[single,0]] = group_neurons[single,1]
+    group_labels[border_contact] = 0
+
+    return labels, group_labels[roots]
+
+
+
 def CombineAssociatedLabels(data):
     # start timing statistics
     total_time = time.time()
 
-    # create empty sets/dicts
-    neighbor_label_set_global = set()
-    associated_label_dict_global = Dict.empty(key_type=types.int64, value_type=types.int64)
-    undetermined_label_set_global = set()
-    neighbor_label_dict_local = dict()
+    # create empty lists of arrays
+    neighbor_edges = []
+    associated_labels = []
+    associated_values = []
+    undetermined_labels = []
 
     read_time = time.time()
 
-    # iterate over all blocks and read in global/local dicts
+    # iterate over all blocks and read in global/local arrays
     for iz in range(data.StartZ(), data.EndZ()):
         for iy in range(data.StartY(), data.EndY()):
             for ix in range(data.StartX(), data.EndX()):
                 # get the location for the temporary directory
                 tmp_directory = data.TempBlockDirectory(iz, iy, ix)
 
-                # read the four sets/dicts for this one block
-                block_neighbor_label_set_global = ReadPickledData('{}/neighbor-label-set-global.pickle'.format(tmp_directory))
-                block_associated_label_dict = ReadPickledData('{}/associated-label-set-local.pickle'.format(tmp_directory))
-                block_undetermined_label_set = ReadPickledData('{}/undetermined-label-set-local.pickle'.format(tmp_directory))
-                block_neighbor_label_dict_local = ReadPickledData('{}/neighbor-label-dictionary-reduced.pickle'.format(tmp_directory))
-
-                # combine the local datasets with the global ones
-                neighbor_label_set_global = neighbor_label_set_global.union(block_neighbor_label_set_global)
-                associated_label_dict_global.update(block_associated_label_dict)
-                undetermined_label_set_global = undetermined_label_set_global.union(block_undetermined_label_set)
-                neighbor_label_dict_local.update(block_neighbor_label_dict_local)
-
-                # free memory
-                del block_neighbor_label_set_global, block_associated_label_dict, block_undetermined_label_set, block_neighbor_label_dict_local
-
+                # read the four arrays for this one block
+                neighbor_edges.append(ReadEdgeArray('{}/neighbor-label-edges-global.npy'.format(tmp_directory)))
+                neighbor_edges.append(ReadEdgeArray('{}/neighbor-label-edges-reduced.npy'.format(tmp_directory)))
+                undetermined_labels.append(np.load('{}/undetermined-labels-local.npy'.format(tmp_directory)))
+                block_associated_labels, block_associated_values = ReadLabelMapping('{}/associated-labels-local.npz'.format(tmp_directory))
+                associated_labels.append(block_associated_labels)
+                associated_values.append(block_associated_values)
 
     read_time = time.time() - read_time
 
     background_associated_labels_time = time.time()
 
-    # create a neighbor label dict building on the reduced labels read in for each block
-    neighbor_label_dict_global = Set2Dictionary(neighbor_label_set_global, label_dict = neighbor_label_dict_local)
+    # combine the global edges and the reduced local edges of every block
+    neighbor_edges = np.unique(np.concatenate(neighbor_edges), axis=0)
+    undetermined_labels = np.concatenate(undetermined_labels)
+
     # find groupings of negative neighbors surrounded by a single positive label
-    associated_label_dict, undetermined_label_set, holes, non_holes = FindBackgroundComponentsAssociatedLabels(neighbor_label_dict_global, undetermined_label_set_global, associated_label_dict_global)
+    # groups with border contact or several neuron neighbors are not holes
+    resolved_labels, resolved_values = ResolveBackgroundComponents(neighbor_edges, undetermined_labels)
+
+    # background labels are unique to each block so the local and global mappings never collide
+    associated_labels = np.concatenate(associated_labels + [resolved_labels])
+    associated_values = np.concatenate(associated_values + [resolved_values])
 
-    # set all of the undetermined values to non_holes:
-    for label in undetermined_label_set:
-        associated_label_dict[label] = 0
+    # background components in each block are labeled -1 - block_index * block_volume - offset
+    background_offsets = -1 - associated_labels
+    order = np.argsort(background_offsets, kind='stable')
+    background_offsets = background_offsets[order]
+    associated_values = associated_values[order]
+    del associated_labels, order
+
+    # create a neighbor label dict which links background components across all blocks
+    neighbor_label_dict_global = EdgeArray2Dictionary(neighbor_edges)
 
     background_associated_labels_time = time.time() - background_associated_labels_time
 
     # write the associated labels to disk
     write_time = time.time()
-    # write only one associated labels dictionary for all blocks
+    # write one dense array of associated labels per block indexed by the background offset
+    block_volume = data.BlockVolume()
+    for iz in range(data.StartZ(), data.EndZ()):
+        for iy in range(data.StartY(), data.EndY()):
+            for ix in range(data.StartX(), data.EndX()):
+                block_index = data.IndexFromIndices(iz, iy, ix)
+
+                # the labels of this block are contiguous in the sorted offsets
+                start, end = np.searchsorted(background_offsets, [block_index * block_volume, (block_index + 1) * block_volume])
+
+                # every background component in the block must have exactly one associated label
+                assert (np.array_equal(background_offsets[start:end] - block_index * block_volume, np.arange(end - start)))
+
+                np.save('{}/hole-filling-associated-labels.npy'.format(data.TempBlockDirectory(iz, iy, ix)), associated_values[start:end])
+
     tmp_directory = data.TempDirectory()
-    PickleNumbaData(associated_label_dict, '{}/hole-filling-associated-labels.pickle'.format(tmp_directory))
     # save the neighbor label dict global which has linked background components across all blocks
-    PickleNumbaData(neighbor_label_dict_global, '{}/hole-filling-neighbor-label-dict-global.pickle'.format(tmp_directory))
+    PickleData(neighbor_label_dict_global, '{}/hole-filling-neighbor-label-dict-global.pickle'.format(tmp_directory))
     write_time = time.time() - write_time
 
     total_time = time.time() - total_time
@@ -6,6 +6,7 @@ from blockbased_synapseaware.hole_filling.components import FindPerBlockConnecte
 from blockbased_synapseaware.hole_filling.connect import ConnectLabelsAcrossBlocks, CombineAssociatedLabels
 from blockbased_synapseaware.hole_filling.mapping import RemoveHoles
 from blockbased_synapseaware.utilities.dataIO import ReadMetaData
+from blockbased_synapseaware.utilities.scheduler import Blocks, ExecuteTasks, PositiveNeighbors
 from blockbased_synapseaware.utilities.constants import *
 
 
@@ -38,3 +39,34 @@ def FillHolesSequentially(meta_filename):
         for iy in range(data.StartY(), data.EndY()):
             for ix in range(data.StartX(), data.EndX()):
                 RemoveHoles(data, iz, iy, ix)
+
+
+
+def FillHolesInParallel(meta_filename, nprocesses=None):
+    # read in the data for this block
+    data = ReadMetaData(meta_filename)
+
+    # users must provide an output directory
+    assert (not data.HoleFillingOutputDirectory() == None)
+    os.makedirs(data.HoleFillingOutputDirectory(), exist_ok=True)
+
+    tasks = {}
+    blocks = Blocks(data)
+
+    # the first step to fill holes in each block has no dependencies
+    for block in blocks:
+        tasks[('components',) + block] = (FindPerBlockConnectedComponents, block, [])
+
+    # the second step needs the walls of this block and its +z, +y, +x neighbors
+    for block in blocks:
+        dependencies = [('components',) + neighbor for neighbor in [block] + PositiveNeighbors(data, *block)]
+        tasks[('connect',) + block] = (ConnectLabelsAcrossBlocks, block, dependencies)
+
+    # the third step needs the adjacencies from every block
+    tasks[('combine',)] = (CombineAssociatedLabels, (), [('connect',) + block for block in blocks])
+
+    # the fourth step needs the global mapping
+    for block in blocks:
+        tasks[('remove',) + block] = (RemoveHoles, block, [('combine',)])
+
+    ExecuteTasks(meta_filename, tasks, nprocesses)
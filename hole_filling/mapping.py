@@ -3,24 +3,19 @@ import time
 
 
 
-from numba import jit, types
-from numba.typed import Dict
+import numpy as np
 
 
 
-from blockbased_synapseaware.utilities.dataIO import ReadH5File, ReadPickledData, WriteH5File
+from blockbased_synapseaware.hole_filling.components import ReadComponentsBlock
+from blockbased_synapseaware.utilities.dataIO import ReadAssociatedLabels, WriteH5File
 
 
 
-@jit(nopython=True)
-def AssignBackgroundAssociatedLabels(components, associated_label_dict):
-    zres, yres, xres = components.shape
-
-    for iz in range(zres):
-        for iy in range(yres):
-            for ix in range(xres):
-                if components[iz,iy,ix] < 0:
-                    components[iz,iy,ix] = associated_label_dict[components[iz,iy,ix]]
+def AssignBackgroundAssociatedLabels(components, associated_labels, background_start_label):
+    # gather the associated label of every background voxel
+    background = components < 0
+    components[background] = associated_labels[background_start_label - components[background]]
 
     return components
 
@@ -32,22 +27,27 @@ def RemoveHoles(data, iz, iy, ix):
 
     # read in the associated labels and the connected components
     read_time = time.time()
-    components = ReadH5File('{}/components.h5'.format(data.TempBlockDirectory(iz, iy, ix)))
-    # need to first create separate empty numba Dict
-    associated_label_dict = Dict.empty(key_type=types.int64, value_type=types.int64)
-    associated_label_dict.update(ReadPickledData('{}/hole-filling-associated-labels.pickle'.format(data.TempDirectory())))
+    components = ReadComponentsBlock(data, iz, iy, ix)
+    associated_labels = ReadAssociatedLabels(data, iz, iy, ix)
     read_time = time.time() - read_time
 
-    # remove all the holes with the associated labels dictionary
+    # the raw segmentation is the components block without the background components
+    post_fill = data.HoleFillingPostFill()
+    if 'statistics' in post_fill: raw_seg = np.maximum(components, 0)
+
+    # get the label of the first background component in this block
+    background_start_label = -1 - (data.IndexFromIndices(iz, iy, ix) * data.BlockVolume())
+
+    # remove all the holes with the associated labels of this block
     hole_fill_time = time.time()
-    components = AssignBackgroundAssociatedLabels(components, associated_label_dict)
+    components = AssignBackgroundAssociatedLabels(components, associated_labels, background_start_label)
     hole_fill_time = time.time() - hole_fill_time
 
     # write the updated components to disk
     write_time = time.time()
     output_directory = data.HoleFillingOutputDirectory()
     output_filename = '{}/{:04d}z-{:04d}y-{:04d}x.h5'.format(output_directory, iz, iy, ix)
-    WriteH5File(components, output_filename)
+    WriteH5File(components, output_filename, compression = data.H5Compression(), chunks = data.H5ChunkSize())
     write_time = time.time() - write_time
 
     total_time = time.time() - total_time
@@ -67,3 +67,15 @@ def RemoveHoles(data, iz, iy, ix):
         fd.write ('Hole Fill Time: {:0.2f} seconds.\n'.format(hole_fill_time))
         fd.write ('Write Time: {:0.2f} seconds.\n'.format(write_time))
         fd.write ('Total Time: {:0.2f} seconds.\n'.format(total_time))
+
+    # the later steps that read the filled block use the copy in memory instead
+    # (imported here so hole filling does not need the skeletonize extensions unless requested)
+    if 'walls' in post_fill:
+        from blockbased_synapseaware.skeletonize.anchors import SaveAnchorWalls
+        SaveAnchorWalls(data, iz, iy, ix, segmentation = components)
+    if 'surfaces' in post_fill:
+        from blockbased_synapseaware.utilities.surfaces import GenerateSurfacesPerBlock
+        GenerateSurfacesPerBlock(data, iz, iy, ix, segmentation = components)
+    if 'statistics' in post_fill:
+        from blockbased_synapseaware.evaluate.statistics import CalculatePerBlockStatistics
+        CalculatePerBlockStatistics(data, iz, iy, ix, raw_seg = raw_seg, seg = components)
@@ -26,7 +26,9 @@ for ix in range(data.StartX(), data.EndX()):
     assert (not data.SkeletonOutputDirectory() == None)
     os.makedirs(data.SkeletonOutputDirectory(), exist_ok=True)
 
-    SaveAnchorWalls(data, iz, iy, ix)
+    # hole filling already wrote the walls of this block
+    if not 'walls' in data.HoleFillingPostFill():
+        SaveAnchorWalls(data, iz, iy, ix)
 
     # Create and Write Success File
     WriteSuccessFile(data, "SK", 1, iz, iy, ix)
@@ -28,7 +28,9 @@ for ix in range(data.StartX(), data.EndX()):
     os.makedirs(data.HoleFillingOutputDirectory(), exist_ok=True)
 
     # compute the first step to fill holes in each block
-    CalculatePerBlockStatistics(data, iz, iy, ix)
+    # hole filling already wrote the statistics of this block
+    if not 'statistics' in data.HoleFillingPostFill():
+        CalculatePerBlockStatistics(data, iz, iy, ix)
 
     # Create and Write Success File
     WriteSuccessFile(data, "ST", 1, iz, iy, ix)
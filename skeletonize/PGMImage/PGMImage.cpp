@@ -97,7 +97,7 @@ void PGMImage::createBorder( int bwidth, unsigned char color )
 
 
 // iteration step
-unsigned long palagyi_fpta( PGMImage* img, queue<unsigned long> &contour, unsigned char* lut )
+unsigned long palagyi_fpta( PGMImage* img, queue<unsigned long> &contour, const unsigned char* lut )
 {
     unsigned long length = contour.size();
 
@@ -121,7 +121,8 @@ unsigned long palagyi_fpta( PGMImage* img, queue<unsigned long> &contour, unsign
             int endpoint = 0;
 
             if ( endpoint == 0 ) {
-                if ( lut[code] == 1 ) deletable.push(p); else contour.push(p);
+                // the lookup table is bit packed with eight entries per byte
+                if ( lut[code >> 3] & ( 1 << ( code & 7 ) ) ) deletable.push(p); else contour.push(p);
             }
         }
     }
@@ -146,7 +147,7 @@ unsigned long palagyi_fpta( PGMImage* img, queue<unsigned long> &contour, unsign
 
 
 
-void fpta_thinning( PGMImage* img, unsigned char *lut, unsigned char *lut2 )
+void fpta_thinning( PGMImage* img, const unsigned char *lut, const unsigned char *lut2 )
 {
     queue<unsigned long> contour;
     int w = img->width, h = img->height;
@@ -176,34 +177,8 @@ void fpta_thinning( PGMImage* img, unsigned char *lut, unsigned char *lut2 )
 
 
 
-void ThinImage(const char *lookup_table_directory, PGMImage* img, std::vector<long> &iu_centers, std::vector<long> &iv_centers)
+void ThinImage(const unsigned char *lut, PGMImage* img, std::vector<long> &iu_centers, std::vector<long> &iv_centers)
 {
-    FILE* fp = NULL;
-
-    char lookup_table_filename[4096];
-    snprintf(lookup_table_filename, 4096, "%s/ronse_fpta.lut", lookup_table_directory);
-    fp = fopen( lookup_table_filename, "rb" );
-
-    unsigned char* lut = NULL;
-    lut = (unsigned char*) malloc ( 16777216 * sizeof(unsigned char) );
-    if ( !lut ) {
-        fprintf(stderr, "Cannot allocate memory for LUT \n"); exit(-1);
-        fflush(fp);
-        fclose(fp);
-    }
-
-    unsigned long i = 0;
-    int read = 0;
-    while( !feof(fp) ) {
-        unsigned char bits;
-        read += fread( &bits, sizeof(unsigned char), 1, fp );
-        for ( unsigned int j = 0, k=1; j < 8; j++, k*=2, i++ ) {
-            if ( (bits & k) > 0 ) lut[i] = 1; else lut[i] = 0;
-        }
-    }
-
-    if (read != 2097152) { fprintf(stderr, "Failed to read LUT \n"); exit(-1); }
-
     unsigned long nobject = 0;
     unsigned long index = 0;
     for ( int y = 0; y < img->height; y++ ) {
@@ -237,8 +212,4 @@ void ThinImage(const char *lookup_table_directory, PGMImage* img, std::vector<lo
     }
 
     delete img;
-
-    free( lut );
-    fflush(fp);
-    fclose(fp);
 }
@@ -17,6 +17,6 @@ class PGMImage {
 
 
 
-void ThinImage(const char *lookup_table_directory, PGMImage* img, std::vector<long> &iu_centers, std::vector<long> &iv_centers);
+void ThinImage(const unsigned char *lut, PGMImage* img, std::vector<long> &iu_centers, std::vector<long> &iv_centers);
 
 #endif
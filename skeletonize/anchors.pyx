@@ -18,6 +18,7 @@ from blockbased_synapseaware.utilities.dataIO import ReadH5File, WriteH5File
 
 
 cdef extern from 'cpp-skeletonize.h':
+    void CppInitializeFPTALookupTable(const char *lookup_table_directory)
     void CppComputeAnchorPoints(const char *lookup_table_directory,
                                 const char *tmp_current_directory,
                                 const char *tmp_neighbor_directory,
@@ -30,30 +31,39 @@ cdef extern from 'cpp-skeletonize.h':
 
 
 
-def SaveAnchorWalls(data, iz, iy, ix):
-    # start timing statistics
-    total_time = time.time()
+def InitializeLookupTables():
+    # map the fpta lookup table into the process-wide cache ahead of time
+    # later calls in this process reuse the mapped table
+    lookup_table_directory = '{}/PGMImage'.format(os.path.dirname(__file__))
+
+    CppInitializeFPTALookupTable(lookup_table_directory.encode('utf-8'))
 
-    # read in the original segmentation
-    read_time = time.time()
-    segmentation = data.ReadSegmentationBlock(iz, iy, ix)
-    read_time = time.time() - read_time
 
-    # write the walls for the segmentation to file
-    write_time = time.time()
+
+def SaveAnchorWalls(data, iz, iy, ix, segmentation = None):
+    # start timing statistics
+    total_time = time.time()
 
     # get the temp directory for this block
     tmp_directory = data.TempBlockDirectory(iz, iy, ix)
     if not os.path.exists(tmp_directory):
         os.makedirs(tmp_directory, exist_ok=True)
 
-    WriteH5File(segmentation[0,:,:], '{}/z-min-anchor-points.h5'.format(tmp_directory))
-    WriteH5File(segmentation[-1,:,:], '{}/z-max-anchor-points.h5'.format(tmp_directory))
-    WriteH5File(segmentation[:,0,:], '{}/y-min-anchor-points.h5'.format(tmp_directory))
-    WriteH5File(segmentation[:,-1,:], '{}/y-max-anchor-points.h5'.format(tmp_directory))
-    WriteH5File(segmentation[:,:,0], '{}/x-min-anchor-points.h5'.format(tmp_directory))
-    WriteH5File(segmentation[:,:,-1], '{}/x-max-anchor-points.h5'.format(tmp_directory))
-    write_time = time.time() - write_time
+    read_time = 0
+    write_time = 0
+
+    # read only the six walls of the segmentation and write them to file
+    for axis in ['z', 'y', 'x']:
+        for side in ['min', 'max']:
+            wall_read_time = time.time()
+            # slice the wall from the segmentation if the block is already in memory
+            if segmentation is None: segmentation_wall = data.ReadSegmentationWall(iz, iy, ix, axis, side)
+            else: segmentation_wall = segmentation[data.WallWindow(axis, side)]
+            read_time += time.time() - wall_read_time
+
+            wall_write_time = time.time()
+            WriteH5File(segmentation_wall, '{}/{}-{}-anchor-points.h5'.format(tmp_directory, axis, side), compression = data.H5Compression())
+            write_time += time.time() - wall_write_time
 
     total_time = time.time() - total_time
 
@@ -3,6 +3,28 @@
 
 
 
+// constant variables
+
+static const long lookup_table_size = 1 << 21;
+
+// lookup tables (bit packed)
+
+static const unsigned char *lut_fpta;
+
+
+
+void CppInitializeFPTALookupTable(const char *lookup_table_directory)
+{
+    // read the fpta lookup table
+    char lut_filename[4096];
+    snprintf(lut_filename, 4096, "%s/ronse_fpta.lut", lookup_table_directory);
+
+    // the lookup table is mapped once per process and shared between walls
+    lut_fpta = MapLookupTable(lut_filename, lookup_table_size);
+}
+
+
+
 
 void CppComputeAnchorPoints(const char *lookup_table_directory,
                             const char *tmp_current_directory,
@@ -78,9 +100,12 @@ void CppComputeAnchorPoints(const char *lookup_table_directory,
     std::unordered_map<long, std::vector<long> > iu_centers = std::unordered_map<long, std::vector<long> >();
     std::unordered_map<long, std::vector<long> > iv_centers = std::unordered_map<long, std::vector<long> >();
 
+    // initialize the lookup table
+    CppInitializeFPTALookupTable(lookup_table_directory);
+
     // for each label, thin the overlap
     for (std::unordered_map <long, PGMImage *>::iterator it = images.begin(); it != images.end(); ++it) {
-        ThinImage(lookup_table_directory, it->second, iu_centers[it->first], iv_centers[it->first]);
+        ThinImage(lut_fpta, it->second, iu_centers[it->first], iv_centers[it->first]);
     }
 
     // get the current and neighbor filename for output
@@ -106,6 +131,12 @@ void CppComputeAnchorPoints(const char *lookup_table_directory,
     long current_checksum = 0;
     long neighbor_checksum = 0;
 
+    // keep track of where each label is in the files for the label tables
+    std::vector<long> table_labels = std::vector<long>();
+    std::vector<long> current_offsets = std::vector<long>();
+    std::vector<long> neighbor_offsets = std::vector<long>();
+    std::vector<long> counts = std::vector<long>();
+
     // iterate over all labels in the volume
     for (std::unordered_map<long, std::vector<long> >::iterator it = iu_centers.begin(); it != iu_centers.end(); ++it) {
         long label = it->first;
@@ -118,6 +149,11 @@ void CppComputeAnchorPoints(const char *lookup_table_directory,
         if (fwrite(&nanchors, sizeof(long), 1, current_fp) != 1) { fprintf(stderr, "Failed to write to %s.\n", current_output_filename); exit(-1); }
         if (fwrite(&nanchors, sizeof(long), 1, neighbor_fp) != 1) { fprintf(stderr, "Failed to write to %s.\n", neighbor_output_filename); exit(-1); }
 
+        table_labels.push_back(label);
+        current_offsets.push_back(ftell(current_fp));
+        neighbor_offsets.push_back(ftell(neighbor_fp));
+        counts.push_back(nanchors);
+
         // create arrays for the local locations of the anchors points
         long *current_local_indices = new long[nanchors];
         long *neighbor_local_indices = new long[nanchors];
@@ -208,6 +244,10 @@ void CppComputeAnchorPoints(const char *lookup_table_directory,
     if (fwrite(&current_checksum, sizeof(long), 1, current_fp) != 1) { fprintf(stderr, "Failed to write to %s.\n", current_output_filename); exit(-1); }
     if (fwrite(&neighbor_checksum, sizeof(long), 1, neighbor_fp) != 1) { fprintf(stderr, "Failed to write to %s.\n", neighbor_output_filename); exit(-1); }
 
+    // write the label tables for random access
+    WritePtsFileFooter(current_fp, table_labels, current_offsets, counts);
+    WritePtsFileFooter(neighbor_fp, table_labels, neighbor_offsets, counts);
+
     // close files
     fclose(current_fp);
     fclose(neighbor_fp);
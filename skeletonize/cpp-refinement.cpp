@@ -1,15 +1,10 @@
 #include "cpp-skeletonize.h"
-#include "cpp-MinBinaryHeap.h"
+#include <algorithm>
 
 
 
-// struct for Dijkstra's algorithm
-struct DijkstraData {
-    long iv;
-    DijkstraData *prev;
-    float distance;
-    bool visited;
-};
+// the number of neighbors in the 26-connected neighborhood
+#define NNEIGHBORS 26
 
 
 
@@ -111,117 +106,191 @@ static void WriteTempFiles(const char *tmp_directory, long label)
 
 
 
-static void RunDijkstrasAlgorithm(const char *skeleton_output_directory, long label)
+static void ComputeEdgeLengths(float edge_lengths[NNEIGHBORS])
 {
-    // a mapping from linear global indices to indices in a dijkstra array data structure
-    std::unordered_map<long, long> dijkstra_map = std::unordered_map<long, long>();
+    // the edge lengths follow the order of the neighbors (z, then y, then x)
+    long ie = 0;
+    for (long iw = -1; iw <= 1; ++iw) {
+        for (long iv = -1; iv <= 1; ++iv) {
+            for (long iu = -1; iu <= 1; ++iu) {
+                // do not include the voxel itself
+                if (!iw and !iv and !iu) continue;
+
+                // find the distance between these two voxels
+                long deltaz = resolution[OR_Z] * iw;
+                long deltay = resolution[OR_Y] * iv;
+                long deltax = resolution[OR_X] * iu;
+
+                edge_lengths[ie] = sqrt(deltax * deltax + deltay * deltay + deltaz * deltaz);
+                ++ie;
+            }
+        }
+    }
+}
+
+
+
+static void BuildAdjacency(std::vector<long> &voxels, std::vector<long> &offsets, std::vector<long> &neighbors, std::vector<char> &edges)
+{
+    // create a compressed sparse row adjacency over the sorted voxels
+    long nvoxels = voxels.size();
+
+    // the three neighbors along x with the same z and y are consecutive in the sorted voxels
+    long row_offsets[9];
+    for (long iw = -1; iw <= 1; ++iw) {
+        for (long iv = -1; iv <= 1; ++iv) {
+            row_offsets[3 * (iw + 1) + (iv + 1)] = iw * padded_volume_size[OR_Y] * padded_volume_size[OR_X] + iv * padded_volume_size[OR_X] - 1;
+        }
+    }
+
+    // the first pass counts the neighbors of every voxel and the second pass stores them
+    offsets = std::vector<long>(nvoxels + 1, 0);
+    for (long pass = 0; pass < 2; ++pass) {
+        if (pass) {
+            neighbors = std::vector<long>(offsets[nvoxels]);
+            edges = std::vector<char>(offsets[nvoxels]);
+        }
+
+        // the start of each of the nine rows only moves forward as the voxels increase
+        long row_starts[9] = { 0 };
+        long nneighbors = 0;
+
+        for (long index = 0; index < nvoxels; ++index) {
+            long ie = 0;
+            for (long row = 0; row < 9; ++row) {
+                long row_index = voxels[index] + row_offsets[row];
+                while (row_starts[row] < nvoxels and voxels[row_starts[row]] < row_index) ++row_starts[row];
+
+                long neighbor = row_starts[row];
+                for (long iu = 0; iu < 3; ++iu) {
+                    // do not include the voxel itself
+                    if (row == 4 and iu == 1) { ++neighbor; continue; }
+
+                    // skip if background
+                    if (neighbor < nvoxels and voxels[neighbor] == row_index + iu) {
+                        if (pass) {
+                            neighbors[nneighbors] = neighbor;
+                            edges[nneighbors] = ie;
+                        }
+                        ++nneighbors;
+                        ++neighbor;
+                    }
+
+                    ++ie;
+                }
+            }
+
+            if (!pass) offsets[index + 1] = nneighbors;
+        }
+    }
+}
+
+
 
+static void RunDijkstrasAlgorithm(const char *tmp_directory, const char *skeleton_output_directory, long label)
+{
+    // the voxels of this label in increasing order are the nodes of the graph
     long nvoxels = segments[label].size();
-    DijkstraData *voxel_data = new DijkstraData[nvoxels];
-    if (!voxel_data) exit(-1);
+    std::vector<long> voxels = std::vector<long>();
+    voxels.reserve(nvoxels);
+
+    std::unordered_map<long, char>::iterator it;
+    for (it = segments[label].begin(); it != segments[label].end(); ++it)
+        voxels.push_back(it->first);
+    std::sort(voxels.begin(), voxels.end());
 
     printf("  Points Before Refinement: %ld\n", nvoxels);
 
-    // create a min binary heap
-    DijkstraData tmp;
-    MinBinaryHeap<DijkstraData *> voxel_heap(&tmp, &(tmp.distance), nvoxels);
+    // get the neighbors of every voxel and the lengths of the 26 edge types
+    std::vector<long> offsets, neighbors;
+    std::vector<char> edges;
+    BuildAdjacency(voxels, offsets, neighbors, edges);
+
+    float edge_lengths[NNEIGHBORS];
+    ComputeEdgeLengths(edge_lengths);
 
     // create sufficiently large value for infinity
     long infinity = padded_volume_size[OR_Z] * padded_volume_size[OR_Z] + padded_volume_size[OR_Y] * padded_volume_size[OR_Y] + padded_volume_size[OR_X] * padded_volume_size[OR_X];
 
-    // initialize all data
-    long index = 0;
-    std::unordered_map<long, char>::iterator it;
-    for (it = segments[label].begin(); it != segments[label].end(); ++it, ++index) {
-        voxel_data[index].iv = it->first;               // voxel index
-        voxel_data[index].prev = NULL;
-        voxel_data[index].distance = infinity;
-        voxel_data[index].visited = false;
-        dijkstra_map[it->first] = index;
-
+    std::vector<float> distances = std::vector<float>(nvoxels, infinity);
+    std::vector<long> previous = std::vector<long>(nvoxels, -1);
+    std::vector<bool> visited = std::vector<bool>(nvoxels, false);
+    std::vector<bool> finalized = std::vector<bool>(nvoxels, false);
+
+    // buckets are as wide as the shortest edge so no voxel can improve another voxel in the same bucket
+    // every queued voxel is at most the longest edge past the current bucket so the buckets form a ring
+    float bucket_width = *std::min_element(edge_lengths, edge_lengths + NNEIGHBORS);
+    float longest_edge = *std::max_element(edge_lengths, edge_lengths + NNEIGHBORS);
+    if (bucket_width <= 0) bucket_width = 1;
+    long nbuckets = (long) ceil(longest_edge / bucket_width) + 2;
+    std::vector<std::vector<long> > buckets = std::vector<std::vector<long> >(nbuckets);
+
+    long nqueued = 0;
+    for (long index = 0; index < nvoxels; ++index) {
         // somata surface points are anchor points
         // a designated synapse receives a value of 2 and is also source
-        if (not (it->second % 2)) {
-            // insert the source into the heap
-            voxel_data[index].distance = 0.0;
-            voxel_data[index].visited = true;
-            voxel_heap.Insert(index, &(voxel_data[index]));
+        if (not (segments[label][voxels[index]] % 2)) {
+            distances[index] = 0.0;
+            visited[index] = true;
+            buckets[0].push_back(index);
+            ++nqueued;
         }
     }
 
-    long voxel_index;
-    while (!voxel_heap.IsEmpty()) {
-        DijkstraData *current = voxel_heap.DeleteMin();
-        voxel_index = current->iv;
+    for (long current_bucket = 0; nqueued; ++current_bucket) {
+        // voxels can be added to the current bucket while it is processed
+        std::vector<long> &bucket = buckets[current_bucket % nbuckets];
 
-        // visit all 26 neighbors of this index
-        long iz, iy, ix;
-        GlobalPaddedIndexToPaddedIndices(voxel_index, iz, iy, ix);
+        for (unsigned long ib = 0; ib < bucket.size(); ++ib) {
+            long index = bucket[ib];
+            --nqueued;
 
-        for (long iw = iz - 1; iw <= iz + 1; ++iw) {
-            for (long iv = iy - 1; iv <= iy + 1; ++iv) {
-                for (long iu = ix - 1; iu <= ix + 1; ++iu) {
-                    // do not iterate over itself
-                    if (iw == iz and iv == iy and iu == ix) continue;
+            // skip entries left behind when the distance decreased
+            if (finalized[index]) continue;
+            finalized[index] = true;
 
-                    // get the linear index for this voxel
-                    long neighbor_index = GlobalPaddedIndicesToPaddedIndex(iw, iv, iu);
+            for (long ie = offsets[index]; ie < offsets[index + 1]; ++ie) {
+                long neighbor = neighbors[ie];
+                if (finalized[neighbor]) continue;
 
-                    // skip if background
-                    if (!segments[label][neighbor_index]) continue;
+                // get the distance to get to this voxel through the current voxel
+                float distance_through_current = distances[index] + edge_lengths[(long) edges[ie]];
 
-                    // get the corresponding neighbor data
-                    long dijkstra_index = dijkstra_map[neighbor_index];
-                    DijkstraData *neighbor_data = &(voxel_data[dijkstra_index]);
+                if (!visited[neighbor] or distance_through_current < distances[neighbor]) {
+                    previous[neighbor] = index;
+                    distances[neighbor] = distance_through_current;
+                    visited[neighbor] = true;
 
-                    // find the distance between these two voxels
-                    long deltaz = resolution[OR_Z] * (iw - iz);
-                    long deltay = resolution[OR_Y] * (iv - iy);
-                    long deltax = resolution[OR_X] * (iu - ix);
-
-                    // get the distance between the two voxels
-                    float distance = sqrt(deltax * deltax + deltay * deltay + deltaz * deltaz);
-
-                    // get the distance to get to this voxel through the current voxel (requires a penalty for visiting this voxel)
-                    float distance_through_current = current->distance + distance;
-                    float distance_without_current = neighbor_data->distance;
-
-                    if (!neighbor_data->visited) {
-                        neighbor_data->prev = current;
-                        neighbor_data->distance = distance_through_current;
-                        neighbor_data->visited = true;
-                        voxel_heap.Insert(dijkstra_index, neighbor_data);
-                    }
-                    else if (distance_through_current < distance_without_current) {
-                        neighbor_data->prev = current;
-                        neighbor_data->distance = distance_through_current;
-                        voxel_heap.DecreaseKey(dijkstra_index, neighbor_data);
-                    }
+                    // rounding can place the neighbor in the current bucket but never earlier
+                    long neighbor_bucket = std::max(current_bucket, (long) (distance_through_current / bucket_width));
+                    buckets[neighbor_bucket % nbuckets].push_back(neighbor);
+                    ++nqueued;
                 }
             }
         }
+
+        bucket.clear();
     }
 
-    std::unordered_set<long> refined_skeleton = std::unordered_set<long>();
+    std::vector<bool> refined_skeleton = std::vector<bool>(nvoxels, false);
+    std::vector<bool> backtracked = std::vector<bool>(nvoxels, false);
 
     // iterate over every synapse until it reaches the source
     std::unordered_set<long>::iterator it2;
     for (it2 = fixed_points[label].begin(); it2 != fixed_points[label].end(); ++it2) {
-        long padded_global_index = *it2;
+        long index = std::lower_bound(voxels.begin(), voxels.end(), *it2) - voxels.begin();
 
-        long dijkstra_index = dijkstra_map[padded_global_index];
-        DijkstraData *data = &(voxel_data[dijkstra_index]);
+        // previous is -1 for the sources only
+        // the rest of the path is shared with an earlier synapse once a backtracked voxel is reached
+        while (index != -1 and !backtracked[index]) {
+            backtracked[index] = true;
 
-        // data->prev = NULL for the sources only
-        while (data != NULL) {
             // add to the list of skeleton points
-            long iv = data->iv;
-
-            if (segments[label][iv] != 4) {
-                refined_skeleton.insert(iv);
+            if (segments[label][voxels[index]] != 4) {
+                refined_skeleton[index] = true;
             }
 
-            data = data->prev;
+            index = previous[index];
         }
     }
 
@@ -230,42 +299,48 @@ static void RunDijkstrasAlgorithm(const char *skeleton_output_directory, long la
     snprintf(skeleton_filename, 4096, "%s/skeletons/%016ld.pts", skeleton_output_directory, label);
     char distance_filename[4096];
     snprintf(distance_filename, 4096, "%s/distances/%016ld.pts", skeleton_output_directory, label);
+    char parent_filename[4096];
+    snprintf(parent_filename, 4096, "%s/parents/%016ld.pts", tmp_directory, label);
 
-    // open both files
+    // open all three files
     FILE *fp = fopen(skeleton_filename, "wb");
     if (!fp) { fprintf(stderr, "Failed to write to %s.\n", skeleton_filename); exit(-1); }
     FILE *distance_fp = fopen(distance_filename, "wb");
     if (!distance_fp) { fprintf(stderr, "Failed to write to %s.\n", distance_filename); exit(-1); }
+    FILE *parent_fp = fopen(parent_filename, "wb");
+    if (!parent_fp) { fprintf(stderr, "Failed to write to %s.\n", parent_filename); exit(-1); }
 
     WritePtsFileHeader(fp, 1);
     WritePtsFileHeader(distance_fp, 1);
+    WritePtsFileHeader(parent_fp, 1);
 
-    long num = refined_skeleton.size();
+    long num = std::count(refined_skeleton.begin(), refined_skeleton.end(), true);
 
     // write the label and number of voxels
     if (fwrite(&label, sizeof(long), 1, fp) != 1) { fprintf(stderr, "Failed to write to %s.\n", skeleton_filename); exit(-1); }
     if (fwrite(&num, sizeof(long), 1, fp) != 1) { fprintf(stderr, "Failed to write to %s.\n", skeleton_filename); exit(-1); }
     if (fwrite(&label, sizeof(long), 1, distance_fp) != 1) { fprintf(stderr, "Failed to write to %s.\n", distance_filename); exit(-1); }
     if (fwrite(&num, sizeof(long), 1, distance_fp) != 1) { fprintf(stderr, "Failed to write to %s.\n", distance_filename); exit(-1); }
+    if (fwrite(&label, sizeof(long), 1, parent_fp) != 1) { fprintf(stderr, "Failed to write to %s.\n", parent_filename); exit(-1); }
+    if (fwrite(&num, sizeof(long), 1, parent_fp) != 1) { fprintf(stderr, "Failed to write to %s.\n", parent_filename); exit(-1); }
 
     long *global_indices = new long[num];
     long *local_indices = new long[num];
+    long *parent_indices = new long[num];
     float *output_distances = new float[num];
 
     long checksum = 0;
+    long parent_checksum = 0;
 
-    // iterate over the refined skeletons
+    // iterate over the refined skeletons in increasing order
     long iv = 0;
-    for (it2 = refined_skeleton.begin(); it2 != refined_skeleton.end(); ++it2, ++iv) {
-        long padded_global_index = *it2;
+    for (long index = 0; index < nvoxels; ++index) {
+        if (!refined_skeleton[index]) continue;
 
         // get the global index, local index, and distance
-        long global_index = GlobalPaddedIndexToIndex(padded_global_index);
+        long global_index = GlobalPaddedIndexToIndex(voxels[index]);
         long local_index = GlobalIndexToLocalIndex(global_index);
 
-        long dijkstra_index = dijkstra_map[padded_global_index];
-        DijkstraData *dijkstra_data = &(voxel_data[dijkstra_index]);
-
         // a weird artifact of somata downsampling...a voxel can be on the surface of the downsampled
         // somata detected image slices but not on the surface of the full reoslution image slices.
         // these synapse points have no neighbors since they are on the cell body surface which doesn't
@@ -273,16 +348,24 @@ static void RunDijkstrasAlgorithm(const char *skeleton_output_directory, long la
         // when this occurs the voxel is not visited and has a distance of infinity.
         // reset the distance here to 0
         float distance;
-        if (dijkstra_data->visited) distance = dijkstra_data->distance;
+        if (visited[index]) distance = distances[index];
         else distance = 0.0;
 
+        // the parent is the next voxel towards the source (sources and voxels next to the somata surface have none)
+        long parent_index = -1;
+        if (previous[index] != -1 and refined_skeleton[previous[index]]) parent_index = GlobalPaddedIndexToIndex(voxels[previous[index]]);
+
         // update the arrays
         global_indices[iv] = global_index;
         local_indices[iv] = local_index;
+        parent_indices[iv] = parent_index;
         output_distances[iv] = distance;
 
-        // update the checksum
+        // update the checksums
         checksum += (global_indices[iv] + local_indices[iv]);
+        parent_checksum += (global_indices[iv] + parent_indices[iv]);
+
+        ++iv;
     }
 
     // write all of the global and local indices to file
@@ -298,16 +381,24 @@ static void RunDijkstrasAlgorithm(const char *skeleton_output_directory, long la
         if (fwrite(&(output_distances[ie]), sizeof(float), 1, distance_fp) != 1) { fprintf(stderr, "Failed to write to %s.\n", distance_filename); exit(-1); }
     }
 
+    // write the global indices and the global indices of their parents
+    if (fwrite(&(global_indices[0]), sizeof(long), num, parent_fp) != (unsigned long) num) { fprintf(stderr, "Failed to write to %s.\n", parent_filename); exit(-1); }
+    if (fwrite(&(parent_indices[0]), sizeof(long), num, parent_fp) != (unsigned long) num) { fprintf(stderr, "Failed to write to %s.\n", parent_filename); exit(-1); }
+
+    // write the checksum
+    if (fwrite(&parent_checksum, sizeof(long), 1, parent_fp) != 1) { fprintf(stderr, "Failed to write to %s.\n", parent_filename); exit(-1); }
+
     // close the files
     fclose(fp);
     fclose(distance_fp);
+    fclose(parent_fp);
 
     printf("  Points After Refinement: %ld\n", num);
 
     // free memory
-    delete[] voxel_data;
     delete[] global_indices;
     delete[] local_indices;
+    delete[] parent_indices;
     delete[] output_distances;
 }
 
@@ -320,8 +411,8 @@ void CppSkeletonRefinement(const char *tmp_directory,
                            float input_resolution[3],
                            long input_volume_size[3],
                            long input_block_size[3],
-                           long start_indices[3],
-                           long nblocks[3])
+                           long nentries,
+                           long *index_entries)
 {
     // update global variables given input values
     for (long iv = 0; iv < NDIMS; ++iv) {
@@ -338,55 +429,75 @@ void CppSkeletonRefinement(const char *tmp_directory,
 
     bool somata_exists = false;
 
-    // iterate through all blocks and read the synapses, skeletons, and somae surfaces
-    for (long iz = start_indices[OR_Z]; iz < start_indices[OR_Z] + nblocks[OR_Z]; ++iz) {
-        for (long iy = start_indices[OR_Y]; iy < start_indices[OR_Y] + nblocks[OR_Y]; ++iy) {
-            for (long ix = start_indices[OR_X]; ix < start_indices[OR_X] + nblocks[OR_X]; ++ix) {
-                // read in the somata file if it exists for this label for this block
-                // this must occur first so that skeletons and synapses can override the default somata surface value of 4
-                char somata_filename[4096];
-                snprintf(somata_filename, 4096, "%s/%04ldz-%04ldy-%04ldx/somata_surfaces/%016ld.pts", tmp_directory, iz, iy, ix, label);
-
-                // open the file, if it exists
-                FILE *somata_fp = fopen(somata_filename, "rb");
-                if (somata_fp) {
-                    // read in the points using global coordinates, a mapped value of 3, without populating the fixed point array
-                    if (!ReadPtsFile(somata_fp, false, 4, false)) { fprintf(stderr, "Failed to read %s.\n", somata_filename); exit(-1); }
-
-                    // close the file
-                    fclose(somata_fp);
-
-                    // a cell body exists for this element
-                    somata_exists = true;
-                }
+    // iterate through the blocks that contain this label (in sequential order) and read the synapses, skeletons, and somae surfaces
+    // each index entry contains the block (z, y, x), whether somata and skeleton files exist, and the synapse offset and count
+    for (long ie = 0; ie < nentries; ++ie) {
+        long *entry = &(index_entries[7 * ie]);
+        long iz = entry[0];
+        long iy = entry[1];
+        long ix = entry[2];
+        bool somata_surface_exists = entry[3];
+        bool skeleton_exists = entry[4];
+        long synapse_offset = entry[5];
+        long nsynapses = entry[6];
+
+        // read in the somata file if it exists for this label for this block
+        // this must occur first so that skeletons and synapses can override the default somata surface value of 4
+        if (somata_surface_exists) {
+            char somata_filename[4096];
+            snprintf(somata_filename, 4096, "%s/%04ldz-%04ldy-%04ldx/somata_surfaces/%016ld.pts", tmp_directory, iz, iy, ix, label);
+
+            // open the file
+            FILE *somata_fp = fopen(somata_filename, "rb");
+            if (!somata_fp) { fprintf(stderr, "Failed to read %s.\n", somata_filename); exit(-1); }
+
+            // read in the points using global coordinates, a mapped value of 4, without populating the fixed point array
+            if (!ReadPtsFile(somata_fp, false, 4, false)) { fprintf(stderr, "Failed to read %s.\n", somata_filename); exit(-1); }
+
+            // close the file
+            fclose(somata_fp);
+
+            // a cell body exists for this element
+            somata_exists = true;
+        }
 
-                // must read skeletons after somata but before synapses
-                char skeleton_filename[4096];
-                snprintf(skeleton_filename, 4096, "%s/%04ldz-%04ldy-%04ldx/skeletons/%016ld.pts", tmp_directory, iz, iy, ix, label);
+        // must read skeletons after somata but before synapses
+        if (skeleton_exists) {
+            char skeleton_filename[4096];
+            snprintf(skeleton_filename, 4096, "%s/%04ldz-%04ldy-%04ldx/skeletons/%016ld.pts", tmp_directory, iz, iy, ix, label);
 
-                // open the file, if it exists
-                FILE *skeleton_fp = fopen(skeleton_filename, "rb");
-                if (skeleton_fp) {
-                    // read in the points using global coordinates, a mapped value of 1, without populating the fixed point array
-                    if (!ReadPtsFile(skeleton_fp, false, 1, false)) { fprintf(stderr, "Failed to read %s.\n", skeleton_filename); exit(-1); }
+            // open the file
+            FILE *skeleton_fp = fopen(skeleton_filename, "rb");
+            if (!skeleton_fp) { fprintf(stderr, "Failed to read %s.\n", skeleton_filename); exit(-1); }
 
-                    // close the file
-                    fclose(skeleton_fp);
-                }
+            // read in the points using global coordinates, a mapped value of 1, without populating the fixed point array
+            if (!ReadPtsFile(skeleton_fp, false, 1, false)) { fprintf(stderr, "Failed to read %s.\n", skeleton_filename); exit(-1); }
+
+            // close the file
+            fclose(skeleton_fp);
+        }
+
+        // must read synapses last to make sure they do not receive a value of 1 (from skeletons) or 4 (from somata surfaces)
+        if (nsynapses) {
+            char synapse_filename[4096];
+            snprintf(synapse_filename, 4096, "%s/%04ldz-%04ldy-%04ldx.pts", synapse_directory, iz, iy, ix);
 
-                // must read synapses last to make sure they do not receive a value of 1 (from skeletons) or 4 (from somata surfaces)
-                char synapse_filename[4096];
-                snprintf(synapse_filename, 4096, "%s/%04ldz-%04ldy-%04ldx.pts", synapse_directory, iz, iy, ix);
+            // open the file
+            FILE *synapse_fp = fopen(synapse_filename, "rb");
+            if (!synapse_fp) { fprintf(stderr, "Failed to read %s.\n", synapse_filename); exit(-1); }
 
-                // open the file
-                FILE *synapse_fp = fopen(synapse_filename, "rb");
-                if (!synapse_fp) { fprintf(stderr, "Failed to read %s.\n", synapse_filename); exit(-1); }
+            // read only the points for this label using global coordinates
+            std::vector<long> padded_indices = std::vector<long>();
+            if (!ReadPtsFileLabel(synapse_fp, synapse_offset, nsynapses, padded_indices)) { fprintf(stderr, "Failed to read %s.\n", synapse_filename); exit(-1); }
 
-                // read in the points using global coordinates, a mapped value of 3, and populating fixed point array
-                if (!ReadPtsFile(synapse_fp, false, 3, true)) { fprintf(stderr, "Failed to read %s.\n", synapse_filename); exit(-1); }
+            // close the file
+            fclose(synapse_fp);
 
-                // close the file
-                fclose(synapse_fp);
+            // synapses receive a mapped value of 3 and populate the fixed point array
+            std::vector<long>::iterator it;
+            for (it = padded_indices.begin(); it != padded_indices.end(); ++it) {
+                segments[label][*it] = 3;
+                fixed_points[label].insert(*it);
             }
         }
     }
@@ -406,7 +517,7 @@ void CppSkeletonRefinement(const char *tmp_directory,
     }
 
     printf("Processing Label: %ld\n", label);
-    RunDijkstrasAlgorithm(skeleton_output_directory, label);
+    RunDijkstrasAlgorithm(tmp_directory, skeleton_output_directory, label);
 
     // overwrite all global variables from this iteration
     fixed_points.clear();
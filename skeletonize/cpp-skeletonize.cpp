@@ -1,3 +1,9 @@
+#include <string>
+#include <mutex>
+#include <fcntl.h>
+#include <unistd.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
 #include "cpp-skeletonize.h"
 
 
@@ -13,6 +19,43 @@ std::unordered_map<long, std::unordered_map<long, char> > segments;
 
 
 
+// lookup tables stay mapped for the lifetime of the process
+static std::unordered_map<std::string, const unsigned char *> lookup_tables;
+static std::mutex lookup_table_mutex;
+
+
+
+const unsigned char *MapLookupTable(const char *lut_filename, long lut_size)
+{
+    // only one thread can update the lookup table cache at once
+    std::lock_guard<std::mutex> lock(lookup_table_mutex);
+
+    // return the lookup table if it is already mapped
+    std::unordered_map<std::string, const unsigned char *>::iterator it = lookup_tables.find(lut_filename);
+    if (it != lookup_tables.end()) return it->second;
+
+    // open the lookup table
+    int fd = open(lut_filename, O_RDONLY);
+    if (fd == -1) { fprintf(stderr, "Failed to read %s\n", lut_filename); exit(-1); }
+
+    // make sure that the lookup table has the expected size
+    struct stat status;
+    if (fstat(fd, &status) == -1 or status.st_size != lut_size) { fprintf(stderr, "Failed to read %s\n", lut_filename); exit(-1); }
+
+    // map the lookup table as read only memory shared between all users of the file
+    void *lut = mmap(NULL, lut_size, PROT_READ, MAP_SHARED, fd, 0);
+    if (lut == MAP_FAILED) { fprintf(stderr, "Failed to read %s\n", lut_filename); exit(-1); }
+
+    // the mapping remains valid after closing the file
+    close(fd);
+
+    lookup_tables[lut_filename] = (const unsigned char *) lut;
+
+    return (const unsigned char *) lut;
+}
+
+
+
 void WritePtsFileHeader(FILE *fp, long nlabels)
 {
     if (fwrite(&(volume_size[0]), sizeof(long), 3, fp) != 3) { fprintf(stderr, "Failed to write pts header.\n"); exit(-1); }
@@ -22,7 +65,26 @@ void WritePtsFileHeader(FILE *fp, long nlabels)
 
 
 
-int ReadPtsFile(FILE *fp, bool use_local_coordinates, char mapped_value, bool is_fixed_point)
+void WritePtsFileFooter(FILE *fp, std::vector<long> &labels, std::vector<long> &offsets, std::vector<long> &counts)
+{
+    // the table starts directly after the checksum
+    long table_offset = ftell(fp);
+    long nlabels = labels.size();
+
+    // write a (label, offset, count) row for every label
+    for (long iv = 0; iv < nlabels; ++iv) {
+        long row[3] = { labels[iv], offsets[iv], counts[iv] };
+        if (fwrite(&(row[0]), sizeof(long), 3, fp) != 3) { fprintf(stderr, "Failed to write pts footer.\n"); exit(-1); }
+    }
+
+    // write the trailer that identifies this as an indexed file
+    long trailer[4] = { table_offset, nlabels, PTS_INDEX_VERSION, PTS_INDEX_MAGIC };
+    if (fwrite(&(trailer[0]), sizeof(long), 4, fp) != 4) { fprintf(stderr, "Failed to write pts footer.\n"); exit(-1); }
+}
+
+
+
+int ReadPtsFile(FILE *fp, bool use_local_coordinates, std::vector<long> &labels, std::unordered_map<long, std::vector<long> > &padded_indices)
 {
     long input_volume_size[3];
     long input_block_size[3];
@@ -49,42 +111,30 @@ int ReadPtsFile(FILE *fp, bool use_local_coordinates, char mapped_value, bool is
         if (fread(&label, sizeof(long), 1, fp) != 1) return 0;
         if (fread(&nelements, sizeof(long), 1, fp) != 1) return 0;
 
+        // keep track of the order in which labels appear in the file
+        if (padded_indices.find(label) == padded_indices.end()) {
+            padded_indices[label] = std::vector<long>();
+            labels.push_back(label);
+        }
+        std::vector<long> &label_padded_indices = padded_indices[label];
+
         // create an array to read in all elements
         long *elements = new long[nelements];
 
-        // read in global coordinates (unused here)
+        // read in global coordinates
         if (fread(&(elements[0]), sizeof(long), nelements, fp) != (unsigned long) nelements) return 0;
         for (long ie = 0; ie < nelements; ++ie) {
-            // populate segments with global coordinates
-            if (not use_local_coordinates) {
-                long index = elements[ie];
-
-                // get the padded index
-                long padded_index = GlobalIndexToPaddedIndex(index);
-
-                // set the equivalent element in the segments array to the mapped value
-                segments[label][padded_index] = mapped_value;
-                if (is_fixed_point) fixed_points[label].insert(padded_index);
-            }
+            // add the padded global coordinates
+            if (not use_local_coordinates) label_padded_indices.push_back(GlobalIndexToPaddedIndex(elements[ie]));
 
             checksum += elements[ie];
         }
 
         // read in local coordinates
         if (fread(&(elements[0]), sizeof(long), nelements, fp) != (unsigned long) nelements) return 0;
-        // for each coordinate, get the padded index and mark as must remain
         for (long ie = 0; ie < nelements; ++ie) {
-            // populate segments with local coordinates
-            if (use_local_coordinates) {
-                long index = elements[ie];
-
-                // get the padded index
-                long padded_index = LocalIndexToPaddedIndex(index);
-
-                // set the equivalent element in the segments array to the mapped value
-                segments[label][padded_index] = mapped_value;
-                if (is_fixed_point) fixed_points[label].insert(padded_index);
-            }
+            // add the padded local coordinates
+            if (use_local_coordinates) label_padded_indices.push_back(LocalIndexToPaddedIndex(elements[ie]));
 
             checksum += elements[ie];
         }
@@ -101,3 +151,51 @@ int ReadPtsFile(FILE *fp, bool use_local_coordinates, char mapped_value, bool is
     // return success
     return 1;
 }
+
+
+
+int ReadPtsFileLabel(FILE *fp, long offset, long nelements, std::vector<long> &padded_indices)
+{
+    // move to the global indices of this label
+    if (fseek(fp, offset, SEEK_SET)) return 0;
+
+    // create an array to read in all elements
+    long *elements = new long[nelements];
+
+    // read in global coordinates
+    if (fread(&(elements[0]), sizeof(long), nelements, fp) != (unsigned long) nelements) { delete[] elements; return 0; }
+    for (long ie = 0; ie < nelements; ++ie) {
+        // add the padded global coordinates
+        padded_indices.push_back(GlobalIndexToPaddedIndex(elements[ie]));
+    }
+
+    // free memory
+    delete[] elements;
+
+    // return success
+    return 1;
+}
+
+
+
+int ReadPtsFile(FILE *fp, bool use_local_coordinates, char mapped_value, bool is_fixed_point)
+{
+    std::vector<long> labels = std::vector<long>();
+    std::unordered_map<long, std::vector<long> > padded_indices = std::unordered_map<long, std::vector<long> >();
+
+    if (!ReadPtsFile(fp, use_local_coordinates, labels, padded_indices)) return 0;
+
+    // set the equivalent elements in the segments array to the mapped value (in file order)
+    for (unsigned long il = 0; il < labels.size(); ++il) {
+        long label = labels[il];
+
+        std::vector<long>::iterator it;
+        for (it = padded_indices[label].begin(); it != padded_indices[label].end(); ++it) {
+            segments[label][*it] = mapped_value;
+            if (is_fixed_point) fixed_points[label].insert(*it);
+        }
+    }
+
+    // return success
+    return 1;
+}
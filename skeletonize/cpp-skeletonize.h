@@ -20,6 +20,13 @@
 
 
 
+// indexed pts files end with a table of (label, offset, count) entries and a trailer of
+// (table offset, number of labels, version, magic) after the checksum
+#define PTS_INDEX_MAGIC 0x5845444E49535450
+#define PTS_INDEX_VERSION 1
+
+
+
 // global variables
 extern float resolution[3];
 extern long volume_size[3];
@@ -53,7 +60,17 @@ void CppTopologicalThinning(const char *lookup_table_directory,
                             float input_resolution[3],
                             long input_volume_size[3],
                             long input_block_size[3],
-                            long current_block_index[3]);
+                            long current_block_index[3],
+                            long nthreads,
+                            long memory_budget);
+
+
+
+void CppInitializeSimpleLookupTable(const char *lookup_table_directory);
+
+
+
+void CppInitializeFPTALookupTable(const char *lookup_table_directory);
 
 
 
@@ -64,8 +81,12 @@ void CppSkeletonRefinement(const char *tmp_directory,
                            float input_resolution[3],
                            long input_volume_size[3],
                            long input_block_size[3],
-                           long start_indices[3],
-                           long nblocks[3]);
+                           long nentries,
+                           long *index_entries);
+
+
+
+const unsigned char *MapLookupTable(const char *lut_filename, long lut_size);
 
 
 
@@ -73,10 +94,22 @@ void WritePtsFileHeader(FILE *fp, long nlabels);
 
 
 
+void WritePtsFileFooter(FILE *fp, std::vector<long> &labels, std::vector<long> &offsets, std::vector<long> &counts);
+
+
+
+int ReadPtsFile(FILE *fp, bool use_local_coordinates, std::vector<long> &labels, std::unordered_map<long, std::vector<long> > &padded_indices);
+
+
+
 int ReadPtsFile(FILE *fp, bool use_local_coordinates, char mapped_value, bool is_fixed_point);
 
 
 
+int ReadPtsFileLabel(FILE *fp, long offset, long nelements, std::vector<long> &padded_indices);
+
+
+
 ///////////////////////////////////////////////////////////
 //// CONVERT AN INDEX INTO A COORDINATE SET OF INDICES ////
 ///////////////////////////////////////////////////////////
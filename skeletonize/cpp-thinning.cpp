@@ -1,4 +1,11 @@
 #include <limits>
+#include <mutex>
+#include <condition_variable>
+#include <thread>
+#include <sys/mman.h>
+#ifdef __GLIBC__
+#include <malloc.h>
+#endif
 #include "cpp-skeletonize.h"
 
 
@@ -9,7 +16,7 @@ static const int lookup_table_size = 1 << 23;
 
 // lookup tables
 
-static unsigned char *lut_simple;
+static const unsigned char *lut_simple;
 
 
 // global variables
@@ -30,19 +37,41 @@ static const int NTHINNING_DIRECTIONS = 6;
 
 
 
+// bounding box of a label in padded block coordinates
+typedef struct {
+    long min[3];
+    long max[3];
+    // number of voxels of the label in the block
+    long nvoxels;
+} BoundingBox;
+
+
+
+// labels are started in order once their dense volumes fit in the memory budget shared by the threads
+typedef struct {
+    std::mutex lock;
+    std::condition_variable released;
+    unsigned long next_label;
+    long memory_in_use;
+    long memory_budget;
+} ThinningSchedule;
+
+
+
 // aggregate variables for all blocks
 static std::unordered_set<long> labels_in_block;
+static std::unordered_map<long, BoundingBox> bounding_boxes;
+static std::unordered_map<long, std::vector<long> > ordered_fixed_points;
 static std::unordered_map<long, std::unordered_set<long> > somata_interior_voxels;
 static std::unordered_map<long, std::unordered_set<long> > somata_surface_voxels;
-static std::unordered_map<long, std::unordered_set<long> > *border_voxels;
 
 
 
 // mask variables for bitwise operations
 static long long_mask[26];
 static unsigned char char_mask[8];
-static long n26_offsets[26];
-static long n6_offsets[6];
+static thread_local long n26_offsets[26];
+static thread_local long n6_offsets[6];
 
 
 
@@ -92,49 +121,124 @@ static void set_char_mask(void)
 
 
 
+// variables for each processed label (one copy per thinning thread)
+static thread_local long current_label;
+// dense padded volume of the current label cropped to its bounding box
+static thread_local unsigned char *segment;
+// padded block coordinates of the first voxel and the dimensions of the dense volume
+static thread_local long segment_offset[3];
+static thread_local long segment_size[3];
+// one width per voxel of the label in raster order
+static thread_local float *widths;
+// runs of label voxels in each (z, y) row of the dense volume with the raster rank of their first voxel
+static thread_local long *row_runs;
+static thread_local long *run_starts;
+static thread_local long *run_ranks;
+static thread_local long nlabel_voxels;
+static thread_local long nlabel_runs;
+
+
+
 static void PopulateOffsets(void)
 {
-    n26_offsets[0] = -1 * padded_block_size[OR_Y] * padded_block_size[OR_X] - padded_block_size[OR_X] - 1;
-    n26_offsets[1] = -1 * padded_block_size[OR_Y] * padded_block_size[OR_X] - padded_block_size[OR_X];
-    n26_offsets[2] = -1 * padded_block_size[OR_Y] * padded_block_size[OR_X] - padded_block_size[OR_X] + 1;
-    n26_offsets[3] = -1 * padded_block_size[OR_Y] * padded_block_size[OR_X] - 1;
-    n26_offsets[4] = -1 * padded_block_size[OR_Y] * padded_block_size[OR_X];
-    n26_offsets[5] = -1 * padded_block_size[OR_Y] * padded_block_size[OR_X] + 1;
-    n26_offsets[6] = -1 * padded_block_size[OR_Y] * padded_block_size[OR_X] + padded_block_size[OR_X] - 1;
-    n26_offsets[7] = -1 * padded_block_size[OR_Y] * padded_block_size[OR_X] + padded_block_size[OR_X];
-    n26_offsets[8] = -1 * padded_block_size[OR_Y] * padded_block_size[OR_X] + padded_block_size[OR_X] + 1;
-
-    n26_offsets[9] = -1 * padded_block_size[OR_X] - 1;
-    n26_offsets[10] = -1 * padded_block_size[OR_X];
-    n26_offsets[11] = -1 * padded_block_size[OR_X] + 1;
+    // offsets are relative to the dense volume of the current label
+    n26_offsets[0] = -1 * segment_size[OR_Y] * segment_size[OR_X] - segment_size[OR_X] - 1;
+    n26_offsets[1] = -1 * segment_size[OR_Y] * segment_size[OR_X] - segment_size[OR_X];
+    n26_offsets[2] = -1 * segment_size[OR_Y] * segment_size[OR_X] - segment_size[OR_X] + 1;
+    n26_offsets[3] = -1 * segment_size[OR_Y] * segment_size[OR_X] - 1;
+    n26_offsets[4] = -1 * segment_size[OR_Y] * segment_size[OR_X];
+    n26_offsets[5] = -1 * segment_size[OR_Y] * segment_size[OR_X] + 1;
+    n26_offsets[6] = -1 * segment_size[OR_Y] * segment_size[OR_X] + segment_size[OR_X] - 1;
+    n26_offsets[7] = -1 * segment_size[OR_Y] * segment_size[OR_X] + segment_size[OR_X];
+    n26_offsets[8] = -1 * segment_size[OR_Y] * segment_size[OR_X] + segment_size[OR_X] + 1;
+
+    n26_offsets[9] = -1 * segment_size[OR_X] - 1;
+    n26_offsets[10] = -1 * segment_size[OR_X];
+    n26_offsets[11] = -1 * segment_size[OR_X] + 1;
     n26_offsets[12] = -1;
     n26_offsets[13] = +1;
-    n26_offsets[14] = padded_block_size[OR_X] - 1;
-    n26_offsets[15] = padded_block_size[OR_X];
-    n26_offsets[16] = padded_block_size[OR_X] + 1;
-
-    n26_offsets[17] = padded_block_size[OR_Y] * padded_block_size[OR_X] - padded_block_size[OR_X] - 1;
-    n26_offsets[18] = padded_block_size[OR_Y] * padded_block_size[OR_X] - padded_block_size[OR_X];
-    n26_offsets[19] = padded_block_size[OR_Y] * padded_block_size[OR_X] - padded_block_size[OR_X] + 1;
-    n26_offsets[20] = padded_block_size[OR_Y] * padded_block_size[OR_X] - 1;
-    n26_offsets[21] = padded_block_size[OR_Y] * padded_block_size[OR_X];
-    n26_offsets[22] = padded_block_size[OR_Y] * padded_block_size[OR_X] + 1;
-    n26_offsets[23] = padded_block_size[OR_Y] * padded_block_size[OR_X] + padded_block_size[OR_X] - 1;
-    n26_offsets[24] = padded_block_size[OR_Y] * padded_block_size[OR_X] + padded_block_size[OR_X];
-    n26_offsets[25] = padded_block_size[OR_Y] * padded_block_size[OR_X] + padded_block_size[OR_X] + 1;
+    n26_offsets[14] = segment_size[OR_X] - 1;
+    n26_offsets[15] = segment_size[OR_X];
+    n26_offsets[16] = segment_size[OR_X] + 1;
+
+    n26_offsets[17] = segment_size[OR_Y] * segment_size[OR_X] - segment_size[OR_X] - 1;
+    n26_offsets[18] = segment_size[OR_Y] * segment_size[OR_X] - segment_size[OR_X];
+    n26_offsets[19] = segment_size[OR_Y] * segment_size[OR_X] - segment_size[OR_X] + 1;
+    n26_offsets[20] = segment_size[OR_Y] * segment_size[OR_X] - 1;
+    n26_offsets[21] = segment_size[OR_Y] * segment_size[OR_X];
+    n26_offsets[22] = segment_size[OR_Y] * segment_size[OR_X] + 1;
+    n26_offsets[23] = segment_size[OR_Y] * segment_size[OR_X] + segment_size[OR_X] - 1;
+    n26_offsets[24] = segment_size[OR_Y] * segment_size[OR_X] + segment_size[OR_X];
+    n26_offsets[25] = segment_size[OR_Y] * segment_size[OR_X] + segment_size[OR_X] + 1;
 
     // use this order to go UP, DOWN, NORTH, SOUTH, EAST, WEST
     // DO NOT CHANGE THIS ORDERING
-    n6_offsets[0] = -1 * padded_block_size[OR_X];                                   // negative y direction
-    n6_offsets[1] = padded_block_size[OR_X];                                        // positive y direction
-    n6_offsets[2] = -1 * padded_block_size[OR_Y] * padded_block_size[OR_X];         // negative z direction
-    n6_offsets[3] = padded_block_size[OR_Y] * padded_block_size[OR_X];              // positive z direction
+    n6_offsets[0] = -1 * segment_size[OR_X];                                        // negative y direction
+    n6_offsets[1] = segment_size[OR_X];                                             // positive y direction
+    n6_offsets[2] = -1 * segment_size[OR_Y] * segment_size[OR_X];                   // negative z direction
+    n6_offsets[3] = segment_size[OR_Y] * segment_size[OR_X];                        // positive z direction
     n6_offsets[4] = +1;                                                             // positive x direction
     n6_offsets[5] = -1;                                                             // negative x direction
 }
 
 
 
+static inline void SegmentIndexToPaddedIndices(long iv, long &iz, long &iy, long &ix)
+{
+    // convert the index in the dense volume to padded block coordinates
+    GenericIndexToIndices(iv, iz, iy, ix, segment_size);
+
+    iz += segment_offset[OR_Z];
+    iy += segment_offset[OR_Y];
+    ix += segment_offset[OR_X];
+}
+
+
+
+static inline long PaddedIndexToSegmentIndex(long padded_index)
+{
+    // convert the padded block index to an index in the dense volume
+    long iz, iy, ix;
+    LocalPaddedIndexToPaddedIndices(padded_index, iz, iy, ix);
+
+    return GenericIndicesToIndex(iz - segment_offset[OR_Z], iy - segment_offset[OR_Y], ix - segment_offset[OR_X], segment_size);
+}
+
+
+
+static void *MapLabelBuffer(long nbytes)
+{
+    // anonymous mappings start zeroed and return to the system when unmapped, whichever thread allocated them
+    // mappings cannot be empty so every buffer has at least one byte
+    void *buffer = mmap(NULL, nbytes ? nbytes : 1, PROT_READ | PROT_WRITE, MAP_PRIVATE | MAP_ANONYMOUS, -1, 0);
+    if (buffer == MAP_FAILED) { fprintf(stderr, "Failed to allocate %ld bytes.\n", nbytes); exit(-1); }
+
+    return buffer;
+}
+
+
+
+static void UnmapLabelBuffer(void *buffer, long nbytes)
+{
+    munmap(buffer, nbytes ? nbytes : 1);
+}
+
+
+
+static inline float &Width(long index)
+{
+    // find the run of label voxels that contains this index in its row of the dense volume
+    long row = index / segment_size[OR_X];
+    long ix = index - row * segment_size[OR_X];
+
+    long run = row_runs[row];
+    while (run + 1 < row_runs[row + 1] and run_starts[run + 1] <= ix) ++run;
+
+    return widths[run_ranks[run] + ix - run_starts[run]];
+}
+
+
+
 // very simple double linked list data structure
 typedef struct {
       long iv, iz, iy, ix;
@@ -173,10 +277,8 @@ typedef struct {
 
 
 
-// variables for each processed block
-long current_label;
-static std::unordered_map<long, float> widths;
-static List surface_voxels;
+// surface voxels of the current label
+static thread_local List surface_voxels;
 
 
 
@@ -285,23 +387,14 @@ static void DestroyPointList(PointList *s)
 
 
 
-static void InitializeLookupTables(const char *lookup_table_directory)
+void CppInitializeSimpleLookupTable(const char *lookup_table_directory)
 {
     // read the simple lookup table
     char lut_filename[4096];
     snprintf(lut_filename, 4096, "%s/lut_simple.dat", lookup_table_directory);
 
-    // open the lookup table
-    FILE *lut_file = fopen(lut_filename, "rb");
-    if (!lut_file) { fprintf(stderr, "Failed to read %s\n", lut_filename); exit(-1); }
-
-    // read the lookup table into an array
-    lut_simple = new unsigned char[lookup_table_size];
-
-    if (fread(lut_simple, 1, lookup_table_size, lut_file) != lookup_table_size) { fprintf(stderr, "Failed to read %s\n", lut_filename); exit(-1); }
-
-    // close file
-    fclose(lut_file);
+    // the lookup table is mapped once per process and shared between blocks
+    lut_simple = MapLookupTable(lut_filename, lookup_table_size);
 
     // set the mask variables
     set_char_mask();
@@ -430,67 +523,226 @@ static void PopulateSegments(long *segmentation)
 {
     long nentries = block_size[OR_Z] * block_size[OR_Y] * block_size[OR_X];
 
-    // add each voxel to an unordered mapping of voxels
+    // find the labels in this block and their bounding boxes
     for (long index = 0; index < nentries; ++index) {
         long label = segmentation[index];
 
         // skip background elements
         if (not label) continue;
 
-        // get the padded local index
-        long padded_index = LocalIndexToPaddedIndex(index);
-
-        // create a new unordered map for this label
-        if (segments.find(label) == segments.end()) {
-            segments[label] = std::unordered_map<long, char>();
+        // get the padded local coordinates
+        long iz, iy, ix;
+        LocalIndexToIndices(index, iz, iy, ix);
+        iz += 1;
+        iy += 1;
+        ix += 1;
+
+        // create a new bounding box for this label
+        if (bounding_boxes.find(label) == bounding_boxes.end()) {
+            BoundingBox bounding_box;
+            bounding_box.min[OR_Z] = bounding_box.max[OR_Z] = iz;
+            bounding_box.min[OR_Y] = bounding_box.max[OR_Y] = iy;
+            bounding_box.min[OR_X] = bounding_box.max[OR_X] = ix;
+            bounding_box.nvoxels = 0;
+
+            bounding_boxes[label] = bounding_box;
             fixed_points[label] = std::unordered_set<long>();
-            for (long dir = 0; dir < NTHINNING_DIRECTIONS; ++dir) {
-                border_voxels[dir][label] = std::unordered_set<long>();
-            }
+            ordered_fixed_points[label] = std::vector<long>();
             labels_in_block.insert(label);
         }
 
-        // skip over points inside the cell body
-        if (somata_interior_voxels[label].find(padded_index) == somata_interior_voxels[label].end()) {
-            // add this point to the segments list as interior (surface voxels found later)
-            segments[label][padded_index] = 1;
-        }
+        // raster order means only the y and x coordinates can decrease
+        BoundingBox &bounding_box = bounding_boxes[label];
+        bounding_box.max[OR_Z] = iz;
+        if (iy < bounding_box.min[OR_Y]) bounding_box.min[OR_Y] = iy;
+        if (iy > bounding_box.max[OR_Y]) bounding_box.max[OR_Y] = iy;
+        if (ix < bounding_box.min[OR_X]) bounding_box.min[OR_X] = ix;
+        if (ix > bounding_box.max[OR_X]) bounding_box.max[OR_X] = ix;
+        bounding_box.nvoxels++;
+    }
+}
 
-        // add points to the list of voxels on the wall
-        long iz, iy, ix;
-        LocalIndexToIndices(index, iz, iy, ix);
 
-        // add the borderpoints if it is on the wall but not on the edge or corner
-        if (iz == block_size[OR_Z] - 1) {
-            if (not (iy == 0 or iy == block_size[OR_Y] - 1 or ix == 0 or ix == block_size[OR_X] - 1)) border_voxels[SOUTH][label].insert(padded_index);
-        }
-        if (iy == block_size[OR_Y] - 1) {
-            if (not (iz == 0 or iz == block_size[OR_Z] - 1 or ix == 0 or ix == block_size[OR_X] - 1)) border_voxels[DOWN][label].insert(padded_index);
-        }
-        if (ix == block_size[OR_X] - 1) {
-            if (not (iz == 0 or iz == block_size[OR_Z] - 1 or iy == 0 or iy == block_size[OR_Y] - 1)) border_voxels[EAST][label].insert(padded_index);
+
+static void ExtendBoundingBox(BoundingBox &bounding_box, long padded_index)
+{
+    long iz, iy, ix;
+    LocalPaddedIndexToPaddedIndices(padded_index, iz, iy, ix);
+
+    if (iz < bounding_box.min[OR_Z]) bounding_box.min[OR_Z] = iz;
+    if (iz > bounding_box.max[OR_Z]) bounding_box.max[OR_Z] = iz;
+    if (iy < bounding_box.min[OR_Y]) bounding_box.min[OR_Y] = iy;
+    if (iy > bounding_box.max[OR_Y]) bounding_box.max[OR_Y] = iy;
+    if (ix < bounding_box.min[OR_X]) bounding_box.min[OR_X] = ix;
+    if (ix > bounding_box.max[OR_X]) bounding_box.max[OR_X] = ix;
+}
+
+
+
+static BoundingBox LabelBoundingBox(long label)
+{
+    // the bounding box must contain the somata surfaces and fixed points of this label
+    // only read from the shared mappings since other threads may use them concurrently
+    BoundingBox bounding_box = bounding_boxes.at(label);
+    const std::vector<long> &label_fixed_points = ordered_fixed_points.at(label);
+
+    std::unordered_set<long>::const_iterator it;
+    if (somata_surface_voxels.find(label) != somata_surface_voxels.end()) {
+        for (it = somata_surface_voxels.at(label).begin(); it != somata_surface_voxels.at(label).end(); ++it)
+            ExtendBoundingBox(bounding_box, *it);
+        bounding_box.nvoxels += somata_surface_voxels.at(label).size();
+    }
+    for (unsigned long iv = 0; iv < label_fixed_points.size(); ++iv)
+        ExtendBoundingBox(bounding_box, label_fixed_points[iv]);
+    bounding_box.nvoxels += label_fixed_points.size();
+
+    return bounding_box;
+}
+
+
+
+static long LabelMemory(long label)
+{
+    // upper bound on the bytes mapped for this label (there are at most as many runs as voxels)
+    BoundingBox bounding_box = LabelBoundingBox(label);
+
+    long padded_size[3];
+    for (long dim = 0; dim < NDIMS; ++dim)
+        padded_size[dim] = bounding_box.max[dim] - bounding_box.min[dim] + 3;
+
+    long nentries = padded_size[OR_Z] * padded_size[OR_Y] * padded_size[OR_X];
+    long nrows = padded_size[OR_Z] * padded_size[OR_Y];
+
+    return nentries * sizeof(unsigned char) + (nrows + 1) * sizeof(long) + bounding_box.nvoxels * (sizeof(float) + 2 * sizeof(long));
+}
+
+
+
+static void PopulateLabelSegment(long *segmentation, std::vector<long> &voxel_order)
+{
+    BoundingBox bounding_box = LabelBoundingBox(current_label);
+    const std::vector<long> &label_fixed_points = ordered_fixed_points.at(current_label);
+
+    std::unordered_set<long>::const_iterator it;
+    bool somata_exists = somata_surface_voxels.find(current_label) != somata_surface_voxels.end();
+
+    // pad the bounding box by one voxel so that all neighbors are within the dense volume
+    for (long dim = 0; dim < NDIMS; ++dim) {
+        segment_offset[dim] = bounding_box.min[dim] - 1;
+        segment_size[dim] = bounding_box.max[dim] - bounding_box.min[dim] + 3;
+    }
+
+    long nentries = segment_size[OR_Z] * segment_size[OR_Y] * segment_size[OR_X];
+    segment = (unsigned char *) MapLabelBuffer(nentries * sizeof(unsigned char));
+
+    // the thinning result depends on the order in which the initial surface voxels are visited.
+    // the previous hash map implementation visited them in the iteration order of its table, so
+    // replay the same insertions into a temporary set to recover that order (freed before thinning starts)
+    std::unordered_set<long> insertion_order = std::unordered_set<long>();
+
+    // add each voxel of the label, skipping over points inside the cell body
+    for (long iz = bounding_box.min[OR_Z]; iz <= bounding_box.max[OR_Z]; ++iz) {
+        for (long iy = bounding_box.min[OR_Y]; iy <= bounding_box.max[OR_Y]; ++iy) {
+            for (long ix = bounding_box.min[OR_X]; ix <= bounding_box.max[OR_X]; ++ix) {
+                if (segmentation[LocalIndicesToIndex(iz - 1, iy - 1, ix - 1)] != current_label) continue;
+
+                long padded_index = LocalPaddedIndicesToPaddedIndex(iz, iy, ix);
+                if (somata_exists and somata_interior_voxels.at(current_label).count(padded_index)) continue;
+
+                // add this point to the segment as interior (surface voxels found later)
+                segment[GenericIndicesToIndex(iz - segment_offset[OR_Z], iy - segment_offset[OR_Y], ix - segment_offset[OR_X], segment_size)] = 1;
+                insertion_order.insert(padded_index);
+            }
         }
-        if (iz == 0) {
-            if (not (iy == 0 or iy == block_size[OR_Y] - 1 or ix == 0 or ix == block_size[OR_X] - 1)) border_voxels[NORTH][label].insert(padded_index);
+    }
+
+    // points on the surface of the cell body get a value of 4 (do not remove)
+    if (somata_exists) {
+        for (it = somata_surface_voxels.at(current_label).begin(); it != somata_surface_voxels.at(current_label).end(); ++it) {
+            segment[PaddedIndexToSegmentIndex(*it)] = 4;
+            insertion_order.insert(*it);
         }
-        if (iy == 0) {
-            if (not (iz == 0 or iz == block_size[OR_Z] - 1 or ix == 0 or ix == block_size[OR_X] - 1)) border_voxels[UP][label].insert(padded_index);
+    }
+
+    // synapses and anchor points get a value of 3
+    for (unsigned long iv = 0; iv < label_fixed_points.size(); ++iv) {
+        long padded_index = label_fixed_points[iv];
+
+        segment[PaddedIndexToSegmentIndex(padded_index)] = 3;
+        insertion_order.insert(padded_index);
+    }
+
+    // return the voxels in the dense volume in the order to visit
+    voxel_order.reserve(insertion_order.size());
+    for (it = insertion_order.begin(); it != insertion_order.end(); ++it) {
+        voxel_order.push_back(PaddedIndexToSegmentIndex(*it));
+    }
+}
+
+
+
+static void PopulateLabelWidths(void)
+{
+    // count the runs of label voxels in every row of the dense volume
+    long nrows = segment_size[OR_Z] * segment_size[OR_Y];
+    row_runs = (long *) MapLabelBuffer((nrows + 1) * sizeof(long));
+
+    long nruns = 0;
+    long nvoxels = 0;
+    for (long row = 0; row < nrows; ++row) {
+        row_runs[row] = nruns;
+
+        unsigned char *row_segment = segment + row * segment_size[OR_X];
+        for (long ix = 0; ix < segment_size[OR_X]; ++ix) {
+            if (not row_segment[ix]) continue;
+
+            if (not ix or not row_segment[ix - 1]) ++nruns;
+            ++nvoxels;
         }
-        if (ix == 0) {
-            if (not (iz == 0 or iz == block_size[OR_Z] - 1 or iy == 0 or iy == block_size[OR_Y] - 1)) border_voxels[WEST][label].insert(padded_index);
+    }
+    row_runs[nrows] = nruns;
+
+    // save the first voxel of every run and its rank among the label voxels in raster order
+    run_starts = (long *) MapLabelBuffer(nruns * sizeof(long));
+    run_ranks = (long *) MapLabelBuffer(nruns * sizeof(long));
+
+    long run = 0;
+    long rank = 0;
+    for (long row = 0; row < nrows; ++row) {
+        unsigned char *row_segment = segment + row * segment_size[OR_X];
+        for (long ix = 0; ix < segment_size[OR_X]; ++ix) {
+            if (not row_segment[ix]) continue;
+
+            if (not ix or not row_segment[ix - 1]) {
+                run_starts[run] = ix;
+                run_ranks[run] = rank;
+                ++run;
+            }
+            ++rank;
         }
     }
 
-    // points on the surface of the cell body get a value of 4 (do not remove)
-    std::unordered_map<long, std::unordered_set<long> >::iterator label_iterator;
-    for (label_iterator = somata_surface_voxels.begin(); label_iterator != somata_surface_voxels.end(); ++label_iterator) {
-        long label = label_iterator->first;
-
-        // iterate over all voxels in the surface of this somata
-        std::unordered_set<long>::iterator voxel_iterator;
-        for (voxel_iterator = somata_surface_voxels[label].begin(); voxel_iterator != somata_surface_voxels[label].end(); ++voxel_iterator) {
-            long padded_index = *voxel_iterator;
-            segments[label][padded_index] = 4;
+    // initialize widths to maximum float value
+    widths = (float *) MapLabelBuffer(nvoxels * sizeof(float));
+    for (long iv = 0; iv < nvoxels; ++iv)
+        widths[iv] = std::numeric_limits<float>::max();
+
+    nlabel_voxels = nvoxels;
+    nlabel_runs = nruns;
+}
+
+
+
+static void AddFixedPoints(std::vector<long> &labels, std::unordered_map<long, std::vector<long> > &padded_indices)
+{
+    // add the points in file order to the list of fixed points
+    for (unsigned long il = 0; il < labels.size(); ++il) {
+        long label = labels[il];
+
+        std::vector<long>::iterator it;
+        for (it = padded_indices[label].begin(); it != padded_indices[label].end(); ++it) {
+            ordered_fixed_points[label].push_back(*it);
+            fixed_points[label].insert(*it);
         }
     }
 }
@@ -506,11 +758,16 @@ static void ReadSynapses(const char *synapse_directory, long current_block_index
     FILE *fp = fopen(synapse_filename, "rb");
     if (!fp) { fprintf(stderr, "Failed to read %s.\n", synapse_filename); exit(-1); }
 
-    // read in the points using local coordinates, a mapped value of 3, and populating fixed point array
-    if (!ReadPtsFile(fp, true, 3, true)) { fprintf(stderr, "Failed to read %s.\n", synapse_filename); exit(-1); }
+    // read in the points using local coordinates
+    std::vector<long> labels = std::vector<long>();
+    std::unordered_map<long, std::vector<long> > padded_indices = std::unordered_map<long, std::vector<long> >();
+    if (!ReadPtsFile(fp, true, labels, padded_indices)) { fprintf(stderr, "Failed to read %s.\n", synapse_filename); exit(-1); }
 
     // close the file
     fclose(fp);
+
+    // synapses are fixed points
+    AddFixedPoints(labels, padded_indices);
 }
 
 
@@ -535,57 +792,59 @@ static void ReadAnchorPoints(const char *tmp_directory)
         FILE *fp = fopen(anchor_pts_filename, "rb");
         if (!fp) continue;
 
-        // read in the points using local coordinates, a mapped value of 3, and populating fixed point array
-        if (!ReadPtsFile(fp, true, 3, true)) { fprintf(stderr, "Failed to read %s.\n", anchor_pts_filename); exit(-1); }
+        // read in the points using local coordinates
+        std::vector<long> labels = std::vector<long>();
+        std::unordered_map<long, std::vector<long> > padded_indices = std::unordered_map<long, std::vector<long> >();
+        if (!ReadPtsFile(fp, true, labels, padded_indices)) { fprintf(stderr, "Failed to read %s.\n", anchor_pts_filename); exit(-1); }
 
         // close the file
         fclose(fp);
+
+        // anchor points are fixed points
+        AddFixedPoints(labels, padded_indices);
     }
 }
 
 
 
 
-static void CollectSurfaceVoxels(void)
+static void CollectSurfaceVoxels(std::vector<long> &voxel_order)
 {
     long n_surface_voxels = 0;
 
     // go through all voxels and check their six neighbors
-    std::unordered_map<long, char>::iterator it;
-    for (it = segments[current_label].begin(); it != segments[current_label].end(); ++it) {
+    std::vector<long>::iterator it;
+    for (it = voxel_order.begin(); it != voxel_order.end(); ++it) {
         // all of these elements are either 1, 3, or 4 and in the segment
-        long index = it->first;
-
-        // initialize widths to maximum float value
-        widths[index] = std::numeric_limits<float>::max();
+        long index = *it;
 
         long iz, iy, ix;
-        LocalPaddedIndexToPaddedIndices(index, iz, iy, ix);
+        SegmentIndexToPaddedIndices(index, iz, iy, ix);
 
         // check the 6 neighbors
         for (long dir = 0; dir < NTHINNING_DIRECTIONS; ++dir) {
             long neighbor_index = index + n6_offsets[dir];
 
             long ik, ij, ii;
-            LocalPaddedIndexToPaddedIndices(neighbor_index, ik, ij, ii);
+            SegmentIndexToPaddedIndices(neighbor_index, ik, ij, ii);
 
             // skip the fake boundary elements
             if ((ik == 0) or (ik == padded_block_size[OR_Z] - 1)) continue;
             if ((ij == 0) or (ij == padded_block_size[OR_Y] - 1)) continue;
             if ((ii == 0) or (ii == padded_block_size[OR_X] - 1)) continue;
 
-            if (segments[current_label].find(neighbor_index) == segments[current_label].end()) {
+            if (!segment[neighbor_index]) {
                 // this location is a boundary so create a surface voxel and break
-                // cannot update it->second if it is synapse so need this test!!
-                if (it->second == 1) {
-                    it->second = 2;
+                // cannot update the segment if it is synapse so need this test!!
+                if (segment[index] == 1) {
+                    segment[index] = 2;
                     NewSurfaceVoxel(index, iz, iy, ix, surface_voxels);
                     n_surface_voxels ++;
                 }
 
                 // any of these voxels can have width zero since we already verify that
                 // the non-label neighbor is not outside the standard volume size
-                widths[index] = 0;
+                Width(index) = 0;
 
                 break;
             }
@@ -597,16 +856,13 @@ static void CollectSurfaceVoxels(void)
 
 
 
-unsigned int Collect26Neighbors(long iz, long iy, long ix)
+unsigned int Collect26Neighbors(long index)
 {
     unsigned int neighbors = 0;
 
-    long index = LocalPaddedIndicesToPaddedIndex(iz, iy, ix);
-
-    // some of these lookups will create a new entry but the region is
-    // shrinking so memory overhead is minimal
+    // the dense volume is padded so all neighbors are valid
     for (long iv = 0; iv < 26; ++iv) {
-        if (segments[current_label][index + n26_offsets[iv]]) neighbors |= long_mask[iv];
+        if (segment[index + n26_offsets[iv]]) neighbors |= long_mask[iv];
     }
 
     return neighbors;
@@ -614,6 +870,30 @@ unsigned int Collect26Neighbors(long iz, long iy, long ix)
 
 
 
+static bool IsBorderVoxel(long iz, long iy, long ix, int wall)
+{
+    // convert the padded coordinates into block coordinates
+    iz -= 1;
+    iy -= 1;
+    ix -= 1;
+
+    bool z_edge = (iz == 0 or iz == block_size[OR_Z] - 1);
+    bool y_edge = (iy == 0 or iy == block_size[OR_Y] - 1);
+    bool x_edge = (ix == 0 or ix == block_size[OR_X] - 1);
+
+    // border points are on the wall but not on the edge or corner
+    if (wall == SOUTH) return (iz == block_size[OR_Z] - 1) and not (y_edge or x_edge);
+    if (wall == DOWN) return (iy == block_size[OR_Y] - 1) and not (z_edge or x_edge);
+    if (wall == EAST) return (ix == block_size[OR_X] - 1) and not (z_edge or y_edge);
+    if (wall == NORTH) return (iz == 0) and not (y_edge or x_edge);
+    if (wall == UP) return (iy == 0) and not (z_edge or x_edge);
+    if (wall == WEST) return (ix == 0) and not (z_edge or y_edge);
+
+    return false;
+}
+
+
+
 void DetectSimpleBorderPoints(PointList *deletable_points, int direction)
 {
     ListElement *LE = (ListElement *)surface_voxels.first;
@@ -624,19 +904,16 @@ void DetectSimpleBorderPoints(PointList *deletable_points, int direction)
         long iz = LE->iz;
 
         // not a synapse endpoint (need this here since endpoints are on the list of surfaces)
-        // this will only be called on things on the surface already so already in unordered_map
-        if (segments[current_label][iv] == 2) {
+        if (segment[iv] == 2) {
             long value = 0;
 
             // is the neighbor in the corresponding direction not in the segment
-            // some of these keys will not exist but will default to 0 value
-            // the search region retracts in from the boundary so limited memory overhead
             // the n6_offsets are in the order UP, DOWN, NORTH, SOUTH, EAST, WEST
-            value = segments[current_label][iv + n6_offsets[direction]];
+            value = segment[iv + n6_offsets[direction]];
 
             // see if the required point belongs to a different segment
             if (!value) {
-                unsigned int neighbors = Collect26Neighbors(iz, iy, ix);
+                unsigned int neighbors = Collect26Neighbors(iv);
 
                 // deletable point
                 if (Simple26_6(neighbors)) {
@@ -682,19 +959,19 @@ static long ThinningIterationStep(void)
             // do not remove voxel in the dirction of the outer facing surface
             // the directions of border voxels are reverse of the direction of erosion
             // e.g., if you are thinning from UP (-y direction), do not remove elements on the DOWN wall (y max)
-            if (border_voxels[DOWN][current_label].find(index) != border_voxels[DOWN][current_label].end() && direction == UP) continue;
-            if (border_voxels[UP][current_label].find(index) != border_voxels[UP][current_label].end() && direction == DOWN) continue;
-            if (border_voxels[SOUTH][current_label].find(index) != border_voxels[SOUTH][current_label].end() && direction == NORTH) continue;
-            if (border_voxels[NORTH][current_label].find(index) != border_voxels[NORTH][current_label].end() && direction == SOUTH) continue;
-            if (border_voxels[WEST][current_label].find(index) != border_voxels[WEST][current_label].end() && direction == EAST) continue;
-            if (border_voxels[EAST][current_label].find(index) != border_voxels[EAST][current_label].end() && direction == WEST) continue;
+            if (direction == UP && IsBorderVoxel(iz, iy, ix, DOWN)) continue;
+            if (direction == DOWN && IsBorderVoxel(iz, iy, ix, UP)) continue;
+            if (direction == NORTH && IsBorderVoxel(iz, iy, ix, SOUTH)) continue;
+            if (direction == SOUTH && IsBorderVoxel(iz, iy, ix, NORTH)) continue;
+            if (direction == EAST && IsBorderVoxel(iz, iy, ix, WEST)) continue;
+            if (direction == WEST && IsBorderVoxel(iz, iy, ix, EAST)) continue;
 
             // check if simple, if so, delete it
-            unsigned int neighbors = Collect26Neighbors(iz, iy, ix);
+            unsigned int neighbors = Collect26Neighbors(index);
 
             if (Simple26_6(neighbors)) {
                 // delete the simple point
-                segments[current_label][index] = 0;
+                segment[index] = 0;
 
                 // add the new surface voxels
                 for (long ip = 0; ip < NTHINNING_DIRECTIONS; ++ip) {
@@ -702,26 +979,27 @@ static long ThinningIterationStep(void)
 
                     // previously not on the surface but is in the object
                     // widths of voxels start at maximum and first updated when put on surface
-                    if (segments[current_label][neighbor_index] == 1) {
+                    if (segment[neighbor_index] == 1) {
                         long iw, iv, iu;
-                        LocalPaddedIndexToPaddedIndices(neighbor_index, iw, iv, iu);
+                        SegmentIndexToPaddedIndices(neighbor_index, iw, iv, iu);
                         NewSurfaceVoxel(neighbor_index, iw, iv, iu, surface_voxels);
 
                         // convert to a surface point
-                        segments[current_label][neighbor_index] = 2;
+                        segment[neighbor_index] = 2;
                     }
                 }
 
                 // check all 26 neighbors to see if width is better going through this voxel
+                float width = Width(index);
                 for (long ip = 0; ip < 26; ++ip) {
                     long neighbor_index = index + n26_offsets[ip];
 
                     // skip background voxels (those that do not belong to this label)
-                    if (!segments[current_label][neighbor_index]) continue;
+                    if (!segment[neighbor_index]) continue;
 
                     // get this index in (x, y, z)
                     long iw, iv, iu;
-                    LocalPaddedIndexToPaddedIndices(neighbor_index, iw, iv, iu);
+                    SegmentIndexToPaddedIndices(neighbor_index, iw, iv, iu);
 
                     // get the distance from the voxel to be deleted
                     float diffz = resolution[OR_Z] * (iz - iw);
@@ -729,10 +1007,10 @@ static long ThinningIterationStep(void)
                     float diffx = resolution[OR_X] * (ix - iu);
 
                     float distance = sqrt(diffx * diffx + diffy * diffy + diffz * diffz);
-                    float current_width = widths[neighbor_index];
+                    float &current_width = Width(neighbor_index);
 
-                    if (widths[index] + distance < current_width) {
-                        widths[neighbor_index] = widths[index] + distance;
+                    if (width + distance < current_width) {
+                        current_width = width + distance;
                     }
                 }
 
@@ -753,10 +1031,10 @@ static long ThinningIterationStep(void)
 
 
 
-static void SequentialThinning(void)
+static void SequentialThinning(std::vector<long> &voxel_order)
 {
     // create a vector of surface voxels
-    CollectSurfaceVoxels();
+    CollectSurfaceVoxels(voxel_order);
 
     int iteration = 0;
     long changed = 0;
@@ -794,7 +1072,7 @@ static void WriteSkeletonOutputFiles(const char *tmp_directory, long current_blo
         LE = (ListElement *)LE->next;
     }
 
-    num += fixed_points[current_label].size();
+    num += fixed_points.at(current_label).size();
 
     printf("    Remaining Voxels: %ld\n", num);
 
@@ -817,8 +1095,8 @@ static void WriteSkeletonOutputFiles(const char *tmp_directory, long current_blo
         ListElement *LE = (ListElement *) surface_voxels.first;
 
         // get the padded index and width
-        long padded_index = LE->iv;
-        output_widths[iv] = widths[padded_index];
+        long padded_index = LocalPaddedIndicesToPaddedIndex(LE->iz, LE->iy, LE->ix);
+        output_widths[iv] = Width(LE->iv);
 
         // get the local and global indices
         long local_index = LocalPaddedIndexToIndex(padded_index);
@@ -841,8 +1119,8 @@ static void WriteSkeletonOutputFiles(const char *tmp_directory, long current_blo
     }
 
     // add in the fixed points
-    std::unordered_set<long>::iterator it;
-    for (it = fixed_points[current_label].begin(); it != fixed_points[current_label].end(); ++it, ++iv) {
+    std::unordered_set<long>::const_iterator it;
+    for (it = fixed_points.at(current_label).begin(); it != fixed_points.at(current_label).end(); ++it, ++iv) {
         // get the padded index
         long padded_index = *it;
 
@@ -855,7 +1133,7 @@ static void WriteSkeletonOutputFiles(const char *tmp_directory, long current_blo
 
         global_indices[iv] = global_index;
         local_indices[iv] = local_index;
-        output_widths[iv] = widths[padded_index];
+        output_widths[iv] = Width(PaddedIndexToSegmentIndex(padded_index));
 
         // update the checksum
         checksum += (global_indices[iv] + local_indices[iv]);
@@ -950,6 +1228,67 @@ static void WriteSomataSurfaces(const char *tmp_directory, long current_block_in
 
 
 
+static void ThinLabels(std::vector<long> *labels, std::vector<long> *label_memories, ThinningSchedule *schedule, long *segmentation, const char *tmp_directory, long *current_block_index)
+{
+    // continue until there are no labels remaining
+    while (true) {
+        unsigned long il;
+        {
+            // wait until the next label fits in the budget (a label larger than the budget is thinned alone)
+            std::unique_lock<std::mutex> lock(schedule->lock);
+            schedule->released.wait(lock, [&] {
+                return schedule->next_label >= labels->size() or not schedule->memory_in_use or
+                    schedule->memory_in_use + (*label_memories)[schedule->next_label] <= schedule->memory_budget;
+            });
+            if (schedule->next_label >= labels->size()) break;
+
+            il = schedule->next_label++;
+            schedule->memory_in_use += (*label_memories)[il];
+        }
+
+        current_label = (*labels)[il];
+
+        printf("Processing Neuron %ld\n", current_label);
+
+        // create the dense volume for this label cropped to its bounding box
+        std::vector<long> voxel_order = std::vector<long>();
+        PopulateLabelSegment(segmentation, voxel_order);
+
+        // keep widths only for the voxels of the label
+        PopulateLabelWidths();
+
+        // populate the offsets for easier linear access
+        PopulateOffsets();
+
+        // thin the volume
+        SequentialThinning(voxel_order);
+
+        // write the values to output
+        WriteSkeletonOutputFiles(tmp_directory, current_block_index);
+
+        // free memory for this label
+        UnmapLabelBuffer(segment, segment_size[OR_Z] * segment_size[OR_Y] * segment_size[OR_X] * sizeof(unsigned char));
+        UnmapLabelBuffer(row_runs, (segment_size[OR_Z] * segment_size[OR_Y] + 1) * sizeof(long));
+        UnmapLabelBuffer(run_starts, nlabel_runs * sizeof(long));
+        UnmapLabelBuffer(run_ranks, nlabel_runs * sizeof(long));
+        UnmapLabelBuffer(widths, nlabel_voxels * sizeof(float));
+
+        // release the surface lists and voxel order of this label held by the allocator of this thread
+#ifdef __GLIBC__
+        malloc_trim(0);
+#endif
+
+        // return the memory of this label to the budget
+        {
+            std::lock_guard<std::mutex> lock(schedule->lock);
+            schedule->memory_in_use -= (*label_memories)[il];
+        }
+        schedule->released.notify_all();
+    }
+}
+
+
+
 void CppTopologicalThinning(const char *lookup_table_directory,
     const char *tmp_directory,
     const char *synapse_directory,
@@ -959,7 +1298,9 @@ void CppTopologicalThinning(const char *lookup_table_directory,
     float input_resolution[3],
     long input_volume_size[3],
     long input_block_size[3],
-    long current_block_index[3])
+    long current_block_index[3],
+    long nthreads,
+    long memory_budget)
 {
     // update global variables given input values
     for (long iv = 0; iv < NDIMS; ++iv) {
@@ -976,13 +1317,8 @@ void CppTopologicalThinning(const char *lookup_table_directory,
     fixed_points = std::unordered_map<long, std::unordered_set<long> >();
     somata_interior_voxels = std::unordered_map<long, std::unordered_set<long> >();
     somata_surface_voxels = std::unordered_map<long, std::unordered_set<long> >();
-    segments = std::unordered_map<long, std::unordered_map<long, char> >();
-
-    // create mappings for every wall
-    border_voxels = new std::unordered_map<long, std::unordered_set<long> >[NTHINNING_DIRECTIONS];
-    for (long dir = 0; dir < NTHINNING_DIRECTIONS; ++dir) {
-        border_voxels[dir] = std::unordered_map<long, std::unordered_set<long> >();
-    }
+    bounding_boxes = std::unordered_map<long, BoundingBox>();
+    ordered_fixed_points = std::unordered_map<long, std::vector<long> >();
 
     // create the mappings for somata and for segmentations
     // somata should go first so to not add points from the soma to the segmentation
@@ -996,30 +1332,29 @@ void CppTopologicalThinning(const char *lookup_table_directory,
     // read in the anchor points
     ReadAnchorPoints(tmp_directory);
 
-    // populate the offsets for easier linear access
-    PopulateOffsets();
-
     // initialize the lookup table
-    InitializeLookupTables(lookup_table_directory);
+    CppInitializeSimpleLookupTable(lookup_table_directory);
 
-    // iterate over all labels in the volume for thinning
-    std::unordered_set<long>::iterator it;
-    for (it = labels_in_block.begin(); it != labels_in_block.end(); ++it) {
-        // initialize new widths mapping for this label
-        widths = std::unordered_map<long, float>();
-
-        current_label = *it;
-
-        printf("Processing Neuron %ld\n", current_label);
-
-        // thin the volume
-        SequentialThinning();
+    // labels are independent so divide them among the threads within the memory budget
+    std::vector<long> labels = std::vector<long>(labels_in_block.begin(), labels_in_block.end());
+    std::vector<long> label_memories = std::vector<long>();
+    for (unsigned long il = 0; il < labels.size(); ++il)
+        label_memories.push_back(LabelMemory(labels[il]));
 
-        // write the values to output
-        WriteSkeletonOutputFiles(tmp_directory, current_block_index);
+    ThinningSchedule schedule;
+    schedule.next_label = 0;
+    schedule.memory_in_use = 0;
+    schedule.memory_budget = memory_budget;
 
-        // clear widths mapping
-        widths.clear();
+    if (nthreads <= 1) ThinLabels(&labels, &label_memories, &schedule, segmentation, tmp_directory, current_block_index);
+    else {
+        std::vector<std::thread> threads = std::vector<std::thread>();
+        for (long it = 0; it < nthreads; ++it) {
+            threads.push_back(std::thread(ThinLabels, &labels, &label_memories, &schedule, segmentation, tmp_directory, current_block_index));
+        }
+        for (long it = 0; it < nthreads; ++it) {
+            threads[it].join();
+        }
     }
 
     // write the somata surfaces to file
@@ -1030,13 +1365,6 @@ void CppTopologicalThinning(const char *lookup_table_directory,
     fixed_points.clear();
     somata_interior_voxels.clear();
     somata_surface_voxels.clear();
-    segments.clear();
-
-    for (long dir = 0; dir < NTHINNING_DIRECTIONS; ++dir) {
-        border_voxels[dir].clear();
-    }
-
-    // free memory
-    delete[] lut_simple;
-    delete[] border_voxels;
+    bounding_boxes.clear();
+    ordered_fixed_points.clear();
 }
@@ -0,0 +1,93 @@
+import os
+import time
+
+
+
+import numpy as np
+
+
+
+from blockbased_synapseaware.utilities.dataIO import ReadMetaData, ReadSkeletonGraph
+from blockbased_synapseaware.utilities.scheduler import MapTasks
+
+
+
+def TopologicalOrder(parents):
+    # the depth of every node is found by pointer jumping towards the roots (log of the longest path iterations)
+    depths = (parents != -1).astype(np.int64)
+    ancestors = parents.copy()
+
+    while np.any(ancestors != -1):
+        jumping = np.flatnonzero(ancestors != -1)
+        depths[jumping] += depths[ancestors[jumping]]
+        ancestors[jumping] = ancestors[ancestors[jumping]]
+
+    # every parent is strictly shallower than its children
+    return np.argsort(depths, kind='stable')
+
+
+
+def ExportSkeleton(data, label):
+    start_time = time.time()
+
+    skeleton_output_directory = data.SkeletonOutputDirectory()
+
+    # read the graph written during refinement
+    graph_filename = '{}/graphs/{:016d}.npz'.format(skeleton_output_directory, label)
+    nodes, parents, distances, widths = ReadSkeletonGraph(graph_filename)
+
+    # get the vertices in nm in (x, y, z) order
+    iz, iy, ix = np.unravel_index(nodes, data.VolumeSize())
+    resolution = data.Resolution()
+    vertices = np.stack((ix * resolution[2], iy * resolution[1], iz * resolution[0]), axis=1).astype(np.float32)
+
+    # every edge connects a node to its parent
+    children = np.flatnonzero(parents != -1)
+    edges = np.stack((children, parents[children]), axis=1).astype(np.int64)
+
+    npz_filename = '{}/npz/{:016d}.npz'.format(skeleton_output_directory, label)
+    np.savez_compressed(npz_filename, vertices=vertices, edges=edges, radius=widths, distances=distances, global_indices=nodes)
+
+    # swc files list the parents before their children with one-based identifiers
+    order = TopologicalOrder(parents)
+    identifiers = np.empty(order.size, dtype=np.int64)
+    identifiers[order] = np.arange(1, order.size + 1)
+
+    swc_parents = np.full(order.size, -1, dtype=np.int64)
+    swc_parents[children] = identifiers[parents[children]]
+
+    # every node has the undefined structure type
+    swc = np.zeros(order.size, dtype=[('id', np.int64), ('type', np.int64), ('x', np.float32), ('y', np.float32), ('z', np.float32), ('radius', np.float32), ('parent', np.int64)])
+    swc['id'] = identifiers[order]
+    swc['x'] = vertices[order,0]
+    swc['y'] = vertices[order,1]
+    swc['z'] = vertices[order,2]
+    swc['radius'] = widths[order]
+    swc['parent'] = swc_parents[order]
+
+    swc_filename = '{}/swc/{:016d}.swc'.format(skeleton_output_directory, label)
+    header = 'label {}\nvertices in nm'.format(label)
+    np.savetxt(swc_filename, swc, fmt='%d %d %0.3f %0.3f %0.3f %0.3f %d', header=header)
+
+    print ('Exported label {} in {:0.2f} seconds'.format(label, time.time() - start_time))
+
+
+
+def ExportSkeletons(meta_filename, nprocesses=None):
+    # read in the meta data file
+    data = ReadMetaData(meta_filename)
+
+    skeleton_output_directory = data.SkeletonOutputDirectory()
+
+    # create the swc and npz output directories if they do not exist
+    for directory in ['swc', 'npz']:
+        output_directory = '{}/{}'.format(skeleton_output_directory, directory)
+        if not os.path.exists(output_directory):
+            os.makedirs(output_directory, exist_ok=True)
+
+    # skip over labels without a refined skeleton
+    graph_filenames = set(os.listdir('{}/graphs'.format(skeleton_output_directory)))
+    labels = [label for label in range(1, data.NLabels()) if '{:016d}.npz'.format(label) in graph_filenames]
+
+    # export all labels in parallel
+    MapTasks(meta_filename, ExportSkeleton, [(label,) for label in labels], nprocesses)
@@ -4,8 +4,9 @@ import os
 
 from blockbased_synapseaware.skeletonize.anchors import ComputeAnchorPoints, SaveAnchorWalls
 from blockbased_synapseaware.skeletonize.thinning import TopologicalThinning
-from blockbased_synapseaware.skeletonize.refinement import RefineSkeleton
+from blockbased_synapseaware.skeletonize.refinement import BuildRefinementIndex, RefineSkeleton
 from blockbased_synapseaware.utilities.dataIO import ReadMetaData
+from blockbased_synapseaware.utilities.scheduler import Blocks, ExecuteTasks, NegativeNeighbors, PositiveNeighbors
 
 
 
@@ -17,11 +18,12 @@ def SkeletonizeSequentially(meta_filename):
     assert (not data.SkeletonOutputDirectory() == None)
     os.makedirs(data.SkeletonOutputDirectory(), exist_ok=True)
 
-    # compute the first step to save the walls of each file
-    for iz in range(data.StartZ(), data.EndZ()):
-        for iy in range(data.StartY(), data.EndY()):
-            for ix in range(data.StartX(), data.EndX()):
-                SaveAnchorWalls(data, iz, iy, ix)
+    # compute the first step to save the walls of each file unless hole filling wrote them
+    if not 'walls' in data.HoleFillingPostFill():
+        for iz in range(data.StartZ(), data.EndZ()):
+            for iy in range(data.StartY(), data.EndY()):
+                for ix in range(data.StartX(), data.EndX()):
+                    SaveAnchorWalls(data, iz, iy, ix)
 
     # compute the second step to find the anchors between blocks
     for iz in range(data.StartZ(), data.EndZ()):
@@ -36,5 +38,45 @@ def SkeletonizeSequentially(meta_filename):
                 TopologicalThinning(data, iz, iy, ix)
 
     # compute the fourth step to refine the skeleton
+    BuildRefinementIndex(data)
     for label in range(1, data.NLabels()):
         RefineSkeleton(data, label)
+
+
+
+def SkeletonizeInParallel(meta_filename, nprocesses=None):
+    # read in the data for this block
+    data = ReadMetaData(meta_filename)
+
+    # users must provide an output directory
+    assert (not data.SkeletonOutputDirectory() == None)
+    os.makedirs(data.SkeletonOutputDirectory(), exist_ok=True)
+
+    tasks = {}
+    blocks = Blocks(data)
+
+    # the first step to save the walls of each file has no dependencies (hole filling may have written them already)
+    save_walls = not 'walls' in data.HoleFillingPostFill()
+    if save_walls:
+        for block in blocks:
+            tasks[('walls',) + block] = (SaveAnchorWalls, block, [])
+
+    # the second step needs the walls of this block and its +z, +y, +x neighbors
+    for block in blocks:
+        dependencies = []
+        if save_walls: dependencies = [('walls',) + neighbor for neighbor in [block] + PositiveNeighbors(data, *block)]
+        tasks[('anchors',) + block] = (ComputeAnchorPoints, block, dependencies)
+
+    # the third step needs the anchor points written by this block and its -z, -y, -x neighbors
+    for block in blocks:
+        dependencies = [('anchors',) + neighbor for neighbor in [block] + NegativeNeighbors(data, *block)]
+        tasks[('thinning',) + block] = (TopologicalThinning, block, dependencies)
+
+    # the index of files per label needs the skeletons from every block
+    tasks[('index',)] = (BuildRefinementIndex, (), [('thinning',) + block for block in blocks])
+
+    # the fourth step refines every label against the index
+    for label in range(1, data.NLabels()):
+        tasks[('refinement', label)] = (RefineSkeleton, (label,), [('index',)])
+
+    ExecuteTasks(meta_filename, tasks, nprocesses)
@@ -13,7 +13,7 @@ import numpy as np
 
 
 
-from blockbased_synapseaware.utilities.dataIO import ReadAttributePtsFile, WriteAttributePtsFile
+from blockbased_synapseaware.utilities.dataIO import ReadAttributePtsFile, ReadParentsPtsFile, ReadPtsFileIndex, WriteAttributePtsFile, WriteSkeletonGraph
 
 
 
@@ -25,8 +25,85 @@ cdef extern from 'cpp-skeletonize.h':
                                float input_resolution[3],
                                long input_volume_size[3],
                                long input_block_size[3],
-                               long start_indices[3],
-                               long nblocks[3])
+                               long nentries,
+                               long *index_entries)
+
+
+
+# the refinement index is read once per process
+refinement_index = None
+refinement_index_key = None
+
+
+
+def LabelsInDirectory(directory):
+    # return the labels of all of the points files in this directory
+    if not os.path.exists(directory): return set()
+
+    return set(int(filename[:-len('.pts')]) for filename in os.listdir(directory) if filename.endswith('.pts'))
+
+
+
+def BuildRefinementIndex(data):
+    # start timing statistics
+    total_time = time.time()
+
+    synapse_directory = data.SynapseDirectory()
+
+    # one row per (label, block) with the block, whether somata surface and skeleton files exist,
+    # and the offset and number of the synapses for this label in the block synapse file
+    rows = []
+
+    # a single pass over the blocks replaces probing every block for every label
+    for iz in range(data.StartZ(), data.EndZ()):
+        for iy in range(data.StartY(), data.EndY()):
+            for ix in range(data.StartX(), data.EndX()):
+                tmp_block_directory = data.TempBlockDirectory(iz, iy, ix)
+
+                somata_surface_labels = LabelsInDirectory('{}/somata_surfaces'.format(tmp_block_directory))
+                skeleton_labels = LabelsInDirectory('{}/skeletons'.format(tmp_block_directory))
+
+                synapse_filename = '{}/{:04d}z-{:04d}y-{:04d}x.pts'.format(synapse_directory, iz, iy, ix)
+                synapse_index = ReadPtsFileIndex(data, synapse_filename)
+
+                for label in sorted(somata_surface_labels | skeleton_labels | set(synapse_index.keys())):
+                    synapse_offset, nsynapses = synapse_index.get(label, (0, 0))
+
+                    rows.append((label, iz, iy, ix, label in somata_surface_labels, label in skeleton_labels, synapse_offset, nsynapses))
+
+    index = np.array(rows, dtype=np.int64).reshape(-1, 8)
+
+    # a stable sort keeps the blocks for each label in sequential order
+    index = index[np.argsort(index[:,0], kind='stable')]
+
+    # write to a temporary file first since other processes might read the index
+    index_filename = '{}/refinement-index.npy'.format(data.TempDirectory())
+    tmp_index_filename = '{}.{}.tmp'.format(index_filename, os.getpid())
+    with open(tmp_index_filename, 'wb') as fd:
+        np.save(fd, index)
+    os.replace(tmp_index_filename, index_filename)
+
+    total_time = time.time() - total_time
+
+    print ('Built Refinement Index: {:0.2f} seconds.'.format(total_time))
+
+
+
+def ReadRefinementIndex(data):
+    global refinement_index, refinement_index_key
+
+    # build the index if no previous step created it
+    index_filename = '{}/refinement-index.npy'.format(data.TempDirectory())
+    if not os.path.exists(index_filename):
+        BuildRefinementIndex(data)
+
+    # only read the index again if the file changed
+    key = (index_filename, os.stat(index_filename).st_mtime_ns)
+    if not refinement_index_key == key:
+        refinement_index = np.load(index_filename)
+        refinement_index_key = key
+
+    return refinement_index
 
 
 
@@ -56,8 +133,11 @@ def RefineSkeleton(data, label):
     tmp_skeletons_directory = '{}/skeletons'.format(tmp_directory)
     if not os.path.exists(tmp_skeletons_directory):
         os.makedirs(tmp_skeletons_directory, exist_ok=True)
+    tmp_parents_directory = '{}/parents'.format(tmp_directory)
+    if not os.path.exists(tmp_parents_directory):
+        os.makedirs(tmp_parents_directory, exist_ok=True)
 
-    # create final output directories for skeletons, distances, and widths
+    # create final output directories for skeletons, distances, widths, and graphs
     skeletons_directory = '{}/skeletons'.format(skeleton_output_directory)
     if not os.path.exists(skeletons_directory):
         os.makedirs(skeletons_directory, exist_ok=True)
@@ -67,13 +147,23 @@ def RefineSkeleton(data, label):
     widths_directory = '{}/widths'.format(skeleton_output_directory)
     if not os.path.exists(widths_directory):
         os.makedirs(widths_directory, exist_ok=True)
+    graphs_directory = '{}/graphs'.format(skeleton_output_directory)
+    if not os.path.exists(graphs_directory):
+        os.makedirs(graphs_directory, exist_ok=True)
+
+    # get the index entries for the blocks that contain this label
+    index = ReadRefinementIndex(data)
+    start, end = np.searchsorted(index[:,0], [label, label + 1])
+    label_index = index[start:end,:]
+
+    # labels that do not occur in any block have no output
+    if not len(label_index): return
 
     # transform other variables
+    cdef np.ndarray[long, ndim=2, mode='c'] cpp_index_entries = np.ascontiguousarray(label_index[:,1:], dtype=ctypes.c_int64)
     cdef np.ndarray[float, ndim=1, mode='c'] cpp_resolution = np.ascontiguousarray(data.Resolution(), dtype=ctypes.c_float)
     cdef np.ndarray[long, ndim=1, mode='c'] cpp_volume_size = np.ascontiguousarray(data.VolumeSize(), dtype=ctypes.c_int64)
     cdef np.ndarray[long, ndim=1, mode='c'] cpp_block_size = np.ascontiguousarray(data.BlockSize(), dtype=ctypes.c_int64)
-    cdef np.ndarray[long, ndim=1, mode='c'] cpp_start_indices = np.ascontiguousarray(data.StartIndices(), dtype=ctypes.c_int64)
-    cdef np.ndarray[long, ndim=1, mode='c'] cpp_nblocks = np.ascontiguousarray(data.NBlocks(), dtype=ctypes.c_int64)
 
     CppSkeletonRefinement(tmp_directory.encode('utf-8'),
                           synapse_directory.encode('utf-8'),
@@ -82,8 +172,8 @@ def RefineSkeleton(data, label):
                           &(cpp_resolution[0]),
                           &(cpp_volume_size[0]),
                           &(cpp_block_size[0]),
-                          &(cpp_start_indices[0]),
-                          &(cpp_nblocks[0]))
+                          cpp_index_entries.shape[0],
+                          &(cpp_index_entries[0,0]))
 
     refinement_time = time.time() - refinement_time
 
@@ -98,22 +188,20 @@ def RefineSkeleton(data, label):
     assert (input_label == label)
     widths = {}
 
-    # read in the widths in each block
-    for iz in range(data.StartZ(), data.EndZ()):
-        for iy in range(data.StartY(), data.EndY()):
-            for ix in range(data.StartX(), data.EndX()):
-                # read the widths for this block if they exist
-                tmp_block_directory = data.TempBlockDirectory(iz, iy, ix)
-                widths_filename = '{}/widths/{:016d}.pts'.format(tmp_block_directory, label)
-                if not os.path.exists(widths_filename): continue
+    # read in the widths in each block (widths are written with the skeletons)
+    for (_, iz, iy, ix, _, skeleton_exists, _, _) in label_index:
+        if not skeleton_exists: continue
 
-                block_widths, input_label = ReadAttributePtsFile(data, widths_filename)
-                assert (input_label == label)
+        tmp_block_directory = data.TempBlockDirectory(iz, iy, ix)
+        widths_filename = '{}/widths/{:016d}.pts'.format(tmp_block_directory, label)
 
-                # if this voxel belongs to the refined skeleton, keep the width
-                for (voxel_index, width) in block_widths.items():
-                    if voxel_index in distances:
-                        widths[voxel_index] = width
+        block_widths, input_label = ReadAttributePtsFile(data, widths_filename)
+        assert (input_label == label)
+
+        # if this voxel belongs to the refined skeleton, keep the width
+        for (voxel_index, width) in block_widths.items():
+            if voxel_index in distances:
+                widths[voxel_index] = width
 
     assert (len(widths.keys()) == len(distances.keys()))
 
@@ -122,10 +210,35 @@ def RefineSkeleton(data, label):
 
     widths_time = time.time() - widths_time
 
+    # write the shortest path tree from refinement as an explicit graph
+    graph_time = time.time()
+
+    parents_filename = '{}/{:016d}.pts'.format(tmp_parents_directory, label)
+    global_indices, parent_indices, input_label = ReadParentsPtsFile(data, parents_filename)
+    assert (input_label == label)
+
+    # nodes are sorted by global index and parents refer to positions in nodes
+    order = np.argsort(global_indices, kind='stable')
+    nodes = global_indices[order]
+    parent_indices = parent_indices[order]
+
+    parents = np.searchsorted(nodes, parent_indices)
+    parents[parent_indices == -1] = -1
+    assert (np.all(nodes[parents[parents != -1]] == parent_indices[parents != -1]))
+
+    node_distances = np.array([distances[node] for node in nodes.tolist()], dtype=np.float32)
+    node_widths = np.array([widths[node] for node in nodes.tolist()], dtype=np.float32)
+
+    graph_filename = '{}/{:016d}.npz'.format(graphs_directory, label)
+    WriteSkeletonGraph(graph_filename, nodes, parents, node_distances, node_widths)
+
+    graph_time = time.time() - graph_time
+
     total_time = time.time() - total_time
 
     print ('Refinement Time: {:0.2f} seconds.'.format(refinement_time))
     print ('Update Widths Time: {:0.2f} seconds.'.format(widths_time))
+    print ('Graph Time: {:0.2f} seconds.'.format(graph_time))
     print ('Total Time: {:0.2f} seconds.'.format(total_time))
 
     # output timing statistics
@@ -136,4 +249,5 @@ def RefineSkeleton(data, label):
     with open(timing_filename, 'w') as fd:
         fd.write ('Refinement Time: {:0.2f} seconds.\n'.format(refinement_time))
         fd.write ('Update Widths Time: {:0.2f} seconds.\n'.format(widths_time))
+        fd.write ('Graph Time: {:0.2f} seconds.\n'.format(graph_time))
         fd.write ('Total Time: {:0.2f} seconds.\n'.format(total_time))
@@ -18,7 +18,8 @@ extensions = [
         name = 'thinning',
         include_dirs = [np.get_include()],
         sources = ['thinning.pyx', 'cpp-thinning.cpp', 'cpp-skeletonize.cpp'],
-        extra_compile_args = ['-O4', '-std=c++0x'],
+        extra_compile_args = ['-O4', '-std=c++0x', '-pthread'],
+        extra_link_args = ['-pthread'],
         undef_macros = ['NDEBUG'],
         language = 'c++'
     ),
@@ -26,7 +27,7 @@ extensions = [
     Extension(
         name = 'refinement',
         include_dirs = [np.get_include()],
-        sources = ['refinement.pyx', 'cpp-refinement.cpp', 'cpp-skeletonize.cpp', 'cpp-MinBinaryHeap.cpp'],
+        sources = ['refinement.pyx', 'cpp-refinement.cpp', 'cpp-skeletonize.cpp'],
         extra_compile_args = ['-O4', '-std=c++0x'],
         undef_macros = ['NDEBUG'],
         language = 'c++'
@@ -19,6 +19,7 @@ from blockbased_synapseaware.utilities.constants import NDIMS
 
 
 cdef extern from 'cpp-skeletonize.h':
+    void CppInitializeSimpleLookupTable(const char *lookup_table_directory)
     void CppTopologicalThinning(const char *lookup_table_directory,
                                 const char *tmp_directory,
                                 const char *synapse_directory,
@@ -28,11 +29,22 @@ cdef extern from 'cpp-skeletonize.h':
                                 float input_resolution[3],
                                 long input_volume_size[3],
                                 long input_block_size[3],
-                                long current_block_index[3])
+                                long current_block_index[3],
+                                long nthreads,
+                                long memory_budget) nogil
 
 
 
-def TopologicalThinning(data, iz, iy, ix):
+def InitializeLookupTables():
+    # map the simple lookup table into the process-wide cache ahead of time
+    # later calls in this process reuse the mapped table
+    lookup_table_directory = os.path.dirname(__file__)
+
+    CppInitializeSimpleLookupTable(lookup_table_directory.encode('utf-8'))
+
+
+
+def TopologicalThinning(data, iz, iy, ix, nthreads=1, memory_budget=None):
     # start timing statistics
     total_time = time.time()
 
@@ -48,7 +60,9 @@ def TopologicalThinning(data, iz, iy, ix):
         for iv in range(NDIMS):
             assert (somata.shape[iv] * somata_downsample_rate == segmentation.shape[iv])
 
-    # thin each label in the block sequentially
+    # thin the labels in the block with nthreads threads sharing memory_budget bytes for their dense label volumes
+    assert (nthreads > 0)
+    if memory_budget is None: memory_budget = os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
     thinning_time = time.time()
 
     tmp_directory = data.TempBlockDirectory(iz, iy, ix)
@@ -65,6 +79,13 @@ def TopologicalThinning(data, iz, iy, ix):
     if not os.path.exists(widths_directory):
         os.mkdir(widths_directory)
 
+    # the refinement index is out of date once the skeletons change
+    refinement_index_filename = '{}/refinement-index.npy'.format(data.TempDirectory())
+    try:
+        os.remove(refinement_index_filename)
+    except FileNotFoundError:
+        pass
+
     # transform the segmentation and somata into a c++ array
     cdef np.ndarray[long, ndim=3, mode='c'] cpp_segmentation = np.ascontiguousarray(segmentation, dtype=ctypes.c_int64)
     # somata array depends on input parameters from the meta file
@@ -88,16 +109,32 @@ def TopologicalThinning(data, iz, iy, ix):
     # get the current index for this block in c++ form
     cdef np.ndarray[long, ndim=1, mode='c'] cpp_current_block_index = np.ascontiguousarray((iz, iy, ix), dtype=ctypes.c_int64)
 
-    CppTopologicalThinning(lookup_table_directory.encode('utf-8'),
-                           tmp_directory.encode('utf-8'),
-                           synapse_directory.encode('utf-8'),
-                           &(cpp_segmentation[0,0,0]),
-                           &(cpp_somata[0,0,0]),
-                           somata_downsample_rate,
-                           &(cpp_resolution[0]),
-                           &(cpp_volume_size[0]),
-                           &(cpp_block_size[0]),
-                           &(cpp_current_block_index[0]))
+    # keep references to the encoded strings while the GIL is released
+    cpp_lookup_table_directory = lookup_table_directory.encode('utf-8')
+    cpp_tmp_directory = tmp_directory.encode('utf-8')
+    cpp_synapse_directory = synapse_directory.encode('utf-8')
+
+    cdef const char *lookup_table_directory_pointer = cpp_lookup_table_directory
+    cdef const char *tmp_directory_pointer = cpp_tmp_directory
+    cdef const char *synapse_directory_pointer = cpp_synapse_directory
+    cdef long cpp_somata_downsample_rate = somata_downsample_rate
+    cdef long cpp_nthreads = nthreads
+    cdef long cpp_memory_budget = memory_budget
+
+    # the worker threads do not need the GIL
+    with nogil:
+        CppTopologicalThinning(lookup_table_directory_pointer,
+                               tmp_directory_pointer,
+                               synapse_directory_pointer,
+                               &(cpp_segmentation[0,0,0]),
+                               &(cpp_somata[0,0,0]),
+                               cpp_somata_downsample_rate,
+                               &(cpp_resolution[0]),
+                               &(cpp_volume_size[0]),
+                               &(cpp_block_size[0]),
+                               &(cpp_current_block_index[0]),
+                               cpp_nthreads,
+                               cpp_memory_budget)
 
     thinning_time = time.time() - thinning_time
 
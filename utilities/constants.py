@@ -7,3 +7,10 @@ NDIMS = 3
 
 # constant for border contact in connected components
 BORDER_CONTACT = 0x7FFFFFFFFFFFFFFF
+
+
+
+# indexed pts files end with a table of (label, offset, count) entries and a trailer of
+# (table offset, number of labels, version, magic) after the checksum
+PTS_INDEX_MAGIC = 0x5845444E49535450
+PTS_INDEX_VERSION = 1
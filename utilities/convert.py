@@ -3,11 +3,47 @@ import time
 
 
 
-from blockbased_synapseaware.utilities.dataIO import ReadMetaData, ReadPtsFile, WritePtsFile
+import numpy as np
 
 
 
-def MapSynapsesAndSurfaces(input_meta_filename, output_meta_filename):
+from blockbased_synapseaware.utilities.dataIO import ReadMetaData, ReadPtsFile, WriteH5File, WritePtsFile
+from blockbased_synapseaware.utilities.scheduler import Blocks, MapTasks, ReadWorkerMetaData
+from blockbased_synapseaware.utilities.synapses import DivideSynapsesIntoBlocks
+from blockbased_synapseaware.utilities.constants import *
+
+
+
+def MapGlobalIndices(input_data, output_data, input_global_indices):
+    # the global iz, iy, ix coordinates remain the same across blocks
+    global_indices = np.unravel_index(np.asarray(input_global_indices, dtype=np.int64), input_data.VolumeSize())
+
+    # get the new global indices
+    return np.ravel_multi_index(global_indices, output_data.VolumeSize()).astype(np.int64)
+
+
+
+def MapSurface(input_data, label, output_meta_filename):
+    start_time = time.time()
+
+    output_data = ReadWorkerMetaData(output_meta_filename)
+
+    # read in the input global points
+    input_surface_filename = '{}/{:016d}.pts'.format(input_data.SurfacesDirectory(), label)
+    input_global_points, _ = ReadPtsFile(input_data, input_surface_filename, label = label)
+
+    output_global_points = {}
+    output_global_points[label] = MapGlobalIndices(input_data, output_data, input_global_points[label])
+
+    # write the new surface filename
+    output_surface_filename = '{}/{:016d}.pts'.format(output_data.SurfacesDirectory(), label)
+    WritePtsFile(output_data, output_surface_filename, output_global_points, input_local_indices = False)
+
+    print ('Completed label {} in {:0.2f} seconds'.format(label, time.time() - start_time))
+
+
+
+def MapSynapsesAndSurfaces(input_meta_filename, output_meta_filename, nprocesses=None):
     # read in the meta data files
     input_data = ReadMetaData(input_meta_filename)
     output_data = ReadMetaData(output_meta_filename)
@@ -19,8 +55,9 @@ def MapSynapsesAndSurfaces(input_meta_filename, output_meta_filename):
     if not os.path.exists(output_synapse_directory):
         os.makedirs(output_synapse_directory, exist_ok=True)
 
-    # read in all of the input syanpses
-    input_synapses = {}
+    # read in all of the input synapses and their labels in block order
+    input_synapses = [np.zeros(0, dtype=np.int64)]
+    input_synapse_labels = [np.zeros(0, dtype=np.int64)]
 
     for iz in range(input_data.StartZ(), input_data.EndZ()):
         for iy in range(input_data.StartY(), input_data.EndY()):
@@ -31,87 +68,102 @@ def MapSynapsesAndSurfaces(input_meta_filename, output_meta_filename):
                 global_pts, _ = ReadPtsFile(input_data, input_synapse_filename)
 
                 for label in global_pts:
-                    if not label in input_synapses:
-                        input_synapses[label] = []
-
-                    # add the array from this block to the input synapses
-                    input_synapses[label] += global_pts[label]
-
-    # create an output dictionary of synapses per block
-    output_synapses_per_block = {}
-
-    # iterate over all output blocks
-    for iz in range(output_data.StartZ(), output_data.EndZ()):
-        for iy in range(output_data.StartY(), output_data.EndY()):
-            for ix in range(output_data.StartX(), output_data.EndX()):
-                # create empty synapses_per_block dictionaries whose keys will be labels
-                output_synapses_per_block[(iz, iy, ix)] = {}
-
-    # for every label, go through the discovered synapses from the input data
-    for label in input_synapses.keys():
-        input_synapses_per_label = input_synapses[label]
+                    input_synapses.append(np.array(global_pts[label], dtype=np.int64))
+                    input_synapse_labels.append(np.full(len(global_pts[label]), label, dtype=np.int64))
 
-        for input_global_index in input_synapses_per_label:
-            # the global iz, iy, ix coordinates remain the same across blocks
-            global_iz, global_iy, global_ix = input_data.GlobalIndexToIndices(input_global_index)
+    input_synapses = np.concatenate(input_synapses)
+    input_synapse_labels = np.concatenate(input_synapse_labels)
 
-            # get the new block from the global coordinates
-            output_block_iz = global_iz // output_data.BlockZLength()
-            output_block_iy = global_iy // output_data.BlockYLength()
-            output_block_ix = global_ix // output_data.BlockXLength()
-
-            if not label in output_synapses_per_block[(output_block_iz, output_block_iy, output_block_ix)]:
-                output_synapses_per_block[(output_block_iz, output_block_iy, output_block_ix)][label] = []
-
-            # get the new global index
-            output_global_index = output_data.GlobalIndicesToIndex(global_iz, global_iy, global_ix)
-
-            output_synapses_per_block[(output_block_iz, output_block_iy, output_block_ix)][label].append(output_global_index)
+    # get the new global indices and divide the synapses into the output blocks
+    output_synapses = MapGlobalIndices(input_data, output_data, input_synapses)
+    output_synapses_per_block = DivideSynapsesIntoBlocks(output_data, output_synapses, input_synapse_labels)
 
     # write all of the synapse block files
-    output_synapses_directory = output_data.SynapseDirectory()
     for iz in range(output_data.StartZ(), output_data.EndZ()):
         for iy in range(output_data.StartY(), output_data.EndY()):
             for ix in range(output_data.StartX(), output_data.EndX()):
                 output_synapse_filename = '{}/{:04d}z-{:04d}y-{:04d}x.pts'.format(output_synapse_directory, iz, iy, ix)
 
-                # write the pts file (use global indices)
-                WritePtsFile(output_data, output_synapse_filename, output_synapses_per_block[(iz, iy, ix)], input_local_indices = False)
+                # write the pts file (use global indices) with a label table for random access
+                WritePtsFile(output_data, output_synapse_filename, output_synapses_per_block[(iz, iy, ix)], input_local_indices = False, indexed = True)
 
     # get the input/output directories for the surfaces
     input_surfaces_directory = input_data.SurfacesDirectory()
     output_surfaces_directory = output_data.SurfacesDirectory()
 
-    # create the output synapse directory if it does not exist
+    # create the output surfaces directory if it does not exist
     if not os.path.exists(output_surfaces_directory):
         os.makedirs(output_surfaces_directory, exist_ok=True)
 
-    # iterate over all labels
-    for label in range(1, input_data.NLabels()):
-        start_time = time.time()
+    # skip over labels that do not exist
+    surface_filenames = set(os.listdir(input_surfaces_directory))
+    labels = [label for label in range(1, input_data.NLabels()) if '{:016d}.pts'.format(label) in surface_filenames]
+
+    # map the surfaces of all labels in parallel
+    MapTasks(input_meta_filename, MapSurface, [(label, output_meta_filename) for label in labels], nprocesses)
+
+
+
+def ReblockSegmentationBlock(output_data, iz, iy, ix, input_meta_filename):
+    start_time = time.time()
+
+    input_data = ReadWorkerMetaData(input_meta_filename)
+
+    input_block_size = input_data.BlockSize()
+    output_block_size = output_data.BlockSize()
+    volume_size = output_data.VolumeSize()
+
+    # get the global extent of this output block (blocks on the far edges may be smaller)
+    output_start = (iz * output_block_size[OR_Z], iy * output_block_size[OR_Y], ix * output_block_size[OR_X])
+    output_end = tuple(min(output_start[dim] + output_block_size[dim], volume_size[dim]) for dim in range(3))
 
-        # skip over labels that do not exist
-        input_surface_filename = '{}/{:016d}.pts'.format(input_surfaces_directory, label)
-        if not os.path.exists(input_surface_filename): continue
+    # get the range of input blocks that overlap this output block
+    input_start_block = tuple(output_start[dim] // input_block_size[dim] for dim in range(3))
+    input_end_block = tuple((output_end[dim] - 1) // input_block_size[dim] + 1 for dim in range(3))
 
-        # read in the input global points
-        input_global_points, _ = ReadPtsFile(input_data, input_surface_filename)
+    segmentation = None
 
-        # create an empty dictionary for the output points
-        output_global_points = {}
-        output_global_points[label] = []
+    for jz in range(input_start_block[OR_Z], input_end_block[OR_Z]):
+        for jy in range(input_start_block[OR_Y], input_end_block[OR_Y]):
+            for jx in range(input_start_block[OR_X], input_end_block[OR_X]):
+                input_start = (jz * input_block_size[OR_Z], jy * input_block_size[OR_Y], jx * input_block_size[OR_X])
 
-        for input_global_index in input_global_points[label]:
-            # the global iz, iy, ix coordinates remain the same across blocks
-            global_iz, global_iy, global_ix = input_data.GlobalIndexToIndices(input_global_index)
+                # get the global extent of the overlap between the two blocks
+                overlap_start = tuple(max(output_start[dim], input_start[dim]) for dim in range(3))
+                overlap_end = tuple(min(output_end[dim], input_start[dim] + input_block_size[dim]) for dim in range(3))
+
+                # read only the overlap from the input block
+                input_window = tuple(slice(overlap_start[dim] - input_start[dim], overlap_end[dim] - input_start[dim]) for dim in range(3))
+                input_segmentation = input_data.ReadRawSegmentationBlock(jz, jy, jx, input_window)
+
+                if segmentation is None:
+                    segmentation = np.zeros(tuple(output_end[dim] - output_start[dim] for dim in range(3)), dtype=input_segmentation.dtype)
+
+                output_window = tuple(slice(overlap_start[dim] - output_start[dim], overlap_end[dim] - output_start[dim]) for dim in range(3))
+                segmentation[output_window] = input_segmentation
+
+    output_filename = '{}/{:04d}z-{:04d}y-{:04d}x.h5'.format(output_data.RawSegmentationDirectory(), iz, iy, ix)
+    WriteH5File(segmentation, output_filename, compression = output_data.H5Compression(), chunks = output_data.H5ChunkSize())
+
+    print ('Completed block {:04d}z-{:04d}y-{:04d}x in {:0.2f} seconds'.format(iz, iy, ix, time.time() - start_time))
+
+
+
+def ReblockSegmentation(input_meta_filename, output_meta_filename, nprocesses=None):
+    # read in the meta data files
+    input_data = ReadMetaData(input_meta_filename)
+    output_data = ReadMetaData(output_meta_filename)
 
-            # get the new global index
-            output_global_index = output_data.GlobalIndicesToIndex(global_iz, global_iy, global_ix)
+    # the blocks must cover the same volume
+    assert (input_data.VolumeSize() == output_data.VolumeSize())
 
-            output_global_points[label].append(output_global_index)
+    # output blocks have the same names as the input blocks so they would overwrite blocks other processes still read
+    assert (not os.path.realpath(input_data.RawSegmentationDirectory()) == os.path.realpath(output_data.RawSegmentationDirectory()))
 
-        # write the new surface filename
-        output_surface_filename = '{}/{:016d}.pts'.format(output_surfaces_directory, label)
-        WritePtsFile(output_data, output_surface_filename, output_global_points, input_local_indices = False)
+    # create the output segmentation directory if it does not exist
+    if not os.path.exists(output_data.RawSegmentationDirectory()):
+        os.makedirs(output_data.RawSegmentationDirectory(), exist_ok=True)
 
-        print ('Completed label {} in {:0.2f} seconds'.format(label, time.time() - start_time))
+    # every output block reads only the overlapping parts of the input blocks so no volume is held in memory
+    arguments = [block + (input_meta_filename,) for block in Blocks(output_data)]
+    MapTasks(output_meta_filename, ReblockSegmentationBlock, arguments, nprocesses)
@@ -8,7 +8,16 @@ import numpy as np
 
 
 
+# the lz4 and zstd filters are only available with the optional hdf5plugin package
+try:
+    import hdf5plugin
+except ImportError:
+    hdf5plugin = None
+
+
+
 from blockbased_synapseaware.data_structures.meta_data import MetaData
+from blockbased_synapseaware.utilities.constants import PTS_INDEX_MAGIC, PTS_INDEX_VERSION
 
 
 
@@ -18,17 +27,52 @@ def ReadMetaData(meta_filename):
 
 
 
-def ReadH5File(filename):
+def ReadH5File(filename, window = None):
     with h5py.File(filename, 'r') as hf:
-        data = np.array(hf[list(hf.keys())[0]])
+        dataset = hf[list(hf.keys())[0]]
+
+        # read only the chunks that overlap the window (a tuple of slices)
+        if window == None: data = dataset[()]
+        else: data = dataset[window]
 
     return data
 
 
 
-def WriteH5File(data, filename):
+def H5CompressionAvailable(compression):
+    # the lz4 and zstd filters need the optional hdf5plugin package
+    if compression in ['lz4', 'zstd']: return not hdf5plugin == None
+
+    return True
+
+
+
+def H5CompressionOptions(compression):
+    # return the h5py dataset arguments for the compression names allowed in the meta file
+    if compression == 'none':
+        return {}
+    elif compression == 'gzip':
+        return { 'compression': 'gzip' }
+    elif compression.startswith('gzip-'):
+        return { 'compression': 'gzip', 'compression_opts': int(compression[len('gzip-'):]) }
+    elif compression == 'lz4':
+        return dict(hdf5plugin.LZ4())
+    elif compression == 'zstd':
+        return dict(hdf5plugin.Zstd())
+    else:
+        assert (False)
+
+
+
+def WriteH5File(data, filename, compression = 'gzip', chunks = None):
+    options = H5CompressionOptions(compression)
+
+    # chunks only apply to datasets of the same rank and cannot exceed the dataset shape
+    if not chunks == None and len(chunks) == data.ndim:
+        options['chunks'] = tuple(min(chunk, size) for chunk, size in zip(chunks, data.shape))
+
     with h5py.File(filename, 'w') as hf:
-        hf.create_dataset('main', data=data, compression='gzip')
+        hf.create_dataset('main', data=data, **options)
 
 
 
@@ -53,7 +97,154 @@ def ReadPickledData(filename):
 
 
 
-def ReadPtsFile(data, filename):
+def WriteEdgeArray(edges, filename):
+    # edges are saved as a lexicographically sorted (N, 2) int64 array without duplicates
+    edges = np.unique(np.asarray(edges, dtype=np.int64).reshape(-1, 2), axis=0)
+
+    np.save(filename, edges)
+
+
+
+def ReadEdgeArray(filename):
+    edges = np.load(filename)
+
+    assert (edges.dtype == np.int64 and edges.ndim == 2 and edges.shape[1] == 2)
+
+    return edges
+
+
+
+def WriteLabelMapping(keys, values, filename):
+    # mappings are saved as two int64 arrays sorted by key
+    keys = np.asarray(keys, dtype=np.int64)
+    values = np.asarray(values, dtype=np.int64)
+    assert (keys.shape == values.shape)
+
+    order = np.argsort(keys, kind='stable')
+
+    np.savez(filename, keys=keys[order], values=values[order])
+
+
+
+def ReadLabelMapping(filename):
+    with np.load(filename) as contents:
+        return contents['keys'], contents['values']
+
+
+
+def ReadAssociatedLabels(data, iz, iy, ix):
+    # the associated label of the background component -1 - block_index * block_volume - offset is at offset
+    return np.load('{}/hole-filling-associated-labels.npy'.format(data.TempBlockDirectory(iz, iy, ix)))
+
+
+
+def ReadPtsFileFooter(contents):
+    # return the label table of an indexed pts file or None for files without one
+    if contents.size < 11 or not contents[-1] == PTS_INDEX_MAGIC: return None
+
+    table_offset, nlabels, version = (int(value) for value in contents[-4:-1])
+    assert (version == PTS_INDEX_VERSION)
+    assert (nlabels == int(contents[6]))
+
+    # the table has a (label, offset, count) row for every label
+    table = contents[table_offset // 8:table_offset // 8 + 3 * nlabels]
+
+    index = {}
+    for (label, offset, nvoxels) in table.reshape(-1, 3):
+        index[int(label)] = (int(offset), int(nvoxels))
+
+    return index
+
+
+
+def ReadPtsFile(data, filename, label = None):
+    # only read the indices for this label when the file has a label table
+    if not label == None:
+        contents = np.memmap(filename, dtype=np.int64, mode='r')
+        index = ReadPtsFileFooter(contents)
+
+        if not index == None:
+            # assert the header matches the current data info
+            assert (tuple(int(value) for value in contents[0:3]) == data.VolumeSize())
+            assert (tuple(int(value) for value in contents[3:6]) == data.BlockSize())
+
+            # labels that do not occur have no indices
+            offset, nvoxels = index.get(label, (0, 0))
+            offset = offset // 8
+
+            # copy the indices so that the file is not mapped after returning
+            global_indices = { label: np.array(contents[offset:offset + nvoxels]) }
+            local_indices = { label: np.array(contents[offset + nvoxels:offset + 2 * nvoxels]) }
+
+            return global_indices, local_indices
+
+    # read the entire file at once, the indices for each label are views into this array
+    contents = np.fromfile(filename, dtype=np.int64)
+
+    # read the header
+    volume_size = tuple(int(value) for value in contents[0:3])
+    block_size = tuple(int(value) for value in contents[3:6])
+    nlabels = int(contents[6])
+
+    # assert the header matches the current data info
+    assert (volume_size == data.VolumeSize())
+    assert (block_size == data.BlockSize())
+
+    # create dictionaries for the global and local indices
+    global_indices = {}
+    local_indices = {}
+
+    # check sum confirms proper I/O
+    checksums = []
+
+    # iterate through all labels in this volume
+    offset = 7
+    for _ in range(nlabels):
+        chapter_label, nvoxels = int(contents[offset]), int(contents[offset + 1])
+        offset += 2
+
+        # get the global and local indices
+        chapter_global_indices = contents[offset:offset + nvoxels]
+        chapter_local_indices = contents[offset + nvoxels:offset + 2 * nvoxels]
+        offset += 2 * nvoxels
+
+        checksums.append(np.sum(chapter_global_indices))
+        checksums.append(np.sum(chapter_local_indices))
+
+        # only keep the requested label (the checksum still covers every label)
+        if label == None or chapter_label == label:
+            global_indices[chapter_label] = chapter_global_indices
+            local_indices[chapter_label] = chapter_local_indices
+
+    # verify the check sum (which wraps around like the c++ code)
+    checksum = np.sum(np.array(checksums, dtype=np.int64))
+    assert (contents[offset] == checksum)
+
+    # the checksum is either the end of the file or followed by the label table
+    index = ReadPtsFileFooter(contents)
+    if index == None: assert (offset == contents.size - 1)
+    else: assert (offset == int(contents[-4]) // 8 - 1)
+
+    # labels that do not occur have no indices
+    if not label == None:
+        global_indices = { label: global_indices.get(label, np.zeros(0, dtype=np.int64)) }
+        local_indices = { label: local_indices.get(label, np.zeros(0, dtype=np.int64)) }
+
+    return global_indices, local_indices
+
+
+
+def ReadPtsFileIndex(data, filename):
+    # use the label table if the file has one
+    contents = np.memmap(filename, dtype=np.int64, mode='r')
+    index = ReadPtsFileFooter(contents)
+    if not index == None:
+        # assert the header matches the current data info
+        assert (tuple(int(value) for value in contents[0:3]) == data.VolumeSize())
+        assert (tuple(int(value) for value in contents[3:6]) == data.BlockSize())
+
+        return index
+
     # open the file
     with open(filename, 'rb') as fd:
         # read the header
@@ -65,28 +256,19 @@ def ReadPtsFile(data, filename):
         assert (volume_size == data.VolumeSize())
         assert (block_size == data.BlockSize())
 
-        # create dictionaries for the global and local indices
-        global_indices = {}
-        local_indices = {}
+        # create a dictionary from labels to the file offset of the global indices and number of voxels
+        index = {}
 
-        # check sum confirms proper I/O
-        checksum = 0
-
-        # iterate through all labels in this volume
+        # skip over the indices of every label
         for _ in range(nlabels):
             label, nvoxels, = struct.unpack('qq', fd.read(16))
+            assert (not label in index)
 
-            # read in the global and local indices
-            global_indices[label] = list(struct.unpack('%sq' % nvoxels, fd.read(8 * nvoxels)))
-            local_indices[label] = list(struct.unpack('%sq' % nvoxels, fd.read(8 * nvoxels)))
-
-            checksum += sum(global_indices[label] + local_indices[label])
+            index[label] = (fd.tell(), nvoxels)
 
-        # verify the check sum
-        input_checksum, = struct.unpack('q', fd.read(8))
-        assert (input_checksum == checksum)
+            fd.seek(16 * nvoxels, 1)
 
-    return global_indices, local_indices
+    return index
 
 
 
@@ -119,7 +301,50 @@ def ReadAttributePtsFile(data, filename):
 
 
 
-def WritePtsFile(data, filename, points, block_index = None, input_local_indices = True):
+def ReadParentsPtsFile(data, filename):
+    # read the entire file at once
+    contents = np.fromfile(filename, dtype=np.int64)
+
+    # assert the header matches the current data info
+    assert (tuple(int(value) for value in contents[0:3]) == data.VolumeSize())
+    assert (tuple(int(value) for value in contents[3:6]) == data.BlockSize())
+    assert (int(contents[6]) == 1)
+
+    label, nvoxels = int(contents[7]), int(contents[8])
+
+    # the global index of every voxel followed by the global index of its parent (-1 for roots)
+    global_indices = contents[9:9 + nvoxels]
+    parent_indices = contents[9 + nvoxels:9 + 2 * nvoxels]
+
+    # verify the check sum (which wraps around like the c++ code)
+    checksum = np.sum(np.array([np.sum(global_indices), np.sum(parent_indices)], dtype=np.int64))
+    assert (contents[9 + 2 * nvoxels] == checksum)
+    assert (contents.size == 10 + 2 * nvoxels)
+
+    return global_indices, parent_indices, label
+
+
+
+def WriteSkeletonGraph(filename, nodes, parents, distances, widths):
+    # graphs are saved as the sorted global indices of the nodes, the position of each node's parent
+    # in nodes (-1 for roots), and the distance to the nearest root and width of every node
+    nodes = np.asarray(nodes, dtype=np.int64)
+    parents = np.asarray(parents, dtype=np.int64)
+    distances = np.asarray(distances, dtype=np.float32)
+    widths = np.asarray(widths, dtype=np.float32)
+    assert (nodes.shape == parents.shape == distances.shape == widths.shape)
+
+    np.savez(filename, nodes=nodes, parents=parents, distances=distances, widths=widths)
+
+
+
+def ReadSkeletonGraph(filename):
+    with np.load(filename) as contents:
+        return contents['nodes'], contents['parents'], contents['distances'], contents['widths']
+
+
+
+def WritePtsFile(data, filename, points, block_index = None, input_local_indices = True, indexed = False):
     # if local indices are given, need to know block index
     if (input_local_indices == True): assert (not block_index == None)
 
@@ -133,42 +358,44 @@ def WritePtsFile(data, filename, points, block_index = None, input_local_indices
 
     with open(filename, 'wb') as fd:
         # write the header for the points file
-        fd.write(struct.pack('qqq', *volume_size))
-        fd.write(struct.pack('qqq', *block_size))
-        fd.write(struct.pack('q', nlabels))
+        np.array(volume_size + block_size + (nlabels,), dtype=np.int64).tofile(fd)
 
         # checksum for file verification
-        checksum = 0
+        checksums = []
+
+        # the label table has a (label, offset, count) row for every label
+        table = []
 
         for label in labels:
+            voxel_indices = np.asarray(points[label], dtype=np.int64)
+
+            # get the local and global indices for all voxels at once
+            if input_local_indices:
+                global_indices = np.asarray(data.LocalIndexToGlobalIndex(voxel_indices, block_index), dtype=np.int64)
+                local_indices = voxel_indices
+            else:
+                global_indices = voxel_indices
+                local_indices = np.asarray(data.GlobalIndexToLocalIndex(voxel_indices), dtype=np.int64)
+
             # write the header for this points chapter
-            nvoxels = len(points[label])
-            fd.write(struct.pack('qq', label, nvoxels))
-
-            global_indices = []
-            local_indices = []
-
-            # get the local and global index
-            for voxel_index in points[label]:
-                if input_local_indices:
-                    global_indices.append(data.LocalIndexToGlobalIndex(voxel_index, block_index))
-                    local_indices.append(voxel_index)
-                else:
-                    global_indices.append(voxel_index)
-                    local_indices.append(data.GlobalIndexToLocalIndex(voxel_index))
-
-            # write the global indices
-            for global_index in global_indices:
-                fd.write(struct.pack('q', global_index))
-                checksum += global_index
-
-            # write the local indices
-            for local_index in local_indices:
-                fd.write(struct.pack('q', local_index))
-                checksum += local_index
-
-        # write the checksum
-        fd.write(struct.pack('q', checksum))
+            np.array((label, voxel_indices.size), dtype=np.int64).tofile(fd)
+            table.append((label, fd.tell(), voxel_indices.size))
+
+            # write the global and local indices
+            global_indices.tofile(fd)
+            local_indices.tofile(fd)
+
+            checksums.append(np.sum(global_indices))
+            checksums.append(np.sum(local_indices))
+
+        # write the checksum (which wraps around like the c++ code)
+        np.array([np.sum(np.array(checksums, dtype=np.int64))], dtype=np.int64).tofile(fd)
+
+        # readers that do not know about the label table stop after the checksum
+        if indexed:
+            table_offset = fd.tell()
+            np.array(table, dtype=np.int64).reshape(-1, 3).tofile(fd)
+            np.array((table_offset, nlabels, PTS_INDEX_VERSION, PTS_INDEX_MAGIC), dtype=np.int64).tofile(fd)
 
 
 
@@ -0,0 +1,159 @@
+import os
+import time
+
+
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from itertools import islice
+
+
+
+from blockbased_synapseaware.utilities.dataIO import ReadMetaData
+
+
+
+# each worker process reads the meta data once
+worker_data = None
+# the other meta data files that tasks read (for example the output of a conversion) are also read once per process
+worker_other_data = {}
+
+
+
+def InitializeWorker(meta_filename):
+    global worker_data
+
+    worker_data = ReadMetaData(meta_filename)
+
+
+
+def ReadWorkerMetaData(meta_filename):
+    # parse every other meta data file once per process and share it between the tasks
+    if not meta_filename in worker_other_data:
+        worker_other_data[meta_filename] = ReadMetaData(meta_filename)
+
+    return worker_other_data[meta_filename]
+
+
+
+def RunTask(function, arguments):
+    # every task takes the meta data as its first argument
+    return function(worker_data, *arguments)
+
+
+
+def Blocks(data):
+    # return all blocks in the volume in the sequential order
+    blocks = []
+    for iz in range(data.StartZ(), data.EndZ()):
+        for iy in range(data.StartY(), data.EndY()):
+            for ix in range(data.StartX(), data.EndX()):
+                blocks.append((iz, iy, ix))
+
+    return blocks
+
+
+
+def PositiveNeighbors(data, iz, iy, ix):
+    # return the neighbors in the +z, +y, and +x directions that are in the volume
+    neighbors = []
+    if iz < data.EndZ() - 1: neighbors.append((iz + 1, iy, ix))
+    if iy < data.EndY() - 1: neighbors.append((iz, iy + 1, ix))
+    if ix < data.EndX() - 1: neighbors.append((iz, iy, ix + 1))
+
+    return neighbors
+
+
+
+def NegativeNeighbors(data, iz, iy, ix):
+    # return the neighbors in the -z, -y, and -x directions that are in the volume
+    neighbors = []
+    if iz > data.StartZ(): neighbors.append((iz - 1, iy, ix))
+    if iy > data.StartY(): neighbors.append((iz, iy - 1, ix))
+    if ix > data.StartX(): neighbors.append((iz, iy, ix - 1))
+
+    return neighbors
+
+
+
+def ExecuteTasks(meta_filename, tasks, nprocesses=None):
+    # tasks maps a key to a (function, arguments, dependencies) tuple where the function is called
+    # as function(data, *arguments) once every task in dependencies has finished
+    # tasks are inserted in sequential order which is the order of submission when several are ready
+    total_time = time.time()
+
+    for key, (_, _, dependencies) in tasks.items():
+        for dependency in dependencies:
+            assert (dependency in tasks)
+
+    # the number of unfinished dependencies for each task and the tasks waiting on each task
+    nremaining = {}
+    dependents = {}
+    for key, (_, _, dependencies) in tasks.items():
+        nremaining[key] = len(dependencies)
+        for dependency in dependencies:
+            dependents.setdefault(dependency, []).append(key)
+
+    if nprocesses is None: nprocesses = os.cpu_count()
+
+    with ProcessPoolExecutor(max_workers=nprocesses, initializer=InitializeWorker, initargs=(meta_filename,)) as executor:
+        running = {}
+
+        # submit every task that has no dependencies
+        for key in tasks:
+            if not nremaining[key]:
+                function, arguments, _ = tasks[key]
+                running[executor.submit(RunTask, function, arguments)] = key
+
+        nfinished = 0
+        while len(running):
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+
+            for future in finished:
+                key = running.pop(future)
+
+                # raise any exception from the worker process
+                future.result()
+                nfinished += 1
+
+                # submit the tasks whose inputs now all exist
+                for dependent in dependents.get(key, []):
+                    nremaining[dependent] -= 1
+                    if not nremaining[dependent]:
+                        function, arguments, _ = tasks[dependent]
+                        running[executor.submit(RunTask, function, arguments)] = dependent
+
+    # tasks are left over only when the dependencies contain a cycle
+    assert (nfinished == len(tasks))
+
+    total_time = time.time() - total_time
+
+    print ('Executed {} Tasks with {} Processes: {:0.2f} seconds.'.format(len(tasks), nprocesses, total_time))
+
+
+
+def IterateTasks(meta_filename, function, arguments, nprocesses=None):
+    # call function(data, *argument) for every argument tuple and yield the results in the same order
+    if nprocesses is None: nprocesses = os.cpu_count()
+
+    # keep a few tasks per process in flight so the parent holds only the results not yet consumed
+    arguments = iter(arguments)
+    window = 2 * nprocesses
+
+    with ProcessPoolExecutor(max_workers=nprocesses, initializer=InitializeWorker, initargs=(meta_filename,)) as executor:
+        futures = deque(executor.submit(RunTask, function, argument) for argument in islice(arguments, window))
+
+        while len(futures):
+            result = futures.popleft().result()
+
+            # submit the next task before handing over the result
+            for argument in islice(arguments, 1):
+                futures.append(executor.submit(RunTask, function, argument))
+
+            yield result
+
+
+
+def MapTasks(meta_filename, function, arguments, nprocesses=None):
+    # call function(data, *argument) for every argument tuple and return the results in the same order
+    return list(IterateTasks(meta_filename, function, arguments, nprocesses))
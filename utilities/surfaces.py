@@ -3,100 +3,85 @@ import time
 
 
 
+from collections import OrderedDict
+
+
+
 import numpy as np
 
 
 
-from numba import jit, types
+from blockbased_synapseaware.utilities.dataIO import ReadMetaData, ReadPtsFile, ReadPtsFileIndex, WritePtsFile
+from blockbased_synapseaware.utilities.scheduler import Blocks, ExecuteTasks
 
 
 
-from blockbased_synapseaware.utilities.dataIO import ReadMetaData, ReadPtsFile, WritePtsFile
+# the number of combined surface files kept open while streaming through the blocks
+SURFACE_FILES_CACHE_SIZE = 512
 
 
 
-@jit(nopython=True)
 def ProduceSurfacesFromSegmentation(segmentation):
-    zres, yres, xres = segmentation.shape
+    # a voxel is on the surface if one of its six neighbors in this block has a different label
+    surface = np.zeros(segmentation.shape, dtype=bool)
 
-    # create a univeral list of surface voxels
-    surfaces = []
+    for axis in range(segmentation.ndim):
+        # compare every voxel with the next voxel along this axis
+        lower = tuple(slice(0, -1) if dimension == axis else slice(None) for dimension in range(segmentation.ndim))
+        upper = tuple(slice(1, None) if dimension == axis else slice(None) for dimension in range(segmentation.ndim))
 
-    # create a set of all the labels in this block
-    labels = set()
+        different = segmentation[lower] != segmentation[upper]
 
-    # iterate over all voxels
-    for iz in range(zres):
-        for iy in range(yres):
-            for ix in range(xres):
-                label = segmentation[iz,iy,ix]
+        # both voxels of a differing pair are surface voxels
+        surface[lower] |= different
+        surface[upper] |= different
 
-                # skip over background elements
-                if not label: continue
+    # get the linear indices (z * yres * xres + y * xres + x) of the non background surface voxels
+    surface &= (segmentation != 0)
+    voxel_indices = np.flatnonzero(surface).astype(np.int64)
+    del surface
 
-                if not label in labels:
-                    labels.add(label)
+    # sort the surface voxels by label keeping the linear indices in increasing order
+    voxel_labels = segmentation.ravel()[voxel_indices]
+    order = np.argsort(voxel_labels, kind='stable')
+    voxel_labels = voxel_labels[order]
+    voxel_indices = voxel_indices[order]
 
-                # consider the six neighborhood
-                surface = False
-                if iz > 0 and not label == segmentation[iz-1,iy,ix]: surface = True
-                if iy > 0 and not label == segmentation[iz,iy-1,ix]: surface = True
-                if ix > 0 and not label == segmentation[iz,iy,ix-1]: surface = True
-                if iz < zres - 1 and not label == segmentation[iz+1,iy,ix]: surface = True
-                if iy < yres - 1 and not label == segmentation[iz,iy+1,ix]: surface = True
-                if ix < xres - 1 and not label == segmentation[iz,iy,ix+1]: surface = True
+    # split the sorted indices into one array per label
+    labels, starts = np.unique(voxel_labels, return_index=True)
+    ends = np.append(starts[1:], voxel_labels.size)
 
-                # add to the list of surfaces
-                if surface: surfaces.append((iz, iy, ix))
+    surfaces_per_label = {}
+    for label, start, end in zip(labels, starts, ends):
+        surfaces_per_label[int(label)] = voxel_indices[start:end]
 
-    return surfaces, labels
+    return surfaces_per_label
 
 
 
-def GenerateSurfacesPerBlock(data, iz, iy, ix):
+def GenerateSurfacesPerBlock(data, iz, iy, ix, segmentation = None):
     # start timing statistics
     total_time = time.time()
 
-    # read in the segmentation for this block
+    # read in the segmentation for this block if it is not already in memory
     read_time = time.time()
-    segmentation = data.ReadSegmentationBlock(iz, iy, ix)
+    if segmentation is None: segmentation = data.ReadSegmentationBlock(iz, iy, ix)
     read_time = time.time() - read_time
 
     surface_time = time.time()
-    surfaces, labels = ProduceSurfacesFromSegmentation(segmentation)
-
-    # create a dictionary of labels to surface lists
-    surfaces_per_label = {}
-    for label in labels:
-        surfaces_per_label[label] = []
-
-    # get the size of this block
-    zres, yres, xres = segmentation.shape
-
-    # update all surface lists
-    for (ik, ij, ii) in surfaces:
-        label = segmentation[ik, ij, ii]
-
-        # convert to linear index
-        voxel_index = ik * yres * xres + ij * yres + ii
-        surfaces_per_label[label].append(voxel_index)
-
+    surfaces_per_label = ProduceSurfacesFromSegmentation(segmentation)
     surface_time = time.time() - surface_time
 
-    # write the surfaces to
+    # write the surfaces of all labels to one indexed file
     write_time = time.time()
 
     # get the tmp filename
     tmp_directory = data.TempBlockDirectory(iz, iy, ix)
-    surface_directory = '{}/surfaces'.format(tmp_directory)
-    if not os.path.exists(surface_directory):
-        os.makedirs(surface_directory, exist_ok=True)
+    if not os.path.exists(tmp_directory):
+        os.makedirs(tmp_directory, exist_ok=True)
 
-    for label in sorted(surfaces_per_label.keys()):
-        surface_filename = '{}/{:016d}.pts'.format(surface_directory, label)
-
-        # write each points file independently
-        WritePtsFile(data, surface_filename, {label: surfaces_per_label[label]}, (iz, iy, ix), input_local_indices = True)
+    surface_filename = '{}/surfaces.pts'.format(tmp_directory)
+    WritePtsFile(data, surface_filename, surfaces_per_label, (iz, iy, ix), input_local_indices = True, indexed = True)
 
     write_time = time.time() - write_time
 
@@ -109,6 +94,16 @@ def GenerateSurfacesPerBlock(data, iz, iy, ix):
 
 
 
+def CreateSurfaceFile(data, surface_filename, label, nvoxels):
+    # write the header and make room for all of the global and local indices and the checksum
+    fd = open(surface_filename, 'wb')
+    np.array(data.VolumeSize() + data.BlockSize() + (1, label, nvoxels), dtype=np.int64).tofile(fd)
+    fd.truncate(8 * (9 + 2 * nvoxels + 1))
+
+    return fd
+
+
+
 def CombineSurfaceVoxels(data):
     # start timing statistics
     total_time = time.time()
@@ -118,28 +113,70 @@ def CombineSurfaceVoxels(data):
     if not os.path.exists(surface_directory):
         os.makedirs(surface_directory, exist_ok=True)
 
-    # iterate over all labels
-    for label in range(1, data.NLabels()):
-        global_indices = []
-
-        # iterate over all blocks and read the points
-        for iz in range(data.StartZ(), data.EndZ()):
-            for iy in range(data.StartY(), data.EndY()):
-                for ix in range(data.StartX(), data.EndX()):
-                    tmp_block_directory = data.TempBlockDirectory(iz, iy, ix)
-
-                    block_surface_filename = '{}/surfaces/{:016d}.pts'.format(tmp_block_directory, label)
-
-                    # skip if this file does not exist (this label does not occur in this block)
-                    if not os.path.exists(block_surface_filename): continue
+    # get the number of surface voxels of each label from the label tables of the block files
+    nvoxels_per_label = {}
+    for iz in range(data.StartZ(), data.EndZ()):
+        for iy in range(data.StartY(), data.EndY()):
+            for ix in range(data.StartX(), data.EndX()):
+                block_surface_filename = '{}/surfaces.pts'.format(data.TempBlockDirectory(iz, iy, ix))
 
-                    global_block_indices, _ = ReadPtsFile(data, block_surface_filename)
+                for label, (_, nvoxels) in ReadPtsFileIndex(data, block_surface_filename).items():
+                    nvoxels_per_label[label] = nvoxels_per_label.get(label, 0) + nvoxels
 
-                    global_indices += global_block_indices[label]
+    # the header of every output file is the volume size, block size, one label, and the label chapter
+    header_size = 9 * 8
 
-        if len(global_indices):
+    # stream through the blocks once and write the indices of every label into place
+    # the most recently written files stay open and each file is closed once complete
+    nwritten_per_label = {}
+    checksums_per_label = {}
+    surface_files = OrderedDict()
+    for iz in range(data.StartZ(), data.EndZ()):
+        for iy in range(data.StartY(), data.EndY()):
+            for ix in range(data.StartX(), data.EndX()):
+                block_surface_filename = '{}/surfaces.pts'.format(data.TempBlockDirectory(iz, iy, ix))
+
+                global_block_indices, local_block_indices = ReadPtsFile(data, block_surface_filename)
+
+                for label in global_block_indices.keys():
+                    nvoxels = nvoxels_per_label[label]
+                    nwritten = nwritten_per_label.get(label, 0)
+                    nblock_voxels = global_block_indices[label].size
+
+                    # create the output file with the first block of this label or reopen it if it was closed
+                    if label in surface_files:
+                        surface_files.move_to_end(label)
+                    else:
+                        if len(surface_files) == SURFACE_FILES_CACHE_SIZE: surface_files.popitem(last=False)[1].close()
+                        surface_filename = '{}/{:016d}.pts'.format(surface_directory, label)
+                        if not nwritten: surface_files[label] = CreateSurfaceFile(data, surface_filename, label, nvoxels)
+                        else: surface_files[label] = open(surface_filename, 'r+b')
+                    fd = surface_files[label]
+
+                    # the local indices in the block are the local indices of the same global indices
+                    fd.seek(header_size + 8 * nwritten)
+                    global_block_indices[label].tofile(fd)
+                    fd.seek(header_size + 8 * (nvoxels + nwritten))
+                    local_block_indices[label].tofile(fd)
+
+                    nwritten_per_label[label] = nwritten + nblock_voxels
+
+                    # the checksum wraps around like the c++ code
+                    checksums_per_label[label] = np.sum(np.array([checksums_per_label.get(label, 0), np.sum(global_block_indices[label]), np.sum(local_block_indices[label])], dtype=np.int64))
+
+                    # write the checksum at the end of the file once all of its indices are in place
+                    if nwritten_per_label[label] == nvoxels:
+                        fd.seek(header_size + 16 * nvoxels)
+                        np.array([checksums_per_label[label]], dtype=np.int64).tofile(fd)
+                        surface_files.pop(label).close()
+
+    # every file is complete and labels without voxels only need the header and a zero checksum
+    for label, nvoxels in nvoxels_per_label.items():
+        assert (nwritten_per_label.get(label, 0) == nvoxels)
+
+        if not nvoxels:
             surface_filename = '{}/{:016d}.pts'.format(surface_directory, label)
-            WritePtsFile(data, surface_filename, { label: global_indices }, input_local_indices = False)
+            CreateSurfaceFile(data, surface_filename, label, nvoxels).close()
 
     total_time = time.time() - total_time
 
@@ -153,10 +190,32 @@ def CollectSurfacesSequentially(meta_filename):
 
     assert (not data.SurfacesDirectory() == None)
 
-    # compute the first step to save the walls of each file
-    for iz in range(data.StartZ(), data.EndZ()):
-        for iy in range(data.StartY(), data.EndY()):
-            for ix in range(data.StartX(), data.EndX()):
-                GenerateSurfacesPerBlock(data, iz, iy, ix)
+    # compute the first step to save the surfaces of each block unless hole filling wrote them
+    if not 'surfaces' in data.HoleFillingPostFill():
+        for iz in range(data.StartZ(), data.EndZ()):
+            for iy in range(data.StartY(), data.EndY()):
+                for ix in range(data.StartX(), data.EndX()):
+                    GenerateSurfacesPerBlock(data, iz, iy, ix)
 
     CombineSurfaceVoxels(data)
+
+
+
+def CollectSurfacesInParallel(meta_filename, nprocesses=None):
+    # read in the data for this block
+    data = ReadMetaData(meta_filename)
+
+    assert (not data.SurfacesDirectory() == None)
+
+    tasks = {}
+    blocks = Blocks(data)
+
+    # the surfaces of each block have no dependencies (hole filling may have written them already)
+    if not 'surfaces' in data.HoleFillingPostFill():
+        for block in blocks:
+            tasks[('surfaces',) + block] = (GenerateSurfacesPerBlock, block, [])
+
+    # combining needs the surfaces from every block
+    tasks[('combine',)] = (CombineSurfaceVoxels, (), [key for key in tasks if key[0] == 'surfaces'])
+
+    ExecuteTasks(meta_filename, tasks, nprocesses)
@@ -1,5 +1,4 @@
 import os
-import math
 
 
 
@@ -9,87 +8,123 @@ import scipy.spatial
 
 
 from blockbased_synapseaware.utilities.dataIO import ReadMetaData, ReadPtsFile, WritePtsFile
+from blockbased_synapseaware.utilities.scheduler import MapTasks
 from blockbased_synapseaware.utilities.constants import *
 
 
 
-def ConvertSynapsesAndProject(meta_filename, input_synapse_directory, xyz, conversion_rate):
-    data = ReadMetaData(meta_filename)
+def ReadSynapseFile(filename, xyz, conversion_rate):
+    # read the coordinates of all synapses at once (empty files have no synapses)
+    if not os.path.getsize(filename): return np.zeros((0, 3), dtype=np.int64)
+    coordinates = np.loadtxt(filename, dtype=np.int64, usecols=(0, 1, 2), ndmin=2)
+
+    # use order 2, 1, 0 to convert from xyz to zyx
+    if xyz: coordinates = coordinates[:,::-1]
+
+    # round half to even like the python round function
+    return np.round(coordinates / np.array(conversion_rate, dtype=np.float64)).astype(np.int64)
 
+
+
+def ProjectSynapses(data, surface, surface_point_cloud, synapse_indices, workers = -1):
     resolution = data.Resolution()
 
-    # create an empty set of synapses
-    synapses = {}
-
-    # iterate over all labels
-    for label in range(1, data.NLabels()):
-        # read the surfaces for this label
-        surface_filename = '{}/{:016d}.pts'.format(data.SurfacesDirectory(), label)
-        # some surfaces (i.e., labels) will not exist in the volume
-        if not os.path.exists(surface_filename): continue
-
-        # read in the surface points, ignore the local coordinates
-        surfaces, _ = ReadPtsFile(data, surface_filename)
-        surface = surfaces[label]
-
-        npts = len(surface)
-        surface_point_cloud = np.zeros((npts, 3), dtype=np.int32)
-
-        for index, iv in enumerate(surface):
-            iz, iy, ix = data.GlobalIndexToIndices(iv)
-
-            surface_point_cloud[index,:] = (iz * resolution[OR_Z], iy * resolution[OR_Y], ix * resolution[OR_X])
-
-        # create an empty array for the synapses
-        synapses[label] = []
-
-        projected = 0
-        missed = 0
-
-        # read in the original synapses
-        input_synapse_filename = '{}/syn_{:04}.txt'.format(input_synapse_directory, label)
-        if os.path.exists(input_synapse_filename):
-            with open(input_synapse_filename, 'r') as fd:
-                for line in fd:
-                    # separate the line into coordinates
-                    coordinates = line.strip().split()
-                    
-                    if xyz:
-                        ix = round(int(coordinates[0]) / conversion_rate[OR_X])
-                        iy = round(int(coordinates[1]) / conversion_rate[OR_Y])
-                        iz = round(int(coordinates[2]) / conversion_rate[OR_Z])
-                    else:
-                        iz = round(int(coordinates[0]) / conversion_rate[OR_Z])
-                        iy = round(int(coordinates[1]) / conversion_rate[OR_Y])
-                        ix = round(int(coordinates[2]) / conversion_rate[OR_X])
-
-                    # create a 2D vector for this point
-                    vec = np.zeros((1, 3), dtype=np.int32)
-                    vec[0,:] = (iz * resolution[OR_Z], iy * resolution[OR_Y], ix * resolution[OR_X])
-
-                    closest_point = surface[scipy.spatial.distance.cdist(surface_point_cloud, vec).argmin()]
-
-                    closest_iz, closest_iy, closest_ix = data.GlobalIndexToIndices(closest_point)
-
-                    deltaz = resolution[OR_Z] * (iz - closest_iz)
-                    deltay = resolution[OR_Y] * (iy - closest_iy)
-                    deltax = resolution[OR_X] * (ix - closest_ix)
-
-                    distance = math.sqrt(deltaz * deltaz + deltay * deltay + deltax * deltax)
-
-                    # skip distances that are clearly off (over 200 nanometers)
-                    max_deviation = 800
-                    if distance < max_deviation:
-                        # add to the list of valid synapses
-                        synapses[label].append(closest_point)
-                        projected += 1
-                    else:
-                        missed += 1
-
-                print ('Synapses within {} nanometers from surface: {}'.format(max_deviation, projected))
-                print ('Synapses over {} nanometers from surface: {}'.format(max_deviation, missed))
+    # get the location of every synapse in nanometers
+    synapse_point_cloud = (synapse_indices * np.array(resolution)).astype(np.int32)
+
+    # find the closest surface point of all synapses at once
+    surface_tree = scipy.spatial.cKDTree(surface_point_cloud)
+    closest = np.zeros(len(synapse_point_cloud), dtype=np.int64)
+
+    # of several equally close surface points take the first one in the surface file
+    # the squared distances between the integer locations are exact so ties are found among the nearest candidates,
+    # and the synapses whose farthest candidate still ties query again with twice as many candidates
+    # (the tree only orders equal squared distances correctly while they are below 2^52, i.e., distances below 67 millimeters)
+    remaining = np.arange(len(synapse_point_cloud))
+    ncandidates = 4
+    while remaining.size:
+        ncandidates = min(ncandidates, len(surface_point_cloud))
+        _, candidates = surface_tree.query(synapse_point_cloud[remaining], k=ncandidates, workers=workers)
+        candidates = candidates.reshape(remaining.size, ncandidates)
+
+        offsets = surface_point_cloud[candidates].astype(np.int64) - synapse_point_cloud[remaining,np.newaxis,:].astype(np.int64)
+        squared_distances = np.sum(offsets * offsets, axis=2)
+        minimum = squared_distances.min(axis=1)
+
+        # take the lowest surface index among the candidates at the minimum distance
+        closest[remaining] = np.where(squared_distances == minimum[:,np.newaxis], candidates, len(surface_point_cloud)).min(axis=1)
+
+        # candidates are in order of distance so all ties are found once the farthest one is not tied
+        unresolved = (squared_distances[:,-1] == minimum) & (ncandidates < len(surface_point_cloud))
+        remaining = remaining[unresolved]
+        ncandidates *= 2
+
+    closest_points = np.asarray(surface, dtype=np.int64)[closest]
+    closest_iz, closest_iy, closest_ix = data.GlobalIndexToIndices(closest_points)
+
+    deltaz = resolution[OR_Z] * (synapse_indices[:,OR_Z] - closest_iz)
+    deltay = resolution[OR_Y] * (synapse_indices[:,OR_Y] - closest_iy)
+    deltax = resolution[OR_X] * (synapse_indices[:,OR_X] - closest_ix)
+
+    distances = np.sqrt(deltaz * deltaz + deltay * deltay + deltax * deltax)
+
+    # skip distances that are clearly off (over 800 nanometers)
+    max_deviation = 800
+    projected = distances < max_deviation
+
+    print ('Synapses within {} nanometers from surface: {}'.format(max_deviation, np.count_nonzero(projected)))
+    print ('Synapses over {} nanometers from surface: {}'.format(max_deviation, np.count_nonzero(~projected)))
+
+    # return the valid synapses
+    return closest_points[projected]
+
+
+
+def ProjectLabelSynapses(data, label, input_synapse_directory, xyz, conversion_rate, workers):
+    resolution = data.Resolution()
+
+    # read the surfaces for this label
+    surface_filename = '{}/{:016d}.pts'.format(data.SurfacesDirectory(), label)
+    # some surfaces (i.e., labels) will not exist in the volume
+    if not os.path.exists(surface_filename): return None
+
+    # read in the surface points, ignore the local coordinates
+    surfaces, _ = ReadPtsFile(data, surface_filename, label = label)
+    surface = surfaces[label]
+
+    # get the location of every surface point in nanometers
+    surface_iz, surface_iy, surface_ix = data.GlobalIndexToIndices(surface)
+    surface_point_cloud = np.stack((surface_iz * resolution[OR_Z], surface_iy * resolution[OR_Y], surface_ix * resolution[OR_X]), axis=1).astype(np.int32)
+
+    # read in the original synapses
+    input_synapse_filename = '{}/syn_{:04}.txt'.format(input_synapse_directory, label)
+    if not os.path.exists(input_synapse_filename): return np.zeros(0, dtype=np.int64)
+
+    synapse_indices = ReadSynapseFile(input_synapse_filename, xyz, conversion_rate)
+
+    return ProjectSynapses(data, surface, surface_point_cloud, synapse_indices, workers)
+
+
+
+def DivideSynapsesIntoBlocks(data, synapses, synapse_labels):
+    # get the block of every synapse from the global coordinates
+    global_iz, global_iy, global_ix = data.GlobalIndexToIndices(synapses)
+
+    block_iz = global_iz // data.BlockZLength()
+    block_iy = global_iy // data.BlockYLength()
+    block_ix = global_ix // data.BlockXLength()
+
+    # sort the synapses by block and label (lexsort is stable so the synapses of a label keep their order)
+    order = np.lexsort((synapse_labels, block_ix, block_iy, block_iz))
+    keys = np.stack((block_iz, block_iy, block_ix, synapse_labels), axis=1)[order]
+    synapses = synapses[order]
+
+    # find the first synapse of every block and label pair
+    first = np.ones(synapses.size, dtype=bool)
+    first[1:] = np.any(keys[1:] != keys[:-1], axis=1)
+    starts = np.flatnonzero(first)
+    ends = np.append(starts[1:], synapses.size)
 
-    # divide all synapses into blocks
     synapses_per_block = {}
 
     # iterate over all blocks
@@ -99,23 +134,42 @@ def ConvertSynapsesAndProject(meta_filename, input_synapse_directory, xyz, conve
                 # create empty synapses_per_block dictionaries whose keys will be labels
                 synapses_per_block[(iz, iy, ix)] = {}
 
-    # for every label, iterate over the discovered synapses
-    for label in synapses.keys():
-        synapses_per_label = synapses[label]
+    for start, end in zip(starts, ends):
+        iz, iy, ix, label = (int(value) for value in keys[start])
 
-        # iterate over all of the projected synapses
-        for global_index in synapses_per_label:
-            global_iz, global_iy, global_ix = data.GlobalIndexToIndices(global_index)
+        synapses_per_block[(iz, iy, ix)][label] = synapses[start:end]
 
-            block_iz = global_iz // data.BlockZLength()
-            block_iy = global_iy // data.BlockYLength()
-            block_ix = global_ix // data.BlockXLength()
+    return synapses_per_block
 
-            # create the array for this label per block if it does not exist
-            if not label in synapses_per_block[(block_iz, block_iy, block_ix)]:
-                synapses_per_block[(block_iz, block_iy, block_ix)][label] = []
 
-            synapses_per_block[(block_iz, block_iy, block_ix)][label].append(global_index)
+
+def ConvertSynapsesAndProject(meta_filename, input_synapse_directory, xyz, conversion_rate, nprocesses=None):
+    data = ReadMetaData(meta_filename)
+
+    if nprocesses is None: nprocesses = os.cpu_count()
+
+    # each label is projected in one process so only sequential runs use all cores for the kd-tree queries
+    workers = -1 if nprocesses == 1 else 1
+
+    # project the synapses of all labels in parallel
+    labels = list(range(1, data.NLabels()))
+    arguments = [(label, input_synapse_directory, xyz, conversion_rate, workers) for label in labels]
+    projected_synapses = MapTasks(meta_filename, ProjectLabelSynapses, arguments, nprocesses)
+
+    # create one array of synapses and their labels for the labels that exist in the volume
+    synapses = [np.zeros(0, dtype=np.int64)]
+    synapse_labels = [np.zeros(0, dtype=np.int64)]
+    for label, label_synapses in zip(labels, projected_synapses):
+        if label_synapses is None: continue
+
+        synapses.append(label_synapses)
+        synapse_labels.append(np.full(label_synapses.size, label, dtype=np.int64))
+
+    synapses = np.concatenate(synapses)
+    synapse_labels = np.concatenate(synapse_labels)
+
+    # divide all synapses into blocks
+    synapses_per_block = DivideSynapsesIntoBlocks(data, synapses, synapse_labels)
 
     # write all of the synapse block files
     synapse_directory = data.SynapseDirectory()
@@ -127,5 +181,5 @@ def ConvertSynapsesAndProject(meta_filename, input_synapse_directory, xyz, conve
             for ix in range(data.StartX(), data.EndX()):
                 synapse_filename = '{}/{:04d}z-{:04d}y-{:04d}x.pts'.format(synapse_directory, iz, iy, ix)
 
-                # write the pts file (use global indices)
-                WritePtsFile(data, synapse_filename, synapses_per_block[(iz, iy, ix)], input_local_indices = False)
+                # write the pts file (use global indices) with a label table for random access
+                WritePtsFile(data, synapse_filename, synapses_per_block[(iz, iy, ix)], input_local_indices = False, indexed = True)